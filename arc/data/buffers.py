@@ -0,0 +1,132 @@
+"""Receive buffers for streaming data"""
+
+from typing import List, Optional, Tuple
+import socket
+import struct
+
+from websocket import ABNF, WebSocket, WebSocketProtocolException
+
+
+class RecvRing:
+    """A ring of reusable receive buffers
+
+    Buffers are handed out in order and reused once the ring wraps around, so anything viewing a buffer is only
+    valid until `size` more buffers have been taken.
+    """
+
+    buffers: List[bytearray]
+    index: int
+
+    def __init__(self, size: int, capacity: int = 0) -> None:
+        """Create a RecvRing
+
+        Args:
+            size (int): Number of buffers in the ring
+            capacity (int, optional): Initial capacity of each buffer in bytes. Defaults to 0.
+        """
+        if size < 1:
+            raise ValueError("ring size must be at least 1")
+        self.buffers = [bytearray(capacity) for _ in range(size)]
+        self.index = 0
+
+    def take(self, nbytes: int) -> memoryview:
+        """Take the next buffer in the ring, growing it if needed
+
+        Args:
+            nbytes (int): Number of bytes needed
+
+        Returns:
+            memoryview: A writable view of exactly `nbytes`
+        """
+        buf = self.buffers[self.index]
+        if len(buf) < nbytes:
+            # grow with headroom so slightly larger batches don't reallocate every time around the ring
+            buf = bytearray(max(nbytes, len(buf) * 2))
+            self.buffers[self.index] = buf
+        self.index = (self.index + 1) % len(self.buffers)
+        return memoryview(buf)[:nbytes]
+
+    def give_back(self) -> None:
+        """Return the last buffer taken so the next `take` reuses it, once nothing views it any more"""
+        self.index = (self.index - 1) % len(self.buffers)
+
+
+def _recv_into(sock: socket.socket, view: memoryview) -> None:
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("socket closed while receiving")
+        view = view[n:]
+
+
+def _recv_exact(sock: socket.socket, nbytes: int) -> bytes:
+    buf = bytearray(nbytes)
+    _recv_into(sock, memoryview(buf))
+    return bytes(buf)
+
+
+def _recv_header(sock: socket.socket) -> Tuple[bool, int, int]:
+    b1, b2 = _recv_exact(sock, 2)
+    if b1 & 0x70:
+        raise WebSocketProtocolException("websocket extensions are not supported")
+    if b2 & 0x80:
+        raise WebSocketProtocolException("server frames must not be masked")
+
+    length = b2 & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", _recv_exact(sock, 2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", _recv_exact(sock, 8))
+
+    return bool(b1 & 0x80), b1 & 0x0F, length
+
+
+def recv_message(ws: WebSocket, ring: Optional[RecvRing] = None) -> Tuple[int, memoryview]:
+    """Receive a websocket message directly into a single buffer
+
+    Unlike `WebSocket.recv_data`, which joins socket chunks into a new bytes object, the payload is read straight
+    from the socket into its final buffer, so each message is allocated at most once.
+
+    Args:
+        ws (WebSocket): A connected websocket
+        ring (RecvRing, optional): Ring of buffers to receive into. Defaults to None, which allocates per message.
+
+    Returns:
+        Tuple[int, memoryview]: The opcode and the message payload
+    """
+    sock = ws.sock
+    opcode: Optional[int] = None
+    payload: Optional[memoryview] = None
+
+    while True:
+        fin, frame_opcode, length = _recv_header(sock)
+
+        if frame_opcode == ABNF.OPCODE_PING:
+            ws.pong(_recv_exact(sock, length))
+            continue
+
+        if frame_opcode == ABNF.OPCODE_PONG:
+            _recv_exact(sock, length)
+            continue
+
+        if frame_opcode == ABNF.OPCODE_CLOSE:
+            _recv_exact(sock, length)
+            ws.send_close()
+            return frame_opcode, memoryview(b"")
+
+        if frame_opcode != ABNF.OPCODE_CONT:
+            opcode = frame_opcode
+            payload = ring.take(length) if ring is not None else memoryview(bytearray(length))
+            _recv_into(sock, payload)
+        else:
+            if payload is None:
+                raise WebSocketProtocolException("continuation frame without a message")
+            # fragmented messages are rare, grow into a fresh buffer
+            prev = payload
+            size = len(prev) + length
+            payload = ring.take(size) if ring is not None else memoryview(bytearray(size))
+            payload[: len(prev)] = prev
+            _recv_into(sock, payload[len(prev) :])
+
+        if fin:
+            return opcode, payload  # type: ignore
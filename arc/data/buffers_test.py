@@ -0,0 +1,67 @@
+import socket
+
+import numpy as np
+from websocket import ABNF
+
+from arc.data.buffers import RecvRing, recv_message
+from arc.data.encoding import encode_message, decode_message
+from arc.data.shapes.image import ImageData
+
+
+class FakeWebSocket:
+    """The parts of a websocket used by recv_message"""
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.pongs = []
+
+    def pong(self, payload: bytes) -> None:
+        self.pongs.append(payload)
+
+    def send_close(self) -> None:
+        pass
+
+
+def _frame(data: bytes, opcode: int = ABNF.OPCODE_BINARY, fin: int = 1) -> bytes:
+    return ABNF(fin, 0, 0, 0, opcode, 0, data).format()
+
+
+def test_ring():
+    ring = RecvRing(2)
+    a = ring.take(10)
+    b = ring.take(4)
+    c = ring.take(8)
+    assert len(a) == 10 and len(b) == 4 and len(c) == 8
+    # wraps around onto the first buffer without reallocating
+    assert c.obj is a.obj
+
+    ring.give_back()
+    assert ring.take(6).obj is a.obj
+
+
+def test_recv_message():
+    server, client = socket.socketpair()
+    ws = FakeWebSocket(client)
+    ring = RecvRing(2)
+
+    x = ImageData(np.random.rand(3, 784), 28, 28, 1, 3)
+    msg = encode_message({"x": x}, end=False)
+
+    server.sendall(_frame(b"hi", ABNF.OPCODE_PING))
+    server.sendall(_frame(msg))
+    half = len(msg) // 2
+    server.sendall(_frame(msg[:half], fin=0) + _frame(msg[half:], ABNF.OPCODE_CONT))
+
+    for _ in range(2):
+        opcode, data = recv_message(ws, ring)
+        assert opcode == ABNF.OPCODE_BINARY
+        assert bytes(data) == msg
+
+        _, parts = decode_message(data, {"x": ImageData}, copy=False)
+        assert np.array_equal(parts["x"].data, x.data)
+        assert parts["x"].data.base is not None
+
+    assert ws.pongs == [b"hi"]
+
+    server.close()
+    client.close()
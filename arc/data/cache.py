@@ -1,7 +1,13 @@
 """Cache data"""
 
-from typing import Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterator, Mapping, Optional
+import hashlib
+import mmap
 import os
+import struct
+import threading
 from urllib.parse import urlparse
 import urllib.request
 import shutil
@@ -10,8 +16,22 @@ import logging
 import gzip
 
 import boto3
+import numpy as np
 from xdg import xdg_data_home
 
+from arc.data.encoding import Buffer
+from arc.data.memmap import cached_arrays
+
+DEFAULT_FRAME_CACHE_BYTES = 128 * 2**20
+FRAME_CACHE_BYTES_ENV = "ARC_FRAME_CACHE_BYTES"
+FRAME_CACHE_SPILL_ENV = "ARC_FRAME_CACHE_SPILL_DIR"
+DEFAULT_EPOCH_CACHE_BYTES = 8 * 2**30
+EPOCH_CACHE_BYTES_ENV = "ARC_EPOCH_CACHE_BYTES"
+EPOCH_CACHE_DIR_ENV = "ARC_EPOCH_CACHE_DIR"
+
+_SEGMENT_SUFFIX = ".segment"
+_LENGTH = struct.Struct("<I")
+
 # Local caching
 
 # Kubernetes caching
@@ -104,6 +124,18 @@ class ResourceCache:
             return self.save(uri)
         raise ValueError(f"resource {uri} not in cache and 'download' parameter is false")
 
+    def arrays(self, name: str, build: Callable[[], Mapping[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        """Get a parsed dataset as memory mapped arrays, if not present then build and save it
+
+        Args:
+            name (str): Name of the dataset, include a version if its parsing can change e.g. "mnist-v1"
+            build (Callable[[], Mapping[str, np.ndarray]]): Parses the dataset into arrays by name
+
+        Returns:
+            Dict[str, np.ndarray]: Read only memory mapped arrays by name
+        """
+        return cached_arrays(os.path.join(self.base_path, "arrays", name), build)
+
     def clear(self) -> None:
         """Clear the cache"""
 
@@ -136,3 +168,416 @@ class ResourceCache:
                 if filename.endswith(ext):
                     return True
         return False
+
+
+@dataclass
+class FrameCacheStats:
+    """Counters for a FrameCache"""
+
+    hits: int = 0
+    """Lookups found in memory or on disk"""
+
+    misses: int = 0
+    """Lookups not found"""
+
+    evictions: int = 0
+    """Frames evicted from memory, spilled or dropped"""
+
+    spills: int = 0
+    """Frames written to disk on eviction"""
+
+    spill_hits: int = 0
+    """Hits read back from disk"""
+
+    bytes: int = 0
+    """Bytes held in memory"""
+
+    spill_bytes: int = 0
+    """Bytes held on disk"""
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups that were hits"""
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "spills": self.spills,
+            "spill_hits": self.spill_hits,
+            "bytes": self.bytes,
+            "spill_bytes": self.spill_bytes,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class FrameCache:
+    """In memory LRU cache of encoded frames with a byte budget
+
+    When a spill directory is given, frames evicted from memory are written there, up to their own byte budget, and
+    moved back into memory when they are hit again. It is safe to share between the threads streams are produced on.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_FRAME_CACHE_BYTES,
+        spill_dir: Optional[str] = None,
+        max_spill_bytes: Optional[int] = None,
+    ) -> None:
+        """Create a FrameCache
+
+        Args:
+            max_bytes (int, optional): Bytes of frames to keep in memory. Defaults to DEFAULT_FRAME_CACHE_BYTES.
+            spill_dir (str, optional): Directory to spill evicted frames to. Defaults to None, which drops them.
+            max_spill_bytes (int, optional): Bytes of frames to keep on disk. Defaults to None, which is 8 times
+                `max_bytes`.
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes if max_spill_bytes is not None else 8 * max_bytes
+        self.stats = FrameCacheStats()
+        self._frames: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._spilled: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._lock = threading.RLock()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["FrameCache"]:
+        """Create a FrameCache configured by the ARC_FRAME_CACHE_BYTES and ARC_FRAME_CACHE_SPILL_DIR variables
+
+        Returns:
+            Optional[FrameCache]: The cache, or None if its budget is 0
+        """
+        max_bytes = int(os.getenv(FRAME_CACHE_BYTES_ENV, DEFAULT_FRAME_CACHE_BYTES))
+        if max_bytes <= 0:
+            return None
+        return cls(max_bytes, os.getenv(FRAME_CACHE_SPILL_ENV))
+
+    def __len__(self) -> int:
+        return len(self._frames) + len(self._spilled)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """Get a frame, marking it as recently used
+
+        Args:
+            key (Hashable): Key of the frame
+
+        Returns:
+            Optional[bytes]: The frame, or None if it isn't cached
+        """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: Hashable) -> Optional[bytes]:
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            self.stats.hits += 1
+            return frame
+
+        if key in self._spilled:
+            path = self._spill_path(key)
+            with open(path, "rb") as f:
+                frame = f.read()
+            self._unspill(key)
+            self.stats.hits += 1
+            self.stats.spill_hits += 1
+            self._put(key, frame)
+            return frame
+
+        self.stats.misses += 1
+        return None
+
+    def put(self, key: Hashable, frame: bytes) -> None:
+        """Cache a frame, evicting the least recently used ones to stay within budget
+
+        Frames larger than the whole budget aren't cached.
+
+        Args:
+            key (Hashable): Key of the frame
+            frame (bytes): The encoded frame
+        """
+        with self._lock:
+            self._put(key, frame)
+
+    def _put(self, key: Hashable, frame: bytes) -> None:
+        if key in self._spilled:
+            self._unspill(key)
+        if len(frame) > self.max_bytes:
+            return
+        old = self._frames.pop(key, None)
+        if old is not None:
+            self.stats.bytes -= len(old)
+        self._frames[key] = frame
+        self.stats.bytes += len(frame)
+
+        while self.stats.bytes > self.max_bytes:
+            evicted_key, evicted = self._frames.popitem(last=False)
+            self.stats.bytes -= len(evicted)
+            self.stats.evictions += 1
+            self._spill(evicted_key, evicted)
+
+    def clear(self) -> None:
+        """Drop every frame, including spilled ones"""
+        with self._lock:
+            for key in list(self._spilled):
+                self._unspill(key)
+            self._frames.clear()
+            self.stats.bytes = 0
+
+    def _spill_path(self, key: Hashable) -> str:
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(str(self.spill_dir), f"{name}.frame")
+
+    def _spill(self, key: Hashable, frame: bytes) -> None:
+        if self.spill_dir is None or len(frame) > self.max_spill_bytes:
+            return
+        if key in self._spilled:
+            self._unspill(key)
+        while self._spilled and self.stats.spill_bytes + len(frame) > self.max_spill_bytes:
+            self._unspill(next(iter(self._spilled)))
+
+        with open(self._spill_path(key), "wb") as f:
+            f.write(frame)
+        self._spilled[key] = len(frame)
+        self.stats.spill_bytes += len(frame)
+        self.stats.spills += 1
+
+    def _unspill(self, key: Hashable) -> None:
+        self.stats.spill_bytes -= self._spilled.pop(key)
+        try:
+            os.remove(self._spill_path(key))
+        except FileNotFoundError:
+            pass
+
+
+@dataclass
+class EpochCacheStats:
+    """Counters for an EpochCache"""
+
+    hits: int = 0
+    """Epochs replayed from disk"""
+
+    misses: int = 0
+    """Epochs not found"""
+
+    segments: int = 0
+    """Segments written"""
+
+    evictions: int = 0
+    """Segments removed to stay within budget"""
+
+    bytes_read: int = 0
+    """Bytes of segments replayed"""
+
+    bytes_written: int = 0
+    """Bytes of segments committed"""
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "segments": self.segments,
+            "evictions": self.evictions,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+class SegmentWriter:
+    """Appends a stream's messages to a segment, which only joins the cache once committed"""
+
+    def __init__(self, cache: "EpochCache", path: str) -> None:
+        """Create a SegmentWriter, use `EpochCache.write` instead
+
+        Args:
+            cache (EpochCache): Cache the segment is for
+            path (str): Path of the segment once committed
+        """
+        self.cache = cache
+        self.path = path
+        self.bytes = 0
+        """Bytes written so far"""
+        self._tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file: Optional[Any] = open(self._tmp, "wb")
+
+    def append(self, msg: Buffer) -> None:
+        """Append a message, a segment that outgrows the cache's budget is dropped
+
+        Args:
+            msg (Buffer): The message as received
+        """
+        if self._file is None:
+            return
+        msg = memoryview(msg).cast("B")
+        if self.bytes + _LENGTH.size + len(msg) > self.cache.max_bytes:
+            logging.info(f"epoch is larger than the epoch cache of {self.cache.max_bytes} bytes, not caching it")
+            self.abort()
+            return
+        self._file.write(_LENGTH.pack(len(msg)))
+        self._file.write(msg)
+        self.bytes += _LENGTH.size + len(msg)
+
+    def commit(self) -> None:
+        """Add the segment to the cache, evicting the least recently used ones to stay within budget"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp, self.path)
+        self.cache.stats.segments += 1
+        self.cache.stats.bytes_written += self.bytes
+        self.cache.evict(keep=self.path)
+
+    def abort(self) -> None:
+        """Drop the segment, a no-op once it is committed"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self._tmp)
+        except FileNotFoundError:
+            pass
+
+
+class EpochCache:
+    """On disk LRU cache of the messages of whole epochs, for clients streaming the same epochs again
+
+    Each epoch is a segment file of the messages it was received as, written once in order and committed when the
+    epoch ends, so an interrupted epoch is never replayed. Segments are replayed through a memory map, decoded batches
+    are views over pages read in from disk (copy on write, so they can be modified). Recency is the segment's
+    modification time, which a replay updates, so every client sharing the directory shares one budget and evicts the
+    segments least recently used by any job.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = DEFAULT_EPOCH_CACHE_BYTES) -> None:
+        """Create an EpochCache
+
+        Args:
+            path (str, optional): Directory of the segments. Defaults to None, which is `arc/epochs` in the XDG data
+                home.
+            max_bytes (int, optional): Bytes of segments to keep. Defaults to DEFAULT_EPOCH_CACHE_BYTES.
+        """
+        if path is None:
+            path = os.path.join(str(xdg_data_home()), "arc", "epochs")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = EpochCacheStats()
+        os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "EpochCache":
+        """Create an EpochCache configured by the ARC_EPOCH_CACHE_DIR and ARC_EPOCH_CACHE_BYTES variables
+
+        Returns:
+            EpochCache: The cache
+        """
+        return cls(os.getenv(EPOCH_CACHE_DIR_ENV), int(os.getenv(EPOCH_CACHE_BYTES_ENV, DEFAULT_EPOCH_CACHE_BYTES)))
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Key of a segment from whatever identifies its messages
+
+        Args:
+            *parts (Any): Values with a stable repr e.g. the job URI, version and stream parameters
+
+        Returns:
+            str: The key
+        """
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    def _segment_path(self, key: str) -> str:
+        return os.path.join(self.path, key + _SEGMENT_SUFFIX)
+
+    def read(self, key: str) -> Optional[Iterator[memoryview]]:
+        """Replay a segment, marking it as recently used
+
+        Args:
+            key (str): Key of the segment
+
+        Returns:
+            Optional[Iterator[memoryview]]: The segment's messages, or None if it isn't cached
+        """
+        path = self._segment_path(key)
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return self._messages(mm)
+
+    def _messages(self, mm: mmap.mmap) -> Iterator[memoryview]:
+        # the map stays open while views of it are alive, it is closed when the last one goes
+        buf = memoryview(mm)
+        offset = 0
+        while offset < len(buf):
+            (size,) = _LENGTH.unpack_from(buf, offset)
+            offset += _LENGTH.size
+            self.stats.bytes_read += _LENGTH.size + size
+            yield buf[offset : offset + size]
+            offset += size
+
+    def write(self, key: str) -> SegmentWriter:
+        """Start writing a segment
+
+        Args:
+            key (str): Key of the segment
+
+        Returns:
+            SegmentWriter: Writer to append the messages to and commit at the end of the epoch
+        """
+        return SegmentWriter(self, self._segment_path(key))
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used segments until the cache is within budget
+
+        Args:
+            keep (str, optional): Path of a segment not to remove. Defaults to None.
+        """
+        segments = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(_SEGMENT_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                segments.append((stat.st_mtime, entry.path, stat.st_size))
+
+        total = sum(size for _, _, size in segments)
+        for _, path, size in sorted(segments):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.stats.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        """Remove every segment"""
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(_SEGMENT_SUFFIX):
+                os.remove(entry.path)
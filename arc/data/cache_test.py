@@ -3,7 +3,7 @@ import os
 
 from xdg import xdg_data_home
 
-from arc.data.cache import ResourceCache
+from arc.data.cache import EpochCache, FrameCache, ResourceCache
 
 TEST_CACHE = ResourceCache(base_path=os.path.join(str(xdg_data_home()), "arc-test", "data"))
 
@@ -28,3 +28,81 @@ def test_cache():
     logging.info(f"cached arc QA at {path4}")
 
     cache.clear()
+
+
+def test_frame_cache(tmp_path):
+    cache = FrameCache(max_bytes=30)
+    cache.put("a", b"a" * 10)
+    cache.put("b", b"b" * 10)
+    cache.put("c", b"c" * 10)
+    assert cache.get("a") == b"a" * 10
+
+    # "b" is the least recently used
+    cache.put("d", b"d" * 10)
+    assert cache.get("b") is None
+    assert cache.get("c") is not None and cache.get("d") is not None
+    assert cache.stats.evictions == 1 and cache.stats.misses == 1 and cache.stats.bytes == 30
+
+    # too large to cache at all
+    cache.put("e", b"e" * 31)
+    assert cache.get("e") is None
+
+    spill = FrameCache(max_bytes=20, spill_dir=str(tmp_path), max_spill_bytes=20)
+    for key in "abcd":
+        spill.put(key, key.encode() * 10)
+    assert spill.stats.spills == 2 and len(spill) == 4
+
+    # read back from disk, which spills the least recently used frame in memory in its place
+    assert spill.get("a") == b"a" * 10
+    assert spill.stats.spill_hits == 1 and spill.stats.spills == 3
+
+    # the disk budget drops the oldest spilled frames
+    spill.put("e", b"e" * 10)
+    assert spill.get("b") is None
+    assert spill.stats.spill_bytes <= 20 and len(list(tmp_path.iterdir())) == 2
+    assert spill.stats.repr_json()["hits"] == spill.stats.hits
+
+    spill.clear()
+    assert len(spill) == 0 and list(tmp_path.iterdir()) == []
+
+
+def test_epoch_cache(tmp_path):
+    cache = EpochCache(str(tmp_path), max_bytes=100)
+    assert cache.key("job", 1) == cache.key("job", 1) != cache.key("job", 2)
+    assert cache.read("a") is None
+
+    segment = cache.write("a")
+    segment.append(b"x" * 10)
+    segment.append(memoryview(b"y" * 20))
+    # nothing is replayed until the epoch is committed
+    assert cache.read("a") is None
+    segment.commit()
+    assert [bytes(m) for m in cache.read("a")] == [b"x" * 10, b"y" * 20]
+    assert cache.stats.hits == 1 and cache.stats.misses == 2 and cache.stats.bytes_read == 38
+
+    # replayed messages are copy on write views, changing them doesn't change the segment
+    msg = next(cache.read("a"))
+    msg[0] = ord("z")
+    assert bytes(next(cache.read("a"))) == b"x" * 10
+
+    # aborted and oversized segments are dropped
+    segment = cache.write("b")
+    segment.append(b"b" * 10)
+    segment.abort()
+    segment = cache.write("c")
+    segment.append(b"c" * 101)
+    segment.commit()
+    assert cache.read("b") is None and cache.read("c") is None
+    assert [p.name for p in tmp_path.iterdir()] == ["a.segment"]
+
+    # "a" is older than "d", so it is evicted once "e" doesn't fit beside both
+    os.utime(tmp_path / "a.segment", (0, 0))
+    for key in "de":
+        segment = cache.write(key)
+        segment.append(key.encode() * 30)
+        segment.commit()
+    assert cache.read("a") is None and cache.read("d") is not None and cache.read("e") is not None
+    assert cache.stats.evictions == 1 and cache.stats.segments == 3
+
+    cache.clear()
+    assert list(tmp_path.iterdir()) == []
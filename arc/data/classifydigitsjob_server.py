@@ -1,6 +1,9 @@
 
+import asyncio
+import itertools
 import json
 import logging
+import random
 from typing import Any, Dict
 from dataclasses import dataclass
 import sys
@@ -10,11 +13,45 @@ import os
 
 from simple_parsing import ArgumentParser
 from starlette.applications import Starlette
-from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from starlette.schemas import SchemaGenerator
 import uvicorn
 
-from arc.data.encoding import ShapeEncoder
+from arc.data.cache import FrameCache
+from arc.data.shapes.classes import SampleStrategy
+from arc.data.encoding import ShapeEncoder, TENSOR_CONTENT_TYPE, is_tensor, encode_message
+from arc.data.compression import IDENTITY, Compressor, get_codec, negotiate, compress_response
+from arc.data.pipeline import PipelineStats
+from arc.data.prefetch import AsyncPrefetcher
+from arc.data.workers import BatchWorkers
+from arc.data.stream import (
+    BROADCAST_PARAM,
+    COUNT_PARAM,
+    CURSOR_PARAM,
+    DROP_LAST_PARAM,
+    EPOCHS_PARAM,
+    NUM_SHARDS_PARAM,
+    RESUME_PARAM,
+    SEED_PARAM,
+    SHARD_PARAM,
+    SHM_PARAM,
+    SHUFFLE_PARAM,
+    STRAGGLER_PARAM,
+    STRATEGY_PARAM,
+    SUBSCRIBERS_PARAM,
+    WINDOW_PARAM,
+    BatchSizer,
+    Broadcast,
+    CreditWindow,
+    Cursor,
+    StragglerPolicy,
+    close_stream,
+    encode_stream,
+    length_prefixed,
+    offer_ring,
+    send_stream,
+)
 from arc.model.metrics import Metrics
 from arc.model.types import SupervisedModel, SupervisedModelClient
 from arc.scm import SCM
@@ -24,6 +61,8 @@ from job_test import *
 from arc.data.shapes.image import ImageData
 from arc.data.shapes.classes import ClassData
 
+logging.basicConfig(level=logging.INFO)
+
 parser = ArgumentParser()
 parser.add_arguments(ClassifyDigitsJob.opts(), dest="classifydigitsjob")
 
@@ -44,16 +83,32 @@ uri = os.getenv("JOB_URI")
 print("setting job uri: ", uri)
 job.uri = uri
 
+# keeps encoded batches of the streams that can be asked for again, see FrameCache.from_env
+job.frame_cache = FrameCache.from_env()
+
+# jobs with class labels index them once so class aware batches don't scan them
+job.class_index(BatchType.TRAIN)
+
 global_client_uuid = ""
 
 async def on_start():
     global global_client_uuid
     global_client_uuid = ""
 
-app = Starlette(debug=True, on_startup=[on_start])
+    # batches are produced on worker processes when ARC_BATCH_WORKERS is set, see BatchWorkers.from_env. They are
+    # forked here, in the serving process before it starts any threads
+    job.batch_workers = BatchWorkers.from_env(job)
+    if job.batch_workers is not None:
+        logging.info(f"producing batches on {job.batch_workers.num_workers} worker processes")
+
+async def on_stop():
+    if job.batch_workers is not None:
+        job.batch_workers.close()
+
+app = Starlette(debug=True, on_startup=[on_start], on_shutdown=[on_stop])
 
 schemas = SchemaGenerator(
-    {"openapi": "3.0.0", "info": {"title": "ClassifyDigitsJob", "version": "d946d04-4666563"}}
+    {"openapi": "3.0.0", "info": {"title": "ClassifyDigitsJob", "version": "d8fd511"}}
 )
 
 @app.route("/health")
@@ -62,7 +117,22 @@ def health(request):
 
 @app.route("/info")
 def info(request):
-    return JSONResponse({"version": scm.sha()})
+    frame_cache = job.frame_cache.stats.repr_json() if job.frame_cache is not None else None
+    batch_workers = job.batch_workers.stats.repr_json() if job.batch_workers is not None else None
+    # stage timing of each stream in progress from a job with a pipeline
+    pipeline = {
+        str(stream_id): PipelineStats.merge(list(runs)).repr_json() for stream_id, runs in pipelines.items() if runs
+    }
+    return JSONResponse(
+        {
+            "version": scm.sha(),
+            "augment": job.augment is not None,
+            "repeatable": job.repeatable,
+            "frame_cache": frame_cache,
+            "batch_workers": batch_workers,
+            "pipeline": pipeline,
+        }
+    )
 
 
 @app.route("/description")
@@ -94,54 +164,212 @@ class ShapeJSONResponse(JSONResponse):
         return json.dumps(content, cls=ShapeEncoder).encode('utf-8')
 
 
+# streams shared by several clients, by their parameters
+broadcasts = {}
+
+# stage timing of the pipeline runs each stream in progress came from, by stream id
+pipelines = {}
+stream_ids = itertools.count()
+
+
 # Use websockets...
 @app.websocket_route('/stream')
 async def stream(websocket):
     await websocket.accept()
 
-    # TODO: ugly hack to not deal with concurrency
-    if "client-uuid" not in websocket.headers:
-        raise ValueError("'client-uuid' must be present in headers")
-    client_uuid = websocket.headers["client-uuid"]
-    global global_client_uuid
-    if global_client_uuid == "":
-        global_client_uuid = client_uuid
-    if global_client_uuid != client_uuid:
-        raise ValueError("arc jobs currently do not support multiple clients; create another job for your client")
-
     # Process incoming messages
     params = websocket.query_params
 
-    batch_size = params.get("batch_size", DEFAULT_BATCH_SIZE)
+    batch_size = int(params.get("batch_size", DEFAULT_BATCH_SIZE))
     batch_type = params.get("batch_type", BatchType.TRAIN.value)
+    batches_per_message = int(params.get("batches_per_message", 1))
+    shard = int(params.get(SHARD_PARAM, 0))
+    num_shards = int(params.get(NUM_SHARDS_PARAM, 1))
+    epochs = int(params.get(EPOCHS_PARAM, 1))
+    drop_last = params.get(DROP_LAST_PARAM, "1") != "0"
+    strategy = SampleStrategy(params.get(STRATEGY_PARAM, SampleStrategy.RANDOM.value))
+    shuffle = params.get(SHUFFLE_PARAM, "1") != "0"
+    encoding = None
+    if is_tensor(websocket.headers.get("accept")):
+        encoding = negotiate(websocket.headers.get("accept-encoding"))
+
+    # resumed streams start at the client's cursor, new ones pick the seed of the epochs' permutations
+    if params.get(RESUME_PARAM):
+        cursor = Cursor.parse(params[RESUME_PARAM])
+        logging.info(f"resuming stream from {cursor}")
+    elif not shuffle:
+        cursor = Cursor()
+    elif params.get(SEED_PARAM):
+        cursor = Cursor(seed=int(params[SEED_PARAM]))
+    else:
+        cursor = Cursor(seed=random.randrange(2**31))
+    # a seed the server picked won't be asked for again
+    cache = job.frame_cache if cursor.seed is None or params.get(SEED_PARAM) else None
+    # batches are resized for one client at a time, broadcasts keep theirs
+    sizer = BatchSizer.from_params(params, batch_size) if not params.get(BROADCAST_PARAM) else None
+    pipeline_runs = []
+
+    # the job's generator runs and is encoded on a worker thread so the event loop keeps serving other routes
+    def source():
+        compressor = Compressor(get_codec(encoding)) if encoding is not None else None
+        batches = job.stream_epochs(
+            cursor,
+            epochs,
+            batch_size,
+            BatchType(batch_type),
+            shard,
+            num_shards,
+            drop_last,
+            cache,
+            strategy,
+            sizer,
+            pipeline_runs,
+        )
+        return encode_stream(batches, compressor, batches_per_message)
+
+    global global_client_uuid
+    broadcast = None
+    if params.get(BROADCAST_PARAM):
+        key = (
+            batch_size,
+            batch_type,
+            batches_per_message,
+            shard,
+            num_shards,
+            epochs,
+            drop_last,
+            shuffle,
+            strategy,
+            params.get(SEED_PARAM),
+            encoding,
+        )
+        broadcast = broadcasts.get(key)
+        if broadcast is None or broadcast.done:
+            broadcast = Broadcast(source, subscribers=int(params.get(SUBSCRIBERS_PARAM, 1)))
+            broadcasts[key] = broadcast
+        sub = broadcast.subscribe(StragglerPolicy(params.get(STRAGGLER_PARAM, StragglerPolicy.BLOCK.value)))
+        messages = broadcast.messages(sub)
+    else:
+        # TODO: ugly hack to not deal with concurrency
+        if "client-uuid" not in websocket.headers:
+            raise ValueError("'client-uuid' must be present in headers")
+        client_uuid = websocket.headers["client-uuid"]
+        if global_client_uuid == "":
+            global_client_uuid = client_uuid
+        if global_client_uuid != client_uuid:
+            raise ValueError(
+                "arc jobs only support multiple clients on broadcast streams; create another job for your client"
+            )
+        messages = AsyncPrefetcher(source, size=2)
+
+    stream_id = next(stream_ids)
+    pipelines[stream_id] = pipeline_runs
+    window = CreditWindow(int(params.get(WINDOW_PARAM, 0)))
+    shm_ring = None
+    reader = None
+    try:
+        # clients on this host take the binary messages through shared memory
+        shm_ring = await offer_ring(websocket, params.get(SHM_PARAM))
+        reader = asyncio.create_task(window.read(websocket, sizer))
+        await send_stream(websocket, messages, window, shm_ring)
+    except ConnectionError as e:
+        logging.info(f"client left the stream early: {e}")
+        return
+    finally:
+        if reader is not None:
+            reader.cancel()
+        if shm_ring is not None:
+            logging.info(f"stream sent {shm_ring.messages} messages through shared memory")
+            shm_ring.close()
+        if broadcast is not None:
+            await broadcast.unsubscribe(sub)
+            if not broadcast.subscribers and broadcasts.get(key) is broadcast:
+                del broadcasts[key]
+            logging.info(f"broadcast subscriber dropped {sub.dropped} messages")
+        else:
+            messages.close()
+            # reset the uid to unlock
+            global_client_uuid = ""
+            logging.info(f"stream waited on the job for {messages.stats.empty}/{messages.stats.items} messages")
+        logging.info(f"stream waited on client credits {window.waits} times")
+        if sizer is not None:
+            logging.info(f"stream resized its batches {sizer.resizes} times, to {sizer.size} last")
+        del pipelines[stream_id]
+        if pipeline_runs:
+            logging.info(f"pipeline stage seconds: {PipelineStats.merge(pipeline_runs)}")
 
-    for x, y in job.stream(int(batch_size), BatchType(batch_type)):
-        total_start = time.time()
-        # rec = await websocket.receive_json()
-        print("prepping data")
-        x_repr = x.repr_json()
-        y_repr = y.repr_json()
-        print("sending")
-        d = {"x": x_repr, "y": y_repr, "end": False}
-        await websocket.send_json(d)
-        print("sent")
-        total_end = time.time()
-        print("total loop time: ", total_end - total_start)
-
-    # reset the uid to unlock
-    global_client_uuid = ""
-    print("sending end")
-    await websocket.send_json({"end": True})
     print("all done sending data, closing socket")
-    await websocket.close()
+    await close_stream(websocket, window)
+
+
+@app.route("/batches", methods=["GET"])
+async def batches(request):
+    params = request.query_params
+
+    batch_size = int(params.get("batch_size", DEFAULT_BATCH_SIZE))
+    batch_type = params.get("batch_type", BatchType.TRAIN.value)
+    batches_per_message = int(params.get("batches_per_message", 1))
+    shard = int(params.get(SHARD_PARAM, 0))
+    num_shards = int(params.get(NUM_SHARDS_PARAM, 1))
+    epochs = int(params.get(EPOCHS_PARAM, 1))
+    drop_last = params.get(DROP_LAST_PARAM, "1") != "0"
+    strategy = SampleStrategy(params.get(STRATEGY_PARAM, SampleStrategy.RANDOM.value))
+    count = int(params.get(COUNT_PARAM, 1))
+    cursor = Cursor.parse(params.get(CURSOR_PARAM, Cursor().token()))
+    encoding = None
+    media_type = "application/json"
+    if is_tensor(request.headers.get("accept")):
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        media_type = TENSOR_CONTENT_TYPE
+
+    # clients send the seed only when they picked it to be repeatable
+    cache = job.frame_cache if cursor.seed is None or params.get(SEED_PARAM) else None
+
+    stream_id = next(stream_ids)
+    pipeline_runs = pipelines[stream_id] = []
+
+    # requests are stateless, each one picks the stream up again at the client's cursor
+    def source():
+        compressor = Compressor(get_codec(encoding)) if encoding is not None else None
+        batches = job.stream_epochs(
+            cursor,
+            epochs,
+            batch_size,
+            BatchType(batch_type),
+            shard,
+            num_shards,
+            drop_last,
+            cache,
+            strategy,
+            pipeline_runs=pipeline_runs,
+        )
+        return encode_stream(itertools.islice(batches, count), compressor, batches_per_message)
+
+    messages = AsyncPrefetcher(source, size=2)
+
+    async def body():
+        try:
+            async for msg, _ in messages:
+                yield length_prefixed(msg)
+        finally:
+            messages.close()
+            del pipelines[stream_id]
+
+    return StreamingResponse(body(), media_type=media_type)
 
 
 @app.route("/sample", methods=["GET"])
 async def sample(request):
     params = request.query_params
     batch_size = params.get("batch_size", DEFAULT_BATCH_SIZE)
+    strategy = SampleStrategy(params.get(STRATEGY_PARAM, SampleStrategy.RANDOM.value))
+
+    x, y = await run_in_threadpool(job.sample_classes, int(batch_size), strategy)
+    if is_tensor(request.headers.get("accept")):
+        encoding, body = compress_response(request.headers.get("accept-encoding"), encode_message({"x": x, "y": y}))
+        headers = {"content-encoding": encoding} if encoding != IDENTITY else None
+        return Response(body, media_type=TENSOR_CONTENT_TYPE, headers=headers)
 
-    x, y = job.sample(int(batch_size))
     resp = {"x": x.repr_json(), "y": y.repr_json()}
     return JSONResponse(resp)
 
@@ -156,6 +384,9 @@ async def evaluate(request):
         opts = jdict.get("opts", None)
         batch_size = jdict.get("batch_size", 32)
         store = jdict.get("store", True)
+        target_ms = jdict.get("target_ms")
+        min_batch_size = jdict.get("min_batch_size", 1)
+        max_batch_size = jdict.get("max_batch_size")
 
         if opts is None:
             model = SupervisedModelClient[ImageData, ClassData](model_uri)
@@ -166,7 +397,7 @@ async def evaluate(request):
         print(e)
         raise
 
-    report = job.evaluate(model, batch_size, store)
+    report = job.evaluate(model, batch_size, store, target_ms, min_batch_size, max_batch_size)
 
     return JSONResponse({"report": report.repr_json()})
 
@@ -181,6 +412,6 @@ if __name__ == "__main__":
         dir = os.path.dirname(fp)
         pkgs[dir] = ""
 
-    logging.info("starting server version 'd946d04-4666563' on port: 8080")
+    logging.info("starting server version 'd8fd511' on port: 8080")
     uvicorn.run("__main__:app", host="0.0.0.0", port=8080, log_level="debug", workers=1, reload=True, reload_dirs=pkgs.keys())
         
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""Encoders and decoders generated per Data class
+
+Reflecting over a dataclass on every call (`fields()`, building kwargs dicts, `cls(**data)`) is a large share of the
+latency for small batches. Instead the fields of a class are inspected once and straight line functions are generated
+for it, with array fields going to buffers and everything else to the header.
+"""
+
+from dataclasses import MISSING, dataclass, fields, is_dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple, Type
+import typing
+
+import numpy as np
+
+_CODEC_ATTR = "_data_codec"
+
+_PLAIN = (int, float, str, bool, type(None))
+
+
+@dataclass(frozen=True)
+class DataCodec:
+    """Functions generated for one dataclass"""
+
+    repr_wire: Callable[[Any], Tuple[Dict[str, Any], Dict[str, np.ndarray]]]
+    """Split an object into scalar fields and arrays"""
+
+    load_wire: Callable[[Type[Any], Dict[str, Any], Dict[str, np.ndarray]], Any]
+    """Create an object from scalar fields and arrays"""
+
+    repr_json: Callable[[Any], Dict[str, Any]]
+    """Convert an object to a dict of its fields"""
+
+    load_dict: Callable[[Type[Any], Dict[str, Any]], Any]
+    """Create an object from a dict of its fields, converting arrays and enums"""
+
+    source: str
+    """The generated source, for debugging"""
+
+
+def _scalar(val: Any) -> Any:
+    if isinstance(val, Enum):
+        return val.value
+    if isinstance(val, np.generic):
+        return val.item()
+    return val
+
+
+def _field_kind(tp: Any) -> str:
+    if tp is np.ndarray:
+        return "array"
+    if isinstance(tp, type) and issubclass(tp, Enum):
+        return "enum"
+    if tp in _PLAIN:
+        return "plain"
+    return "any"
+
+
+def _generated_init(cls: Type[Any]) -> bool:
+    # dataclasses compile their __init__ from source, a hand written one has a real file
+    code = getattr(cls.__init__, "__code__", None)
+    return code is not None and code.co_filename == "<string>"
+
+
+def _construct(cls: Type[Any], data: Dict[str, Any], no_init: FrozenSet[str]) -> Any:
+    obj = cls(**{name: val for name, val in data.items() if name not in no_init})
+    for name in no_init:
+        if name in data:
+            obj.__dict__[name] = data[name]
+    return obj
+
+
+def compile_codec(cls: Type[Any]) -> DataCodec:
+    """Generate the encoders and decoders for a dataclass
+
+    Args:
+        cls (Type[Any]): A dataclass
+
+    Raises:
+        TypeError: If the class is not a dataclass
+
+    Returns:
+        DataCodec: The generated functions
+    """
+    if not is_dataclass(cls):
+        raise TypeError(f"{cls.__name__} is not a dataclass")
+
+    try:
+        hints = typing.get_type_hints(cls)
+    except Exception:
+        # unresolvable annotations just lose the specialized paths
+        hints = {}
+
+    names = frozenset(f.name for f in fields(cls))
+    required = frozenset(
+        f.name for f in fields(cls) if f.init and f.default is MISSING and f.default_factory is MISSING  # type: ignore
+    )
+    env: Dict[str, Any] = {
+        "ndarray": np.ndarray,
+        "asarray": np.asarray,
+        "_scalar": _scalar,
+        "_PLAIN": _PLAIN,
+        "_FIELDS": names,
+        "_REQUIRED": required,
+    }
+    # __post_init__ has to run and init=False fields can't be passed in, otherwise objects are created without calling
+    # __init__
+    use_init = hasattr(cls, "__post_init__") or any(not f.init for f in fields(cls))
+
+    repr_wire: List[str] = ["def repr_wire(self):", "    scalars = {}", "    arrays = {}"]
+    repr_json: List[str] = ["def repr_json(self):", "    return {"]
+    load_wire: List[str] = ["def load_wire(cls, scalars, arrays):"]
+    load_dict: List[str] = [
+        "def load_dict(cls, data):",
+        "    if not data.keys() <= _FIELDS:",
+        "        raise TypeError(f'{cls.__name__} got unexpected fields {sorted(data.keys() - _FIELDS)}')",
+        "    if not _REQUIRED <= data.keys():",
+        "        raise TypeError(f'{cls.__name__} is missing fields {sorted(_REQUIRED - data.keys())}')",
+    ]
+    assign_wire: List[str] = []
+    assign_dict: List[str] = []
+    # init=False fields are set on the object once it is created, if they were sent at all
+    after_wire: List[str] = []
+    after_dict: List[str] = []
+
+    for i, f in enumerate(fields(cls)):
+        name = f.name
+        kind = _field_kind(hints.get(name))
+        key = repr(name)
+
+        repr_json.append(f"        {key}: self.{name},")
+
+        repr_wire.append(f"    v = self.{name}")
+        if kind == "array":
+            repr_wire.append(f"    if isinstance(v, ndarray): arrays[{key}] = v")
+            repr_wire.append(f"    else: scalars[{key}] = _scalar(v)")
+        elif kind == "enum":
+            repr_wire.append(f"    scalars[{key}] = v.value if isinstance(v, Enum_{i}) else v")
+        elif kind == "plain":
+            repr_wire.append(f"    scalars[{key}] = v if type(v) in _PLAIN else _scalar(v)")
+        else:
+            repr_wire.append(f"    if isinstance(v, ndarray): arrays[{key}] = v")
+            repr_wire.append(f"    else: scalars[{key}] = _scalar(v)")
+
+        # a missing field falls back to its default, load_dict checks for required ones up front like cls(**data) did
+        if f.default is not MISSING:
+            env[f"default_{i}"] = f.default
+            missing: Optional[str] = f"default_{i}"
+        elif f.default_factory is not MISSING:  # type: ignore
+            env[f"factory_{i}"] = f.default_factory  # type: ignore
+            missing = f"factory_{i}()"
+        else:
+            missing = None
+
+        if kind == "enum":
+            env[f"Enum_{i}"] = hints[name]
+
+        # arrays from the wire are already arrays, but enums need converting back
+        if kind == "enum":
+            get = f"Enum_{i}(scalars[{key}])"
+        else:
+            get = f"scalars[{key}]"
+        if kind == "enum":
+            convert = f"Enum_{i}(data[{key}])"
+        elif kind == "array":
+            convert = f"asarray(data[{key}])"
+        else:
+            convert = f"data[{key}]"
+
+        if use_init and not f.init:
+            wire = f"arrays[{key}] if {key} in arrays else {get}" if kind in ("array", "any") else get
+            present = f"{key} in scalars or {key} in arrays" if kind in ("array", "any") else f"{key} in scalars"
+            after_wire.append(f"    if {present}: obj.__dict__[{key}] = {wire}")
+            after_dict.append(f"    if {key} in data: obj.__dict__[{key}] = {convert}")
+            continue
+
+        if missing is not None:
+            get = f"{get} if {key} in scalars else {missing}"
+        if kind in ("array", "any"):
+            get = f"arrays[{key}] if {key} in arrays else {get}"
+        assign_wire.append(f"    kw[{key}] = {get}")
+
+        if missing is None:
+            assign_dict.append(f"    kw[{key}] = {convert}")
+        else:
+            assign_dict.append(f"    kw[{key}] = {convert} if {key} in data else {missing}")
+
+    repr_wire.append("    return scalars, arrays")
+    repr_json.append("    }")
+
+    for lines, assign, after in ((load_wire, assign_wire, after_wire), (load_dict, assign_dict, after_dict)):
+        lines.append("    kw = {}")
+        lines.extend(assign)
+        if use_init:
+            lines.append("    obj = cls(**kw)")
+            lines.extend(after)
+        else:
+            lines.append("    obj = cls.__new__(cls)")
+            lines.append("    obj.__dict__.update(kw)")
+        lines.append("    return obj")
+
+    source = "\n".join(repr_wire + [""] + repr_json + [""] + load_wire + [""] + load_dict) + "\n"
+    exec(compile(source, f"<data codec {cls.__qualname__}>", "exec"), env)
+
+    if not _generated_init(cls):
+        # a hand written __init__ may take anything, objects are created from the fields as they were before codecs
+        no_init = frozenset(f.name for f in fields(cls) if not f.init)
+
+        def load_wire_reflective(cls: Type[Any], scalars: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> Any:
+            return _construct(cls, {**scalars, **arrays}, no_init)
+
+        def load_dict_reflective(cls: Type[Any], data: Dict[str, Any]) -> Any:
+            return _construct(cls, data, no_init)
+
+        return DataCodec(
+            repr_wire=env["repr_wire"],
+            load_wire=load_wire_reflective,
+            repr_json=env["repr_json"],
+            load_dict=load_dict_reflective,
+            source=source,
+        )
+    return DataCodec(
+        repr_wire=env["repr_wire"],
+        load_wire=env["load_wire"],
+        repr_json=env["repr_json"],
+        load_dict=env["load_dict"],
+        source=source,
+    )
+
+
+def codec_for(cls: Type[Any]) -> Optional[DataCodec]:
+    """Get the generated codec for a class, compiling it on first use
+
+    Args:
+        cls (Type[Any]): The class
+
+    Returns:
+        Optional[DataCodec]: The codec, or None if the class is not a dataclass
+    """
+    # look in the class itself, a subclass can add fields to its parent
+    codec = cls.__dict__.get(_CODEC_ATTR, MISSING)
+    if codec is MISSING:
+        codec = compile_codec(cls) if is_dataclass(cls) else None
+        setattr(cls, _CODEC_ATTR, codec)
+    return codec  # type: ignore
@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import numpy as np
+import pytest
+
+from arc.data.codegen import codec_for
+from arc.data.shapes.classes import ClassData, ClassEncoding
+from arc.data.shapes.image import ImageData
+from arc.data.types import Data, NDArray
+
+
+@dataclass
+class TaggedData(Data):
+    """Arrays with defaults and a custom repr_json"""
+
+    data: NDArray
+    mask: NDArray
+    tags: List[str] = field(default_factory=list)
+    weight: float = 1.0
+
+    @classmethod
+    def short_name(cls) -> str:
+        return "tag"
+
+    def as_ndarray(self) -> NDArray:
+        return self.data
+
+    def repr_json(self) -> Dict[str, Any]:
+        d = super().repr_json()
+        d["data"] = self.data.tolist()
+        d["mask"] = self.mask.tolist()
+        d["custom"] = True
+        return d
+
+
+def test_codec():
+    y = ClassData(np.arange(3), 10, 3, ClassEncoding.CATEGORICAL, names=None)
+    codec = codec_for(ClassData)
+    assert codec is codec_for(ClassData)
+
+    scalars, arrays = codec.repr_wire(y)
+    assert list(arrays) == ["data"]
+    assert scalars == {"num_classes": 10, "size": 3, "encoding": "categorical", "names": None}
+
+    y2 = ClassData.load_wire(scalars, arrays)
+    assert y2.encoding is ClassEncoding.CATEGORICAL
+    assert y2.data is arrays["data"]
+
+    # numpy scalars are converted for JSON
+    x = ImageData(np.zeros((1, 4)), np.int64(2), 2, 1, 1)
+    assert type(x.repr_wire()[0]["width"]) is int
+
+
+def test_codec_overrides():
+    t = TaggedData(np.arange(4), np.ones(4, dtype=bool))
+    d = t.repr_json()
+    assert d["custom"] and d["tags"] == [] and d["weight"] == 1.0
+
+    t2 = TaggedData.load_dict({"data": [1, 2], "mask": [True, False]})
+    assert isinstance(t2.data, np.ndarray) and t2.tags == [] and t2.tags is not t.tags
+
+    t3 = TaggedData.load_bytes(TaggedData(np.arange(2), np.zeros(2, dtype=bool), ["a"], 0.5).repr_bytes())
+    assert t3.tags == ["a"] and t3.weight == 0.5 and t3.mask.dtype == bool
+
+    # subclasses get their own codec
+    @dataclass
+    class MoreTaggedData(TaggedData):
+        extra: int = 0
+
+    assert "extra" in MoreTaggedData(np.arange(1), np.ones(1)).repr_wire()[0]
+    assert "extra" not in t.repr_wire()[0]
+
+
+@dataclass
+class CountedData(Data):
+    """A field computed in __post_init__ that isn't passed to __init__"""
+
+    data: NDArray
+    count: int = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.count = len(self.data)
+
+    @classmethod
+    def short_name(cls) -> str:
+        return "counted"
+
+    def as_ndarray(self) -> NDArray:
+        return self.data
+
+
+@dataclass
+class ScaledData(CountedData):
+    """A hand written __init__ that takes different arguments than the fields"""
+
+    scale: float = 1.0
+
+    def __init__(self, data: NDArray, scale: float = 1.0, normalize: bool = False) -> None:
+        self.data = data / data.max() if normalize else data
+        self.scale = scale
+        self.__post_init__()
+
+
+def test_codec_init():
+    c = CountedData(np.arange(3))
+    assert c.count == 3
+    assert CountedData.load_dict(c.repr_json()).count == 3
+    c2 = CountedData.load_bytes(c.repr_bytes())
+    assert c2.count == 3 and np.array_equal(c2.data, c.data)
+
+    s = ScaledData.load_dict({"data": np.arange(1.0, 5.0), "normalize": True})
+    assert s.data.max() == 1.0 and s.scale == 1.0
+    s2 = ScaledData.load_bytes(ScaledData(np.arange(2.0), 2.0).repr_bytes())
+    assert s2.scale == 2.0
+
+    # unexpected keys are an error, as they were for cls(**data)
+    with pytest.raises(TypeError):
+        TaggedData.load_dict({"data": [1], "mask": [True], "colour": "red"})
+    with pytest.raises(TypeError):
+        CountedData.load_dict({"data": [1], "colour": "red"})
+
+    # and so are missing ones
+    with pytest.raises(TypeError, match=r"missing fields \['mask'\]"):
+        TaggedData.load_dict({"data": [1]})
+    with pytest.raises(TypeError):
+        CountedData.load_dict({})
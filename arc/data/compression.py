@@ -0,0 +1,382 @@
+"""Compression codecs for job streams and model RPC"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+import lzma
+import struct
+import time
+import zlib
+
+from arc.data.encoding import Buffer
+
+IDENTITY = "identity"
+
+DEFAULT_ENCODINGS = ("deflate",)
+"""Encodings clients advertise by default, lzma compresses better but is usually too slow to keep up with a stream"""
+
+DEFAULT_BANDWIDTH = 20e6
+"""Assumed link bandwidth in bytes per second, roughly what a `kubectl port-forward` tunnel sustains"""
+
+_CHUNK_SIZE = 1 << 20
+"""Bytes decompressed at a time, so a message is never held as both bytes and bytearray"""
+
+
+class Codec(ABC):
+    """A compression codec"""
+
+    name: str
+
+    @abstractmethod
+    def compress(self, buf: Buffer) -> bytes:
+        """Compress a buffer
+
+        Args:
+            buf (Buffer): Buffer to compress
+
+        Returns:
+            bytes: The compressed buffer
+        """
+        pass
+
+    @abstractmethod
+    def decompress(self, buf: Buffer) -> Buffer:
+        """Decompress a buffer
+
+        Args:
+            buf (Buffer): Buffer to decompress
+
+        Returns:
+            Buffer: The decompressed buffer, writable so arrays decoded from it without a copy are writable too
+        """
+        pass
+
+
+class IdentityCodec(Codec):
+    """Leaves buffers as they are"""
+
+    name = IDENTITY
+
+    def compress(self, buf: Buffer) -> bytes:
+        return bytes(buf)
+
+    def decompress(self, buf: Buffer) -> Buffer:
+        return buf
+
+
+class DeflateCodec(Codec):
+    """zlib deflate"""
+
+    name = "deflate"
+
+    def __init__(self, level: int = 1) -> None:
+        """Create a DeflateCodec
+
+        Args:
+            level (int, optional): Compression level from 1 (fastest) to 9 (smallest). Defaults to 1.
+        """
+        self.level = level
+
+    def compress(self, buf: Buffer) -> bytes:
+        return zlib.compress(buf, self.level)
+
+    def decompress(self, buf: Buffer) -> Buffer:
+        decompressor = zlib.decompressobj()
+        out = bytearray(decompressor.decompress(buf, _CHUNK_SIZE))
+        while decompressor.unconsumed_tail:
+            out += decompressor.decompress(decompressor.unconsumed_tail, _CHUNK_SIZE)
+        out += decompressor.flush()
+        if not decompressor.eof:
+            raise zlib.error("incomplete or truncated stream")
+        return out
+
+
+class LzmaCodec(Codec):
+    """lzma in the xz container"""
+
+    name = "xz"
+
+    def __init__(self, preset: int = 0) -> None:
+        """Create a LzmaCodec
+
+        Args:
+            preset (int, optional): Compression preset from 0 (fastest) to 9 (smallest). Defaults to 0.
+        """
+        self.preset = preset
+
+    def compress(self, buf: Buffer) -> bytes:
+        return lzma.compress(buf, preset=self.preset)
+
+    def decompress(self, buf: Buffer) -> Buffer:
+        decompressor = lzma.LZMADecompressor()
+        out = bytearray(decompressor.decompress(buf, _CHUNK_SIZE))
+        while not decompressor.eof and not decompressor.needs_input:
+            out += decompressor.decompress(b"", _CHUNK_SIZE)
+        if not decompressor.eof:
+            raise lzma.LZMAError("compressed data ended before the end-of-stream marker was reached")
+        return out
+
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (IdentityCodec(), DeflateCodec(), LzmaCodec())}
+
+
+def get_codec(name: str) -> Codec:
+    """Get a codec by name
+
+    Args:
+        name (str): Name of the codec e.g. "deflate"
+
+    Raises:
+        ValueError: If the codec is unknown
+
+    Returns:
+        Codec: The codec
+    """
+    if name not in CODECS:
+        raise ValueError(f"unknown compression codec '{name}', supported codecs are {list(CODECS)}")
+    return CODECS[name]
+
+
+def negotiate(accept_encoding: Optional[str], supported: Sequence[str] = tuple(CODECS)) -> str:
+    """Pick an encoding from an accept-encoding header
+
+    Args:
+        accept_encoding (str, optional): Header value e.g. "deflate, xz;q=0.5"
+        supported (Sequence[str], optional): Encodings we can send. Defaults to all codecs.
+
+    Returns:
+        str: The accepted encoding with the highest quality, IDENTITY if there is none
+    """
+    if not accept_encoding:
+        return IDENTITY
+
+    best, best_q = IDENTITY, 0.0
+    for item in accept_encoding.split(","):
+        name, *params = [p.strip() for p in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                q = float(param[2:])
+        if name in supported and name != IDENTITY and q > best_q:
+            best, best_q = name, q
+    return best
+
+
+@dataclass
+class CompressionStats:
+    """Compression counters for one connection"""
+
+    messages: int = 0
+    """Number of messages"""
+
+    compressed: int = 0
+    """Number of messages that were sent compressed"""
+
+    raw_bytes: int = 0
+    """Bytes before compression"""
+
+    wire_bytes: int = 0
+    """Bytes actually sent"""
+
+    seconds: float = 0.0
+    """Time spent compressing or decompressing"""
+
+    @property
+    def ratio(self) -> float:
+        """Ratio of raw to wire bytes"""
+        if self.wire_bytes == 0:
+            return 1.0
+        return self.raw_bytes / self.wire_bytes
+
+    def record(self, raw_bytes: int, wire_bytes: int, seconds: float, compressed: bool) -> None:
+        """Record a message
+
+        Args:
+            raw_bytes (int): Size before compression
+            wire_bytes (int): Size on the wire
+            seconds (float): Time spent on the message
+            compressed (bool): Whether the message was compressed
+        """
+        self.messages += 1
+        self.compressed += int(compressed)
+        self.raw_bytes += raw_bytes
+        self.wire_bytes += wire_bytes
+        self.seconds += seconds
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {
+            "messages": self.messages,
+            "compressed": self.compressed,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "seconds": self.seconds,
+            "ratio": self.ratio,
+        }
+
+    @classmethod
+    def load_dict(cls, data: Dict[str, Any]) -> "CompressionStats":
+        """Load object from JSON
+
+        Args:
+            data (Dict[str, Any]): Dict to create from
+
+        Returns:
+            CompressionStats: A CompressionStats
+        """
+        return cls(data["messages"], data["compressed"], data["raw_bytes"], data["wire_bytes"], data["seconds"])
+
+
+class Compressor:
+    """Compresses the messages of one connection
+
+    Compression is only worth it when the time saved on the wire outweighs the time spent compressing. When a message
+    doesn't pay off, because it is incompressible or the CPU is slower than the link, the next `backoff` messages are
+    sent uncompressed before trying again.
+    """
+
+    def __init__(
+        self,
+        codec: Codec,
+        bandwidth: float = DEFAULT_BANDWIDTH,
+        min_size: int = 1024,
+        backoff: int = 16,
+    ) -> None:
+        """Create a Compressor
+
+        Args:
+            codec (Codec): Codec to use
+            bandwidth (float, optional): Link bandwidth in bytes per second. Defaults to DEFAULT_BANDWIDTH.
+            min_size (int, optional): Messages smaller than this are never compressed. Defaults to 1024.
+            backoff (int, optional): Messages to skip after one that didn't pay off. Defaults to 16.
+        """
+        self.codec = codec
+        self.bandwidth = bandwidth
+        self.min_size = min_size
+        self.backoff = backoff
+        self.stats = CompressionStats()
+        self._skip = 0
+
+    def compress(self, buf: Buffer) -> Tuple[str, Buffer]:
+        """Compress a message if it pays off
+
+        Args:
+            buf (Buffer): Message to compress
+
+        Returns:
+            Tuple[str, Buffer]: The encoding used and the message to send
+        """
+        nbytes = memoryview(buf).nbytes
+        if self.codec.name == IDENTITY or nbytes < self.min_size or self._skip > 0:
+            self._skip = max(self._skip - 1, 0)
+            self.stats.record(nbytes, nbytes, 0.0, False)
+            return IDENTITY, buf
+
+        start = time.perf_counter()
+        out = self.codec.compress(buf)
+        seconds = time.perf_counter() - start
+
+        saved = (nbytes - len(out)) / self.bandwidth - seconds
+        if saved <= 0:
+            self._skip = self.backoff
+        if len(out) >= nbytes:
+            self.stats.record(nbytes, nbytes, seconds, False)
+            return IDENTITY, buf
+
+        self.stats.record(nbytes, len(out), seconds, True)
+        return self.codec.name, out
+
+
+def compress_response(accept_encoding: Optional[str], body: Buffer) -> Tuple[str, Buffer]:
+    """Compress the body of a response to a request that doesn't hold a connection
+
+    A new compressor is used for every response, so one client's incompressible payloads don't back off compression
+    for the others.
+
+    Args:
+        accept_encoding (str, optional): Header value e.g. "deflate"
+        body (Buffer): Body to compress
+
+    Returns:
+        Tuple[str, Buffer]: The encoding used and the body to send
+    """
+    return Compressor(get_codec(negotiate(accept_encoding))).compress(body)
+
+
+def decompress(encoding: Optional[str], buf: Buffer, stats: Optional[CompressionStats] = None) -> Buffer:
+    """Decompress a buffer
+
+    Args:
+        encoding (str, optional): Encoding of the buffer, None is the same as IDENTITY
+        buf (Buffer): Buffer to decompress
+        stats (CompressionStats, optional): Stats to record into. Defaults to None.
+
+    Returns:
+        Buffer: The decompressed buffer
+    """
+    if encoding is None or encoding == IDENTITY:
+        if stats is not None:
+            nbytes = memoryview(buf).nbytes
+            stats.record(nbytes, nbytes, 0.0, False)
+        return buf
+
+    start = time.perf_counter()
+    out = get_codec(encoding).decompress(buf)
+    if stats is not None:
+        stats.record(len(out), memoryview(buf).nbytes, time.perf_counter() - start, True)
+    return out
+
+
+# Compressed websocket messages are wrapped in a small envelope, so the stream can switch between compressed and
+# uncompressed messages as it goes:
+#
+#   magic (4 bytes) | encoding name length (uint8) | encoding name | compressed message
+
+ENVELOPE_MAGIC = b"ARCZ"
+
+_ENVELOPE = struct.Struct("<4sB")
+
+
+def compress_message(compressor: Compressor, msg: Buffer) -> Buffer:
+    """Compress a binary websocket message
+
+    Args:
+        compressor (Compressor): Compressor for the connection
+        msg (Buffer): Message to compress
+
+    Returns:
+        Buffer: The message to send, either as it was or in a compressed envelope
+    """
+    encoding, body = compressor.compress(msg)
+    if encoding == IDENTITY:
+        return msg
+    name = encoding.encode("ascii")
+    return b"".join([_ENVELOPE.pack(ENVELOPE_MAGIC, len(name)), name, body])
+
+
+def decompress_message(msg: Buffer, stats: Optional[CompressionStats] = None) -> Buffer:
+    """Decompress a binary websocket message created with `compress_message`
+
+    Args:
+        msg (Buffer): Received message
+        stats (CompressionStats, optional): Stats to record into. Defaults to None.
+
+    Returns:
+        Buffer: The original message
+    """
+    view = memoryview(msg).cast("B")
+    if bytes(view[:4]) != ENVELOPE_MAGIC:
+        return decompress(IDENTITY, view, stats)
+
+    begin = time.perf_counter()
+    _, name_len = _ENVELOPE.unpack_from(view)
+    start = _ENVELOPE.size + name_len
+    encoding = bytes(view[_ENVELOPE.size : start]).decode("ascii")
+    out = decompress(encoding, view[start:])
+    if stats is not None:
+        stats.record(memoryview(out).nbytes, view.nbytes, time.perf_counter() - begin, True)
+    return out
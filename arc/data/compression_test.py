@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+
+from arc.data.compression import (
+    IDENTITY,
+    CompressionStats,
+    Compressor,
+    DeflateCodec,
+    LzmaCodec,
+    negotiate,
+    compress_message,
+    compress_response,
+    decompress_message,
+)
+from arc.data.encoding import encode_message, decode_message
+from arc.data.shapes.image import ImageData
+
+
+def test_codecs():
+    buf = bytes(1000) + b"arc" * 100
+    for codec in (DeflateCodec(), LzmaCodec()):
+        out = codec.compress(memoryview(buf))
+        assert len(out) < len(buf)
+        assert codec.decompress(out) == buf
+        assert not memoryview(codec.decompress(out)).readonly
+
+
+def test_negotiate():
+    assert negotiate(None) == IDENTITY
+    assert negotiate("deflate") == "deflate"
+    assert negotiate("br, xz;q=0.5, deflate;q=0.8") == "deflate"
+    assert negotiate("deflate;q=0, xz") == "xz"
+    assert negotiate("br") == IDENTITY
+
+
+def test_compress_message():
+    # quantized pixels compress well
+    pixels = np.random.randint(0, 4, (8, 784)) / 4
+    x = ImageData(pixels, 28, 28, 1, 8)
+    msg = encode_message({"x": x}, end=False)
+
+    compressor = Compressor(DeflateCodec())
+    sent = compress_message(compressor, msg)
+    assert len(sent) < len(msg)
+
+    stats = CompressionStats()
+    _, parts = decode_message(decompress_message(sent, stats), {"x": ImageData}, copy=False)
+    assert np.array_equal(parts["x"].data, pixels)
+    assert stats.raw_bytes == len(msg) and stats.wire_bytes == len(sent)
+    assert compressor.stats.ratio > 1
+
+    assert CompressionStats.load_dict(compressor.stats.repr_json()) == compressor.stats
+
+
+def test_compressor_adapts():
+    compressor = Compressor(DeflateCodec(), backoff=4)
+
+    # random bytes don't compress, so they are sent as they are and the next few aren't even tried
+    noise = os.urandom(4096)
+    for _ in range(5):
+        assert compress_message(compressor, noise) is noise
+    assert compressor.stats.compressed == 0
+    assert compressor.stats.seconds > 0
+
+    # tiny messages are never compressed
+    assert compressor.compress(b"\0" * 10) == (IDENTITY, b"\0" * 10)
+
+    # on a very fast link compressing never pays off
+    fast = Compressor(DeflateCodec(), bandwidth=1e15)
+    fast.compress(bytes(10000))
+    assert fast.compress(bytes(10000))[0] == IDENTITY
+
+
+def test_compress_response():
+    # responses are compressed on their own, one client's noise doesn't turn compression off for the next
+    noise = os.urandom(4096)
+    assert compress_response("deflate", noise) == (IDENTITY, noise)
+    encoding, body = compress_response("deflate", bytes(4096))
+    assert encoding == "deflate" and len(body) < 4096
+    assert compress_response(None, bytes(4096))[0] == IDENTITY
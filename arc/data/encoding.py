@@ -1,5 +1,10 @@
-# import numpy as np
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Type, Union
 import json
+import struct
+
+import numpy as np
 
 # from arc.data.types import Data
 
@@ -27,3 +32,459 @@ class ShapeEncoder(json.JSONEncoder):
             return obj.repr_json()
         else:
             return json.JSONEncoder.default(self, obj)
+
+
+# Binary tensor wire format
+#
+# A packed buffer is laid out as:
+#
+#   magic (4 bytes) | header length (uint32 LE) | JSON header | padding | body
+#
+# The header holds the scalar fields as JSON along with a descriptor for every array
+# (dtype, shape, offset, nbytes) and every nested part (offset, nbytes). Offsets are relative to the
+# start of the body and everything is aligned to ALIGNMENT bytes so arrays can be viewed in place.
+# A message is simply a packed buffer whose parts are themselves packed `Data` objects.
+
+TENSOR_CONTENT_TYPE = "application/x-arc-tensor"
+JSON_CONTENT_TYPE = "application/json"
+
+MAGIC = b"ARC1"
+ALIGNMENT = 8
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_PREFIX = struct.Struct("<4sI")
+
+Restore = Tuple[str, float]
+"""The user facing dtype of an array along with the scale it was quantized with"""
+
+
+class WireDtype(str, Enum):
+    """How floating point arrays are represented on the wire"""
+
+    PRESERVE = "preserve"
+    """Send arrays as they are"""
+
+    FLOAT16 = "downcast-to-float16"
+    """Downcast to float16"""
+
+    UINT8 = "quantize-to-uint8"
+    """Quantize to uint8 steps of `scale`"""
+
+
+@dataclass(frozen=True)
+class WirePolicy:
+    """Wire dtype policy for the floating point arrays of a Data class"""
+
+    dtype: WireDtype = WireDtype.PRESERVE
+    """Wire representation"""
+
+    scale: float = 1.0
+    """Value of one uint8 step when quantizing e.g. 1/255 for pixels normalized to [0, 1]"""
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {"dtype": self.dtype.value, "scale": self.scale}
+
+    @classmethod
+    def load_dict(cls, data: Dict[str, Any]) -> "WirePolicy":
+        """Load object from JSON
+
+        Args:
+            data (Dict[str, Any]): Dict to create from
+
+        Returns:
+            WirePolicy: A WirePolicy
+        """
+        return cls(WireDtype(data["dtype"]), data.get("scale", 1.0))
+
+
+def to_wire(arr: np.ndarray, policy: WirePolicy) -> Tuple[np.ndarray, Optional[Restore]]:
+    """Convert an array to its wire dtype
+
+    Args:
+        arr (np.ndarray): Array to convert
+        policy (WirePolicy): Policy to apply, only floating point arrays are converted
+
+    Returns:
+        Tuple[np.ndarray, Optional[Restore]]: The wire array and how to restore it, if it was converted
+    """
+    if policy.dtype == WireDtype.PRESERVE or arr.dtype.kind != "f":
+        return arr, None
+
+    if policy.dtype == WireDtype.FLOAT16:
+        if arr.dtype == np.float16:
+            return arr, None
+        return arr.astype(np.float16), (arr.dtype.str, 1.0)
+
+    q = np.rint(arr / policy.scale)
+    np.clip(q, 0, 255, out=q)
+    return q.astype(np.uint8), (arr.dtype.str, policy.scale)
+
+
+def from_wire(arr: np.ndarray, restore: Restore) -> np.ndarray:
+    """Restore an array to its user facing dtype
+
+    Args:
+        arr (np.ndarray): Wire array
+        restore (Restore): The user facing dtype and scale
+
+    Returns:
+        np.ndarray: The restored array
+    """
+    dtype, scale = restore
+    out = arr.astype(np.dtype(dtype))
+    if scale != 1.0:
+        out *= scale
+    return out
+
+
+@dataclass
+class Frame:
+    """An unpacked binary buffer"""
+
+    fields: Dict[str, Any] = field(default_factory=dict)
+    """Scalar fields from the header"""
+
+    arrays: Dict[str, np.ndarray] = field(default_factory=dict)
+    """Arrays from the body"""
+
+    parts: Dict[str, memoryview] = field(default_factory=dict)
+    """Nested packed buffers from the body"""
+
+    restore: Dict[str, Restore] = field(default_factory=dict)
+    """Arrays that were converted by a wire policy and how to restore them"""
+
+
+def _padding(n: int) -> int:
+    return -n % ALIGNMENT
+
+
+def pack(
+    fields: Dict[str, Any],
+    arrays: Optional[Mapping[str, np.ndarray]] = None,
+    parts: Optional[Mapping[str, Buffer]] = None,
+    restore: Optional[Mapping[str, Restore]] = None,
+) -> bytes:
+    """Pack fields, arrays and nested parts into a binary buffer
+
+    Args:
+        fields (Dict[str, Any]): JSON serializable scalar fields
+        arrays (Mapping[str, np.ndarray], optional): Arrays to write as raw buffers. Defaults to None.
+        parts (Mapping[str, Buffer], optional): Already packed buffers to nest. Defaults to None.
+        restore (Mapping[str, Restore], optional): How to restore arrays converted with `to_wire`. Defaults to None.
+
+    Raises:
+        ValueError: If an array has an object dtype
+
+    Returns:
+        bytes: The packed buffer
+    """
+    chunks: List[Buffer] = []
+    array_descs: List[List[Any]] = []
+    part_descs: List[List[Any]] = []
+    offset = 0
+
+    def _append(buf: Buffer, nbytes: int) -> None:
+        nonlocal offset
+        chunks.append(buf)
+        pad = _padding(nbytes)
+        if pad:
+            chunks.append(b"\0" * pad)
+        offset += nbytes + pad
+
+    for name, arr in (arrays or {}).items():
+        arr = np.ascontiguousarray(arr)
+        if arr.dtype.hasobject:
+            raise ValueError(f"array '{name}' has an object dtype and cannot be packed, use repr_json instead")
+        desc = [name, arr.dtype.str, list(arr.shape), offset, arr.nbytes]
+        if restore is not None and name in restore:
+            desc.append(list(restore[name]))
+        array_descs.append(desc)
+        # viewing as bytes also covers dtypes the buffer protocol can't export e.g. datetime64
+        _append(memoryview(arr.reshape(-1).view(np.uint8)), arr.nbytes)
+
+    for name, buf in (parts or {}).items():
+        nbytes = memoryview(buf).nbytes
+        part_descs.append([name, offset, nbytes])
+        _append(buf, nbytes)
+
+    header = json.dumps({"fields": fields, "arrays": array_descs, "parts": part_descs}, separators=(",", ":"))
+    header_bytes = header.encode("utf-8")
+    prefix = _PREFIX.pack(MAGIC, len(header_bytes))
+    pad = _padding(len(prefix) + len(header_bytes))
+
+    return b"".join([prefix, header_bytes, b"\0" * pad, *chunks])
+
+
+def unpack(buf: Buffer, copy: bool = True) -> Frame:
+    """Unpack a binary buffer
+
+    Args:
+        buf (Buffer): Buffer created with `pack`
+        copy (bool, optional): Copy arrays out of the buffer rather than viewing it. Defaults to True.
+
+    Raises:
+        ValueError: If the buffer is not in the arc tensor format
+
+    Returns:
+        Frame: The unpacked frame
+    """
+    view = memoryview(buf).cast("B")
+    magic, header_len = _PREFIX.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("buffer is not in the arc tensor format")
+
+    header_end = _PREFIX.size + header_len
+    header = json.loads(bytes(view[_PREFIX.size : header_end]))
+    body = header_end + _padding(header_end)
+
+    arrays: Dict[str, np.ndarray] = {}
+    restore: Dict[str, Restore] = {}
+    for name, dtype, shape, offset, nbytes, *extra in header["arrays"]:
+        start = body + offset
+        arr = np.frombuffer(view[start : start + nbytes], dtype=np.dtype(dtype)).reshape(shape)
+        arrays[name] = arr.copy() if copy else arr
+        if extra:
+            restore[name] = tuple(extra[0])  # type: ignore
+
+    parts: Dict[str, memoryview] = {}
+    for name, offset, nbytes in header["parts"]:
+        start = body + offset
+        parts[name] = view[start : start + nbytes]
+
+    return Frame(fields=header["fields"], arrays=arrays, parts=parts, restore=restore)
+
+
+def add_fields(buf: Buffer, fields: Dict[str, Any]) -> bytes:
+    """Pack a buffer again with more scalar fields, its arrays and parts are copied over as they are
+
+    Args:
+        buf (Buffer): Buffer created with `pack`
+        fields (Dict[str, Any]): JSON serializable scalar fields to add, the buffer's own fields take precedence
+
+    Raises:
+        ValueError: If the buffer is not in the arc tensor format
+
+    Returns:
+        bytes: The packed buffer
+    """
+    view = memoryview(buf).cast("B")
+    magic, header_len = _PREFIX.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("buffer is not in the arc tensor format")
+
+    header_end = _PREFIX.size + header_len
+    header = json.loads(bytes(view[_PREFIX.size : header_end]))
+    header["fields"] = {**fields, **header["fields"]}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    prefix = _PREFIX.pack(MAGIC, len(header_bytes))
+    pad = _padding(len(prefix) + len(header_bytes))
+
+    # offsets are relative to the body, so it can follow the new header unchanged
+    return b"".join([prefix, header_bytes, b"\0" * pad, view[header_end + _padding(header_end) :]])
+
+
+def is_tensor(content_type: Optional[str]) -> bool:
+    """Whether a content type or accept header advertises the binary tensor format
+
+    Args:
+        content_type (str, optional): Content type or accept header value
+
+    Returns:
+        bool: True if the tensor format is present
+    """
+    if content_type is None:
+        return False
+    return TENSOR_CONTENT_TYPE in content_type
+
+
+def encode_message(parts: Mapping[str, Any], **fields) -> bytes:
+    """Encode `Data` objects into a single binary message
+
+    Args:
+        parts (Mapping[str, Any]): Data objects by name e.g. {"x": x, "y": y}
+        **fields: Extra JSON serializable fields for the message e.g. end=False
+
+    Returns:
+        bytes: The binary message
+    """
+    return pack(fields, parts={name: data.repr_bytes() for name, data in parts.items()})
+
+
+@dataclass(frozen=True)
+class Encoded:
+    """An encoded request body that can be sent to any number of servers"""
+
+    body: bytes
+    """The encoded body"""
+
+    content_type: str
+    """Content type of the body"""
+
+    content_encoding: Optional[str] = None
+    """Compression applied to the body, None if it is uncompressed"""
+
+    raw_bytes: int = 0
+    """Size of the body before compression"""
+
+    seconds: float = 0.0
+    """Time spent compressing the body"""
+
+    parts: Optional[Mapping[str, Any]] = field(default=None, compare=False, repr=False)
+    """The Data objects the body was encoded from, to encode them again for a server that rejects the body"""
+
+
+def encode_body(parts: Mapping[str, Any], content_type: str = TENSOR_CONTENT_TYPE) -> Encoded:
+    """Encode `Data` objects as a request body
+
+    Args:
+        parts (Mapping[str, Any]): Data objects by name e.g. {"x": x, "y": y}
+        content_type (str, optional): Preferred content type, JSON is used unless it advertises the tensor format.
+            Defaults to TENSOR_CONTENT_TYPE.
+
+    Returns:
+        Encoded: The encoded body
+    """
+    if is_tensor(content_type):
+        body = encode_message(parts)
+        return Encoded(body, TENSOR_CONTENT_TYPE, raw_bytes=len(body), parts=parts)
+    body = json.dumps(parts, cls=ShapeEncoder).encode("utf8")
+    return Encoded(body, JSON_CONTENT_TYPE, raw_bytes=len(body), parts=parts)
+
+
+def static_fields(parts: Mapping[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Static fields of `Data` objects, used to tell when a stream needs a new session header
+
+    Args:
+        parts (Mapping[str, Any]): Data objects by name e.g. {"x": x, "y": y}
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Static fields by name
+    """
+    return {name: data.repr_static() for name, data in parts.items()}
+
+
+def encode_session(parts: Mapping[str, Any]) -> bytes:
+    """Encode the session header of a stream, holding the schema and static fields of each part
+
+    It is sent before the first batch and again whenever the static fields change, the batches that follow only
+    carry their arrays and batch fields.
+
+    Args:
+        parts (Mapping[str, Any]): Data objects by name e.g. {"x": x, "y": y}
+
+    Returns:
+        bytes: The binary session header
+    """
+    session = {name: {"schema": type(data).json_schema(), "fields": data.repr_static()} for name, data in parts.items()}
+    return pack({"session": session})
+
+
+def encode_batches(batches: Sequence[Mapping[str, Any]], **fields) -> bytes:
+    """Encode several batches of `Data` objects into a single binary message, without their static fields
+
+    Args:
+        batches (Sequence[Mapping[str, Any]]): Data objects by name for each batch
+        **fields: Extra JSON serializable fields for the message e.g. end=False
+
+    Returns:
+        bytes: The binary message
+    """
+    parts: Dict[str, Buffer] = {}
+    for i, batch in enumerate(batches):
+        for name, data in batch.items():
+            parts[f"{name}.{i}"] = data.repr_batch_bytes()
+    return pack({**fields, "batches": len(batches)}, parts=parts)
+
+
+def encode_batch(parts: Mapping[str, Any]) -> bytes:
+    """Encode one batch of `Data` objects with their static fields, so it can be decoded on its own
+
+    Unlike `encode_message` the arrays are packed with `repr_batch_bytes`, which `decode_batch` hands back to the
+    decoded objects, so a stream can send them again without re-encoding.
+
+    Args:
+        parts (Mapping[str, Any]): Data objects by name e.g. {"x": x, "y": y}
+
+    Returns:
+        bytes: The binary batch
+    """
+    static = {name: data.repr_static() for name, data in parts.items()}
+    return pack({"static": static}, parts={name: data.repr_batch_bytes() for name, data in parts.items()})
+
+
+def decode_batch(buf: Buffer, classes: Mapping[str, Type[Any]]) -> Dict[str, Any]:
+    """Decode a batch created with `encode_batch`, the Data objects are views over the buffer
+
+    Args:
+        buf (Buffer): The binary batch
+        classes (Mapping[str, Type[Any]]): Data classes by part name, parts not present are skipped
+
+    Returns:
+        Dict[str, Any]: The decoded Data objects by name
+    """
+    frame = unpack(buf, copy=False)
+    static = frame.fields["static"]
+    return {
+        name: classes[name].load_bytes(part, copy=False, static=static[name])
+        for name, part in frame.parts.items()
+        if name in classes
+    }
+
+
+def decode_batches(
+    buf: Buffer,
+    classes: Mapping[str, Type[Any]],
+    session: Mapping[str, Dict[str, Any]],
+    copy: bool = True,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Decode a binary message created with `encode_batches` or `encode_message`
+
+    Args:
+        buf (Buffer): The binary message
+        classes (Mapping[str, Type[Any]]): Data classes by part name, parts not present are skipped
+        session (Mapping[str, Dict[str, Any]]): Static fields by part name from the last session header
+        copy (bool, optional): Copy arrays out of the buffer rather than viewing it. Defaults to True.
+
+    Returns:
+        Tuple[Dict[str, Any], List[Dict[str, Any]]]: The message fields and the decoded Data objects of each batch
+    """
+    frame = unpack(buf, copy=False)
+    if "batches" not in frame.fields:
+        datas = {
+            name: classes[name].load_bytes(part, copy=copy) for name, part in frame.parts.items() if name in classes
+        }
+        return frame.fields, [datas] if datas else []
+
+    batches: List[Dict[str, Any]] = [{} for _ in range(frame.fields["batches"])]
+    for key, part in frame.parts.items():
+        name, i = key.rsplit(".", 1)
+        if name in classes:
+            batches[int(i)][name] = classes[name].load_bytes(part, copy=copy, static=session[name])
+    return frame.fields, batches
+
+
+def decode_message(
+    buf: Buffer, classes: Mapping[str, Type[Any]], copy: bool = True
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Decode a binary message into `Data` objects
+
+    Args:
+        buf (Buffer): Message created with `encode_message`
+        classes (Mapping[str, Type[Any]]): Data classes by part name, parts not present are skipped
+        copy (bool, optional): Copy arrays out of the buffer rather than viewing it. Defaults to True.
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, Any]]: The message fields and the decoded Data objects
+    """
+    frame = unpack(buf, copy=False)
+    datas: Dict[str, Any] = {}
+    for name, part in frame.parts.items():
+        if name in classes:
+            datas[name] = classes[name].load_bytes(part, copy=copy)
+    return frame.fields, datas
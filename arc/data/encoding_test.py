@@ -0,0 +1,191 @@
+from dataclasses import dataclass
+import json
+
+import numpy as np
+
+from arc.data.encoding import (
+    ShapeEncoder,
+    WireDtype,
+    WirePolicy,
+    pack,
+    unpack,
+    encode_message,
+    decode_message,
+    encode_session,
+    encode_batches,
+    decode_batches,
+    encode_batch,
+    decode_batch,
+    static_fields,
+    ALIGNMENT,
+)
+from arc.data.types import wire_policy_from_schema
+from arc.data.shapes.image import ImageData
+from arc.data.shapes.classes import ClassData, ClassEncoding
+
+
+def test_pack_unpack():
+    arrays = {"a": np.arange(7, dtype=np.uint8), "b": np.random.rand(3, 5)}
+    buf = pack({"n": 3, "name": "test"}, arrays)
+
+    frame = unpack(buf)
+    assert frame.fields == {"n": 3, "name": "test"}
+    for name, arr in arrays.items():
+        assert frame.arrays[name].dtype == arr.dtype
+        assert np.array_equal(frame.arrays[name], arr)
+
+    # views are aligned relative to the start of the buffer
+    base = np.frombuffer(buf, dtype=np.uint8).ctypes.data
+    for arr in unpack(buf, copy=False).arrays.values():
+        assert (arr.ctypes.data - base) % ALIGNMENT == 0
+
+
+def test_image_data_bytes():
+    x = ImageData(np.random.rand(4, 784), 28, 28, 1, 4)
+    buf = x.repr_bytes()
+
+    # raw float64 buffer plus a small header, instead of a JSON list of floats
+    assert len(buf) < x.data.nbytes + 256
+    assert len(buf) < len(json.dumps(x, cls=ShapeEncoder))
+
+    x2 = ImageData.load_bytes(buf)
+    assert np.array_equal(x2.data, x.data)
+    assert (x2.width, x2.height, x2.channels, x2.num_images) == (28, 28, 1, 4)
+
+
+def test_message():
+    x = ImageData(np.random.rand(2, 16), 4, 4, 1, 2)
+    msg = encode_message({"x": x}, end=False)
+
+    fields, parts = decode_message(msg, {"x": ImageData})
+    assert fields == {"end": False}
+    assert np.array_equal(parts["x"].data, x.data)
+
+    fields, parts = decode_message(pack({"end": True}), {"x": ImageData})
+    assert fields["end"]
+    assert parts == {}
+
+
+def test_repr_bytes_cache():
+    x = ImageData(np.random.rand(2, 16), 4, 4, 1, 2)
+
+    # repr_json no longer mutates the object
+    d = x.repr_json()
+    assert isinstance(d["data"], list)
+    assert isinstance(x.data, np.ndarray)
+
+    buf = x.repr_bytes()
+    assert x.repr_bytes() is buf
+    assert "_repr_bytes" not in x.repr_json()
+
+    # reassigning a field drops the cached encoding
+    x.num_images = 1
+    x.data = x.data[:1]
+    assert x.repr_bytes() is not buf
+    assert ImageData.load_bytes(x.repr_bytes()).num_images == 1
+
+    # decoded views reuse the received buffer as their encoding
+    body = encode_message({"x": x})
+    _, parts = decode_message(body, {"x": ImageData}, copy=False)
+    assert bytes(parts["x"].repr_bytes()) == bytes(x.repr_bytes())
+    assert encode_message({"x": parts["x"]}) == body
+
+
+@dataclass
+class DigitImageData(ImageData):
+    """Pixels normalized to [0, 1] that are sent as uint8"""
+
+    wire_policy = WirePolicy(WireDtype.UINT8, scale=1 / 255)
+
+
+@dataclass
+class HalfImageData(ImageData):
+    """Images sent as float16"""
+
+    wire_policy = WirePolicy(WireDtype.FLOAT16)
+
+
+def test_wire_policy():
+    pixels = np.random.randint(0, 256, (4, 784)).astype(np.uint8)
+    x = DigitImageData(pixels / 255, 28, 28, 1, 4)
+
+    buf = x.repr_bytes()
+    assert len(buf) < pixels.nbytes + 256
+
+    x2 = DigitImageData.load_bytes(buf)
+    assert "data" not in x2.__dict__
+    assert x2.data.dtype == np.float64
+    assert np.allclose(x2.data, x.data)
+    assert "data" in x2.__dict__
+
+    # the policy is self describing, so any ImageData can decode it
+    assert np.allclose(ImageData.load_bytes(buf).data, x.data)
+
+    h = HalfImageData(np.random.rand(2, 16).astype(np.float32), 4, 4, 1, 2)
+    h2 = HalfImageData.load_bytes(h.repr_bytes(), copy=False)
+    assert h2.data.dtype == np.float32
+    assert np.allclose(h2.data, h.data, atol=1e-3)
+    assert h2.repr_json()["width"] == 4
+
+    assert wire_policy_from_schema(json.dumps(DigitImageData.json_schema())) == DigitImageData.wire_policy
+    assert wire_policy_from_schema(ImageData.json_schema()) == WirePolicy()
+
+
+def test_session(monkeypatch):
+    names = [str(i) for i in range(10)]
+    batches = [
+        {
+            "x": ImageData(np.random.rand(n, 16), 4, 4, 1, n),
+            "y": ClassData(np.arange(n), 10, n, ClassEncoding.CATEGORICAL, names=names),
+        }
+        for n in (3, 2)
+    ]
+    assert static_fields(batches[0]) == static_fields(batches[1])
+
+    fields, decoded = decode_batches(encode_session(batches[0]), {"x": ImageData, "y": ClassData}, {})
+    assert decoded == []
+    session = {name: part["fields"] for name, part in fields["session"].items()}
+    assert session["y"]["names"] == names and "size" not in session["y"]
+
+    # static fields aren't repeated in each batch
+    msg = encode_batches(batches, end=False)
+    assert b"names" not in msg and b"width" not in msg
+
+    fields, decoded = decode_batches(msg, {"x": ImageData, "y": ClassData}, session, copy=False)
+    assert fields["end"] is False
+    for batch, dec in zip(batches, decoded):
+        assert np.array_equal(dec["x"].data, batch["x"].data)
+        assert dec["x"].num_images == batch["x"].num_images and dec["x"].width == 4
+        assert dec["y"].names == names and dec["y"].encoding == ClassEncoding.CATEGORICAL
+        assert dec["y"].size == batch["y"].size
+
+    # forwarding a decoded batch adds the static fields back to its encoding rather than packing it again
+    def _no_pack(self, batch_only):
+        raise AssertionError("packed again")
+
+    monkeypatch.setattr(ImageData, "_pack", _no_pack)
+    monkeypatch.setattr(ClassData, "_pack", _no_pack)
+    forwarded = decode_message(encode_message(decoded[0]), {"x": ImageData, "y": ClassData})[1]
+    monkeypatch.undo()
+    assert forwarded["y"].names == names and forwarded["x"].width == 4
+    assert np.array_equal(forwarded["x"].data, batches[0]["x"].data)
+    assert bytes(decoded[0]["x"].repr_bytes()) != bytes(decoded[0]["x"].repr_batch_bytes())
+    assert "_repr_static" not in decoded[0]["y"].repr_json()
+
+    # plain messages still decode
+    _, decoded = decode_batches(encode_message(batches[0], end=False), {"x": ImageData}, {})
+    assert decoded[0]["x"].num_images == 3
+
+
+def test_batch():
+    x = ImageData(np.random.rand(3, 16), 4, 4, 1, 3)
+    y = ClassData(np.arange(3), 10, 3, ClassEncoding.CATEGORICAL, names=[str(i) for i in range(10)])
+    buf = encode_batch({"x": x, "y": y})
+
+    batch = decode_batch(buf, {"x": ImageData, "y": ClassData})
+    assert np.array_equal(batch["x"].data, x.data) and batch["x"].width == 4
+    assert batch["y"].names == y.names and batch["y"].size == 3
+
+    # the decoded batch reuses its encoding instead of packing again
+    assert bytes(batch["x"].repr_batch_bytes()) == bytes(x.repr_batch_bytes())
+    assert np.shares_memory(np.frombuffer(batch["x"].repr_batch_bytes(), np.uint8), np.frombuffer(buf, np.uint8))
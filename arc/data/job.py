@@ -1,8 +1,10 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field, make_dataclass, is_dataclass
-from typing import List, Iterator, Tuple, Dict, Type, Protocol
+from typing import List, Iterator, Generator, Tuple, Dict, Type, Protocol, Optional, Union, Any, Callable, Iterable
 import logging
 import inspect
+import itertools
+import random
 import typing
 from typing import TypeVar, Generic
 from pathlib import Path
@@ -15,8 +17,10 @@ import uuid
 from urllib import parse
 import time
 
+import numpy as np
 from simple_parsing.helpers import Serializable
 from urllib import request, parse
+from http.client import HTTPConnection, HTTPResponse
 from kubernetes import client, config
 from kubernetes.stream import portforward
 from kubernetes.client.models import (
@@ -49,12 +53,54 @@ from kubernetes.client import (
 from docker.utils.utils import parse_repository_tag
 from docker.utils.config import load_general_config
 from docker.auth import resolve_repository_name, load_config
-from websocket import create_connection
+from websocket import ABNF, WebSocket, create_connection
 from dataclasses_jsonschema import JsonSchemaMixin, T
 from kubernetes.client.rest import ApiException
 
 from arc.data.types import *
-from arc.data.types import XData, YData
+from arc.data.types import XData, YData, wire_policy_from_schema
+from arc.data.encoding import TENSOR_CONTENT_TYPE, is_tensor, decode_message, decode_batches, decode_batch, encode_batch
+from arc.data.encoding import Buffer
+from arc.data.cache import EpochCache, FrameCache, SegmentWriter
+from arc.data.shapes.classes import ClassIndex, SampleStrategy
+from arc.data.shuffle import num_batches
+from arc.data.buffers import RecvRing, recv_message
+from arc.data.compression import DEFAULT_ENCODINGS, CompressionStats, decompress, decompress_message
+from arc.data.pipeline import PipelineRun, PipelineStats
+from arc.data.prefetch import Prefetcher, PrefetchStats
+from arc.data.shm import ShmRing, host_id
+from arc.data.workers import BatchWorkers
+from arc.data.stream import (
+    BATCH_SIZE_KEY,
+    BROADCAST_PARAM,
+    COUNT_PARAM,
+    CREDIT_KEY,
+    CURSOR_PARAM,
+    DROP_LAST_PARAM,
+    EPOCHS_PARAM,
+    MAX_BATCH_SIZE_PARAM,
+    MIN_BATCH_SIZE_PARAM,
+    NUM_SHARDS_PARAM,
+    RESUME_PARAM,
+    SEED_PARAM,
+    SHARD_PARAM,
+    SHM_KEY,
+    SHM_PARAM,
+    SHUFFLE_PARAM,
+    STEP_MS_KEY,
+    STRAGGLER_PARAM,
+    STRATEGY_PARAM,
+    SUBSCRIBERS_PARAM,
+    TARGET_BYTES_PARAM,
+    TARGET_MS_PARAM,
+    WINDOW_PARAM,
+    BatchCount,
+    BatchSizer,
+    Cursor,
+    StragglerPolicy,
+    StreamOptions,
+    read_length_prefixed,
+)
 from ..kube.sync import copy_file_to_pod
 from arc.model.types import Model, SupervisedModel, SupervisedModelClient
 from arc.data.types import Score, SupervisedScore
@@ -77,6 +123,8 @@ from arc.kube.pod_util import REPO_SHA_LABEL, ENV_SHA_LABEL, REPO_NAME_LABEL, FU
 
 DEFAULT_BATCH_SIZE = 32
 DEFAULT_EPOCH_SIZE = 100
+# start of the JSON descriptor of a message sent through shared memory
+_SHM_PREFIX = f'{{"{SHM_KEY}":'.encode("utf-8")
 JOB_LABEL = "job"
 JOB_NAME_LABEL = "name"
 JOB_VERSION_LABEL = "version"
@@ -87,6 +135,7 @@ JOB_Y_DATA_LABEL = "y"
 JOB_Y_DATA_SCHEMA_LABEL = "y-schema"
 JOB_PARAMS_SCHEMA_LABEL = "params-schema"
 JOB_SERVER_PATH_LABEL = "server-path"
+JOB_REPLICA_LABEL = "replica"
 SERVER_PORT = "8080"
 JOB_CONFIG_FILE_NAME = "config.json"
 
@@ -123,6 +172,15 @@ class SupervisedJobClient(Generic[X, Y]):
     y_cls: Optional[Type[Y]] = None
     uri: Optional[str] = None
     uid: Optional[str] = None
+    wire_format: str = TENSOR_CONTENT_TYPE
+    accept_encoding: str = ", ".join(DEFAULT_ENCODINGS)
+    received_stats: Optional[CompressionStats] = None
+    server_stats: Optional[CompressionStats] = None
+    prefetch_stats: Optional[PrefetchStats] = None
+    cursor: Optional[Cursor] = None
+    batch_count: Optional[BatchCount] = None
+    params: Optional[Dict[str, Any]] = None
+    _recording: Optional[SegmentWriter] = None
 
     def __init__(
         self,
@@ -136,6 +194,7 @@ class SupervisedJobClient(Generic[X, Y]):
         scm: Optional[SCM] = None,
         sync_strategy: RemoteSyncStrategy = RemoteSyncStrategy.IMAGE,
         dev_dependencies: Optional[bool] = None,
+        replica: int = 0,
         **kwargs,
     ) -> None:
         """Create a SupervisedJobClient
@@ -144,6 +203,7 @@ class SupervisedJobClient(Generic[X, Y]):
             # should this just be a container for now?
             uri (str): OCI URI to the model
             docker_socket (str, optional): docker socket to use. Defaults to None.
+            replica (int, optional): Which replica of the job to connect to, each runs in its own pod. Defaults to 0.
         """
 
         self.uri = uri
@@ -151,6 +211,7 @@ class SupervisedJobClient(Generic[X, Y]):
         params: Optional[Dict[str, Any]] = None
         if len(kwargs) != 0:
             params = kwargs
+        self.params = params
 
         if is_k8s_proc():
             logging.info("running in kubernetes")
@@ -243,7 +304,8 @@ class SupervisedJobClient(Generic[X, Y]):
                 continue
             if JOB_LABEL in annotations:
                 server_job_uri = annotations[JOB_LABEL]
-                if server_job_uri == uri:
+                server_replica = annotations.get(JOB_REPLICA_LABEL, "0")
+                if server_job_uri == uri and server_replica == str(replica):
                     logging.info("found job running in cluster")
                     self.server_addr = f"http://{pod_name}.pod.{namespace}.kubernetes:{SERVER_PORT}"
                     self.pod_name = pod_name
@@ -298,6 +360,9 @@ class SupervisedJobClient(Generic[X, Y]):
         pod_name = f"{str(project_name).replace('/', '-')}-{tag}"
         if len(pod_name) > 63:
             pod_name = pod_name[:62]
+        if replica > 0:
+            suffix = f"-r{replica}"
+            pod_name = pod_name[: 62 - len(suffix)] + suffix
 
         if params is not None:
             cfg = V1ConfigMap(
@@ -372,6 +437,7 @@ class SupervisedJobClient(Generic[X, Y]):
                     JOB_X_DATA_SCHEMA_LABEL: self.model_x_schema,
                     JOB_Y_DATA_SCHEMA_LABEL: self.model_y_schema,
                     JOB_PARAMS_SCHEMA_LABEL: self.model_params_schema,
+                    JOB_REPLICA_LABEL: str(replica),
                 },
             ),
             spec=spec,
@@ -437,6 +503,17 @@ class SupervisedJobClient(Generic[X, Y]):
         x_cls: Type[X] = args[0]
         y_cls: Type[Y] = args[1]
 
+    def _check_wire_policy(self) -> None:
+        """Warn if the job encodes X or Y with a different wire policy than the client expects"""
+
+        for name, schema, cls in (("x", self.model_x_schema, self.x_cls), ("y", self.model_y_schema, self.y_cls)):
+            policy = wire_policy_from_schema(schema)
+            if policy != cls.wire_policy:
+                logging.warning(
+                    f"job sends {name} with wire policy {policy} but {cls.__name__} declares {cls.wire_policy}, "
+                    + "arrays will still be restored to their original dtype"
+                )
+
     def info(self) -> Dict[str, Any]:
         """Info about the server
 
@@ -458,78 +535,525 @@ class SupervisedJobClient(Generic[X, Y]):
         resp = request.urlopen(req)
         return resp.read().decode("utf-8")
 
-    # TODO: stream_one() that uses basic HTTP requests for environments that don't like upgrading
-
     def stream(
         self,
         batch_size: int = DEFAULT_BATCH_SIZE,
         batch_type: BatchType = BatchType.TRAIN,
+        resume_from: Optional[Union[Cursor, str]] = None,
+        shard: int = 0,
+        num_shards: int = 1,
+        epochs: int = 1,
+        seed: Optional[int] = None,
+        shuffle: bool = True,
+        drop_last: bool = True,
+        strategy: SampleStrategy = SampleStrategy.RANDOM,
+        target_bytes: Optional[int] = None,
+        target_ms: Optional[float] = None,
+        min_batch_size: int = 1,
+        max_batch_size: Optional[int] = None,
+        options: Optional[StreamOptions] = None,
     ) -> Iterator[Tuple[X, Y]]:
         """Stream data
 
+        Batches are decoded as views over the received message, so their arrays are not copied again after leaving
+        the socket. Messages are compressed when the job supports one of the encodings in `accept_encoding`, the
+        counters for the last stream are kept in `received_stats` and `server_stats`.
+
+        The job sends the static fields of X and Y once in a session header, each batch only carries its arrays and
+        batch fields.
+
         Args:
             batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
             batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            resume_from (Union[Cursor, str], optional): Cursor or cursor token to resume a dropped stream from, e.g.
+                `client.cursor` which is the position after the last batch yielded. Defaults to None.
+            shard (int, optional): Which shard of the stream to take, see `ShardedJobClient`. Defaults to 0.
+            num_shards (int, optional): Number of shards the stream is split into, shard `i` gets every
+                `num_shards`th batch starting at batch `i`. Defaults to 1.
+            epochs (int, optional): Number of epochs to stream, `cursor.epoch` tells which one a batch is from.
+                Defaults to 1.
+            seed (int, optional): Seed of the epochs' permutations. Defaults to None, which lets the job pick one.
+            shuffle (bool, optional): Shuffle each epoch, if the job supports it. Defaults to True.
+            drop_last (bool, optional): Drop the last partial batch of each epoch. Defaults to True.
+            strategy (SampleStrategy, optional): Draw each batch stratified or balanced by class instead of in the
+                job's order, see `SupervisedJob.sample_classes`. Defaults to SampleStrategy.RANDOM.
+            target_bytes (int, optional): Encoded bytes per batch the job resizes batches for, starting at
+                `batch_size`. Defaults to None.
+            target_ms (float, optional): Milliseconds per step the job resizes batches for, where a step is the time
+                the caller spends with each batch e.g. fitting a model on it. Defaults to None.
+            min_batch_size (int, optional): Smallest batch size when resizing, sizes are this times a power of two.
+                Defaults to 1.
+            max_batch_size (int, optional): Largest batch size when resizing. Defaults to None, which is 64 times
+                `batch_size`.
+            options (StreamOptions, optional): Buffering, flow control and broadcast options. Queue occupancy of a
+                prefetching stream is kept in `prefetch_stats`. Defaults to None, which is `StreamOptions()`.
 
         Yields:
             Iterator[Tuple[X, Y]]: An iterator of X and Y
         """
+        if options is None:
+            options = StreamOptions()
+        adaptive = target_bytes is not None or target_ms is not None
+        if adaptive and (options.broadcast or num_shards > 1):
+            raise ValueError("batch size targets need an unsharded stream that isn't broadcast")
+        if options.prefetch > 0 and options.recv_buffers is not None and options.recv_buffers < options.prefetch + 2:
+            raise ValueError("recv_buffers must be at least prefetch + 2 so queued batches aren't overwritten")
+        if options.broadcast and resume_from is not None:
+            raise ValueError("broadcast streams can't be resumed")
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"shard {shard} out of range for {num_shards} shards")
+
         server_addr = f"{self.pod_name}.pod.{self.pod_namespace}.kubernetes:{SERVER_PORT}"
+        query = f"batch_size={batch_size}&batch_type={batch_type}&batches_per_message={options.batches_per_message}"
+        query += f"&{WINDOW_PARAM}={options.window}&{EPOCHS_PARAM}={epochs}"
+        query += f"&{SHUFFLE_PARAM}={int(shuffle)}&{DROP_LAST_PARAM}={int(drop_last)}"
+        query += f"&{STRATEGY_PARAM}={SampleStrategy(strategy).value}"
+        if adaptive:
+            query += f"&{MIN_BATCH_SIZE_PARAM}={min_batch_size}"
+            if max_batch_size is not None:
+                query += f"&{MAX_BATCH_SIZE_PARAM}={max_batch_size}"
+            if target_bytes is not None:
+                query += f"&{TARGET_BYTES_PARAM}={target_bytes}"
+            if target_ms is not None:
+                query += f"&{TARGET_MS_PARAM}={target_ms}"
+        if seed is not None:
+            query += f"&{SEED_PARAM}={seed}"
+        if num_shards > 1:
+            query += f"&{SHARD_PARAM}={shard}&{NUM_SHARDS_PARAM}={num_shards}"
+        if options.broadcast:
+            query += f"&{BROADCAST_PARAM}=1&{SUBSCRIBERS_PARAM}={options.subscribers}"
+            query += f"&{STRAGGLER_PARAM}={StragglerPolicy(options.straggler).value}"
+        if resume_from is not None:
+            if isinstance(resume_from, Cursor):
+                resume_from = resume_from.token()
+            query += f"&{RESUME_PARAM}={resume_from}"
+        shared_memory = options.shared_memory and is_tensor(self.wire_format)
+        if shared_memory:
+            query += f"&{SHM_PARAM}={parse.quote(host_id())}"
 
         # you need to create your own socket here
         sock = socket.create_connection((f"{self.pod_name}.pod.{self.pod_namespace}.kubernetes", SERVER_PORT))
         if self.uid is None:
             self.uid = uuid.uuid4()
         ws = create_connection(
-            f"ws://{server_addr}/stream?batch_size={batch_size}&batch_type={batch_type}",
-            header=[f"client-uuid: {self.uid}"],
+            f"ws://{server_addr}/stream?{query}",
+            header=[
+                f"client-uuid: {self.uid}",
+                f"accept: {self.wire_format}",
+                f"accept-encoding: {self.accept_encoding}",
+            ],
             socket=sock,
         )
+        ring = RecvRing(options.recv_buffers) if options.recv_buffers is not None else None
+        shm_ring, first = self._accept_ring(ws) if shared_memory else (None, None)
+        self.received_stats = CompressionStats()
+        segment, self._recording = self._recording, None
+
+        # the time the caller spends with each batch, reported back with the credits when the job resizes for it
+        steps: Optional[Dict[str, Any]] = {} if target_ms is not None else None
+
+        if options.prefetch == 0:
+            try:
+                for x, y, cursor in self._recv_batches(ws, ring, options.window, steps, shm_ring, segment, first):
+                    self.cursor = cursor
+                    start = time.perf_counter()
+                    yield x, y
+                    if steps is not None:
+                        steps.update(
+                            {STEP_MS_KEY: (time.perf_counter() - start) * 1000, BATCH_SIZE_KEY: cursor.batch_size}
+                        )
+            finally:
+                ws.close()
+                if shm_ring is not None:
+                    shm_ring.close()
+            return
+
+        # shutting down the socket unblocks the receive on the prefetch thread if the caller stops early
+        prefetcher = Prefetcher(
+            lambda: self._recv_batches(ws, ring, options.window, steps, shm_ring, segment, first),
+            options.prefetch,
+            interrupt=ws.abort,
+        )
+        self.prefetch_stats = prefetcher.stats
+        try:
+            # the cursor is set here rather than on the prefetch thread, which runs ahead of the caller
+            for x, y, cursor in prefetcher:
+                self.cursor = cursor
+                start = time.perf_counter()
+                yield x, y
+                if steps is not None:
+                    steps.update({STEP_MS_KEY: (time.perf_counter() - start) * 1000, BATCH_SIZE_KEY: cursor.batch_size})
+            ws.close()
+        finally:
+            prefetcher.close()
+            ws.shutdown()
+            if shm_ring is not None:
+                shm_ring.close()
+            stats = prefetcher.stats
+            logging.info(
+                f"stream prefetch mean occupancy: {stats.mean_occupancy:.2f}, "
+                + f"waited on the job for {stats.empty}/{stats.items} batches, {stats.wait_seconds:.3f} seconds"
+            )
+
+    def stream_cached(
+        self,
+        epoch_cache: EpochCache,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        shard: int = 0,
+        num_shards: int = 1,
+        epochs: int = 1,
+        seed: Optional[int] = None,
+        shuffle: bool = True,
+        drop_last: bool = True,
+        strategy: SampleStrategy = SampleStrategy.RANDOM,
+        options: Optional[StreamOptions] = None,
+    ) -> Iterator[Tuple[X, Y]]:
+        """Stream data through an epoch cache
+
+        Each epoch received is kept on disk and the epochs it already holds are replayed instead of streamed from the
+        job, see `EpochCache`. Epochs only repeat with a `seed` or without shuffling, so one of them is needed.
+
+        Args:
+            epoch_cache (EpochCache): Cache to record epochs into and replay them from
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            shard (int, optional): Which shard of the stream to take. Defaults to 0.
+            num_shards (int, optional): Number of shards the stream is split into. Defaults to 1.
+            epochs (int, optional): Number of epochs to stream. Defaults to 1.
+            seed (int, optional): Seed of the epochs' permutations. Defaults to None.
+            shuffle (bool, optional): Shuffle each epoch, if the job supports it. Defaults to True.
+            drop_last (bool, optional): Drop the last partial batch of each epoch. Defaults to True.
+            strategy (SampleStrategy, optional): Draw each batch stratified or balanced by class.
+                Defaults to SampleStrategy.RANDOM.
+            options (StreamOptions, optional): Options for the epochs streamed from the job, which can't be
+                broadcast. Defaults to None.
+
+        Raises:
+            ValueError: If the epochs can't repeat or the stream can't be recorded
+
+        Yields:
+            Iterator[Tuple[X, Y]]: An iterator of X and Y
+        """
+        if options is not None and options.broadcast:
+            raise ValueError("the epoch cache needs a stream that isn't broadcast")
+        if shuffle and seed is None:
+            raise ValueError("the epoch cache needs a seed or shuffle=False, a seed the job picks never repeats")
+        if not is_tensor(self.wire_format):
+            raise ValueError("the epoch cache keeps binary messages, it needs a tensor wire format")
+        if not shuffle:
+            seed = None
+
+        info = self.info()
+        # unshuffled epochs in the job's own order are the same batches unless they are augmented, one segment serves
+        # all of them. Class aware epochs are drawn per epoch, and jobs streaming from `stream` may shuffle in it
+        repeats = (
+            not shuffle
+            and SampleStrategy(strategy) == SampleStrategy.RANDOM
+            and info.get("repeatable", False)
+            and not info.get("augment", True)
+        )
+        stream_key = (
+            self.uri,
+            info.get("version"),
+            self.params,
+            batch_size,
+            BatchType(batch_type).value,
+            shard,
+            num_shards,
+            drop_last,
+            SampleStrategy(strategy).value,
+            seed,
+        )
+
+        for epoch in range(epochs):
+            key = epoch_cache.key(*stream_key, None if repeats else epoch)
+            messages = epoch_cache.read(key)
+            if messages is not None:
+                logging.info(f"replaying epoch {epoch} from the epoch cache")
+                self.received_stats = CompressionStats()
+                for x, y, cursor in self._decode_messages(messages):
+                    self.cursor = Cursor(epoch, cursor.seed, cursor.index, cursor.batch_size)
+                    yield x, y
+                continue
+
+            # the segment is committed when the epoch's last message arrives, anything short of that is dropped
+            segment = epoch_cache.write(key)
+            self._recording = segment
+            try:
+                yield from self.stream(
+                    batch_size,
+                    batch_type,
+                    resume_from=Cursor(epoch, seed),
+                    shard=shard,
+                    num_shards=num_shards,
+                    epochs=epoch + 1,
+                    seed=seed,
+                    shuffle=shuffle,
+                    drop_last=drop_last,
+                    strategy=strategy,
+                    options=options,
+                )
+            finally:
+                self._recording = None
+                segment.abort()
+
+    def stream_http(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        count: Optional[int] = None,
+        batches_per_message: int = 1,
+        resume_from: Optional[Union[Cursor, str]] = None,
+        shard: int = 0,
+        num_shards: int = 1,
+        epochs: int = 1,
+        seed: Optional[int] = None,
+        shuffle: bool = True,
+        drop_last: bool = True,
+        strategy: SampleStrategy = SampleStrategy.RANDOM,
+        max_count: int = 256,
+    ) -> Iterator[Tuple[X, Y]]:
+        """Stream data over plain HTTP requests, for networks that don't allow websocket upgrades
+
+        Each request fetches `count` batches from `/batches` starting at the cursor, over one kept alive connection.
+        The response streams in as the job produces it, so a count large enough to hide the round trip gets close to
+        the throughput of `stream`. The count used for the next request is kept in `batch_count`.
+
+        Args:
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            count (int, optional): Number of batches per request. Defaults to None, which picks it from the measured
+                round trip time, see `BatchCount`.
+            batches_per_message (int, optional): Number of batches the job packs into each message. Defaults to 1.
+            resume_from (Union[Cursor, str], optional): Cursor or cursor token to start from. Defaults to None.
+            shard (int, optional): Which shard of the stream to take. Defaults to 0.
+            num_shards (int, optional): Number of shards the stream is split into. Defaults to 1.
+            epochs (int, optional): Number of epochs to stream. Defaults to 1.
+            seed (int, optional): Seed of the epochs' permutations. Defaults to None, which picks one.
+            shuffle (bool, optional): Shuffle each epoch, if the job supports it. Defaults to True.
+            drop_last (bool, optional): Drop the last partial batch of each epoch. Defaults to True.
+            strategy (SampleStrategy, optional): Draw each batch stratified or balanced by class.
+                Defaults to SampleStrategy.RANDOM.
+            max_count (int, optional): Largest count to pick when `count` is None. Defaults to 256.
+
+        Yields:
+            Iterator[Tuple[X, Y]]: An iterator of X and Y
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"shard {shard} out of range for {num_shards} shards")
+
+        # the client picks the seed, every request has to ask for the same permutation
+        explicit_seed = seed is not None
+        if resume_from is None:
+            if shuffle and seed is None:
+                seed = random.randrange(2**31)
+            resume_from = Cursor(seed=seed if shuffle else None)
+        elif isinstance(resume_from, str):
+            resume_from = Cursor.parse(resume_from)
+        self.cursor = resume_from
+
+        query = f"batch_size={batch_size}&batch_type={batch_type}&batches_per_message={batches_per_message}"
+        query += f"&{EPOCHS_PARAM}={epochs}&{DROP_LAST_PARAM}={int(drop_last)}"
+        query += f"&{STRATEGY_PARAM}={SampleStrategy(strategy).value}"
+        if explicit_seed:
+            query += f"&{SEED_PARAM}={self.cursor.seed}"
+        if num_shards > 1:
+            query += f"&{SHARD_PARAM}={shard}&{NUM_SHARDS_PARAM}={num_shards}"
+
+        if count is None:
+            self.batch_count = BatchCount(max_count=max_count)
+        else:
+            self.batch_count = BatchCount(count, min_count=count, max_count=count)
+        self.received_stats = CompressionStats()
+        addr = parse.urlparse(self.server_addr)
+        conn = HTTPConnection(addr.hostname, addr.port)
         try:
             while True:
-                total_start = time.time()
-                op_code, data = ws.recv_data()
-                if self.x_cls is None or self.y_cls is None:
-                    print("self dict: ", self.__dict__)
-                    args = typing.get_args(self.__orig_class__)
-                    self.x_cls: Type[X] = args[0]
-                    self.y_cls: Type[Y] = args[1]
-
-                jdict = json.loads(data)
-                end = jdict["end"]
-                if end:
-                    break
-                x = self.x_cls.load_dict(jdict["x"])
-                y = self.y_cls.load_dict(jdict["y"])
-                yield (x, y)
+                requested = self.batch_count.count
+                start = time.perf_counter()
+                conn.request(
+                    "GET",
+                    f"/batches?{query}&{CURSOR_PARAM}={self.cursor.token()}&{COUNT_PARAM}={requested}",
+                    headers={"accept": self.wire_format, "accept-encoding": self.accept_encoding},
+                )
+                resp = conn.getresponse()
+                if resp.status != 200:
+                    raise ConnectionError(f"/batches failed with {resp.status}: {resp.read()!r}")
+
+                received = 0
+                first = 0.0
+                for x, y, cursor in self._read_batches(resp):
+                    if received == 0:
+                        first = time.perf_counter() - start
+                    received += 1
+                    self.cursor = cursor
+                    yield x, y
+                if received < requested:
+                    return
+                # the caller's time with each batch counts too, the round trip only has to be small next to both
+                self.batch_count.update(received, first, time.perf_counter() - start)
+        finally:
+            conn.close()
 
-                total_end = time.time()
-                # print("total loop time: ", total_end - total_start)
-        except Exception as e:
-            print("stream exception: ", e)
-            raise e
+    def _read_batches(self, resp: HTTPResponse) -> Iterator[Tuple[X, Y, Cursor]]:
+        yield from self._decode_messages(read_length_prefixed(resp.read))
 
-    def sample(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[X, Y]:
+    def _decode_messages(self, messages: Iterable[Buffer]) -> Iterator[Tuple[X, Y, Cursor]]:
+        if self.x_cls is None or self.y_cls is None:
+            args = typing.get_args(self.__orig_class__)
+            self.x_cls: Type[X] = args[0]
+            self.y_cls: Type[Y] = args[1]
+            self._check_wire_policy()
+
+        session: Dict[str, Dict[str, Any]] = {}
+        for msg in messages:
+            if not is_tensor(self.wire_format):
+                jdict = json.loads(msg)
+                if jdict["end"]:
+                    continue
+                cursor = Cursor.load_dict(jdict["cursor"])
+                yield self.x_cls.load_dict(jdict["x"]), self.y_cls.load_dict(jdict["y"]), cursor.advance()
+                continue
+
+            data = decompress_message(msg, self.received_stats)
+            fields, batches = decode_batches(data, {"x": self.x_cls, "y": self.y_cls}, session, copy=False)
+            if "session" in fields:
+                session = {name: part["fields"] for name, part in fields["session"].items()}
+                continue
+            if "compression" in fields:
+                self.server_stats = CompressionStats.load_dict(fields["compression"])
+            if "cursor" in fields:
+                cursor = Cursor.load_dict(fields["cursor"])
+                for i, batch in enumerate(batches):
+                    yield batch["x"], batch["y"], cursor.advance(i + 1)
+
+    def _accept_ring(self, ws: WebSocket) -> Tuple[Optional[ShmRing], Optional[Tuple[int, memoryview]]]:
+        # the server answers a client that sent its host with a ring to attach to, or None, servers that don't know
+        # about shared memory start the stream straight away and their first message is handed on to _recv_batches
+        op_code, data = recv_message(ws)
+        if op_code != ABNF.OPCODE_TEXT or bytes(data[: len(_SHM_PREFIX)]) != _SHM_PREFIX:
+            return None, (op_code, data)
+        offer = json.loads(bytes(data))[SHM_KEY]
+        shm_ring = None
+        if offer is not None:
+            try:
+                shm_ring = ShmRing.attach(offer["name"], offer["nonce"])
+            except (OSError, ValueError) as e:
+                logging.info(f"streaming over the socket, could not attach to the job's shared memory: {e}")
+            ws.send(json.dumps({SHM_KEY: shm_ring is not None}))
+        return shm_ring, None
+
+    def _recv_batches(
+        self,
+        ws: WebSocket,
+        ring: Optional[RecvRing],
+        window: int,
+        steps: Optional[Dict[str, Any]] = None,
+        shm_ring: Optional[ShmRing] = None,
+        segment: Optional[SegmentWriter] = None,
+        first: Optional[Tuple[int, memoryview]] = None,
+    ) -> Iterator[Tuple[X, Y, Optional[Cursor]]]:
+        session: Dict[str, Dict[str, Any]] = {}
+        # grant credits back in chunks rather than for every batch
+        grant_every = max(1, window // 2)
+        consumed = 0
+        while True:
+            if first is not None:
+                op_code, data = first
+                first = None
+            else:
+                op_code, data = recv_message(ws, ring)
+            if op_code == ABNF.OPCODE_CLOSE:
+                break
+            if self.x_cls is None or self.y_cls is None:
+                args = typing.get_args(self.__orig_class__)
+                self.x_cls: Type[X] = args[0]
+                self.y_cls: Type[Y] = args[1]
+                self._check_wire_policy()
+
+            # binary messages sent through shared memory arrive as descriptors
+            if shm_ring is not None and op_code == ABNF.OPCODE_TEXT and bytes(data[: len(_SHM_PREFIX)]) == _SHM_PREFIX:
+                desc = json.loads(bytes(data))[SHM_KEY]
+                if ring is not None:
+                    # the descriptor is parsed, its buffer can take the message
+                    ring.give_back()
+                op_code, data = ABNF.OPCODE_BINARY, shm_ring.read(desc, ring.take(desc[1]) if ring else None)
+
+            if op_code == ABNF.OPCODE_BINARY:
+                if segment is not None:
+                    segment.append(data)
+                data = decompress_message(data, self.received_stats)
+                fields, batches = decode_batches(data, {"x": self.x_cls, "y": self.y_cls}, session, copy=False)
+                if "session" in fields:
+                    session = {name: part["fields"] for name, part in fields["session"].items()}
+                    continue
+                cursor = Cursor.load_dict(fields["cursor"]) if "cursor" in fields else None
+                for i, batch in enumerate(batches):
+                    yield (batch["x"], batch["y"], cursor.advance(i + 1) if cursor is not None else None)
+                    consumed += 1
+                if fields["end"]:
+                    if segment is not None:
+                        segment.commit()
+                    if "compression" in fields:
+                        self.server_stats = CompressionStats.load_dict(fields["compression"])
+                        logging.info(
+                            f"stream compression ratio: {self.server_stats.ratio:.2f}, "
+                            + f"server seconds: {self.server_stats.seconds:.3f}, "
+                            + f"client seconds: {self.received_stats.seconds:.3f}"
+                        )
+                    break
+                if (window > 0 or steps) and consumed >= grant_every:
+                    ws.send(json.dumps({CREDIT_KEY: consumed, **(steps or {})}))
+                    consumed = 0
+                continue
+
+            jdict = json.loads(bytes(data))
+            end = jdict["end"]
+            if end:
+                break
+            x = self.x_cls.load_dict(jdict["x"])
+            y = self.y_cls.load_dict(jdict["y"])
+            cursor = Cursor.load_dict(jdict["cursor"]) if "cursor" in jdict else None
+            yield (x, y, cursor.advance() if cursor is not None else None)
+            consumed += 1
+            if (window > 0 or steps) and consumed >= grant_every:
+                ws.send(json.dumps({CREDIT_KEY: consumed, **(steps or {})}))
+                consumed = 0
+
+    def sample(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, strategy: SampleStrategy = SampleStrategy.RANDOM
+    ) -> Tuple[X, Y]:
         """Sample data
 
         Args:
             batch_size (int, optional): Size of the batch. Defaults to 32.
+            strategy (SampleStrategy, optional): How rows are picked, stratified and balanced need a job with class
+                labels. Defaults to SampleStrategy.RANDOM.
 
         Returns:
             Tuple[X, Y]: A tuple of X and Y
         """
 
-        params = parse.urlencode({"batch_size": batch_size})
-        req = request.Request(f"{self.server_addr}/sample?{params}")
+        params = parse.urlencode({"batch_size": batch_size, STRATEGY_PARAM: SampleStrategy(strategy).value})
+        req = request.Request(
+            f"{self.server_addr}/sample?{params}",
+            headers={"accept": self.wire_format, "accept-encoding": self.accept_encoding},
+        )
         resp = request.urlopen(req)
-        resp_data = resp.read().decode("utf-8")
+        resp_data = decompress(resp.headers.get("content-encoding"), resp.read())
 
         if self.x_cls is None:
             args = typing.get_args(self.__orig_class__)
             self.x_cls: Type[X] = args[0]
             self.y_cls: Type[Y] = args[1]
+            self._check_wire_policy()
 
-        jdict = json.loads(resp_data)
+        if is_tensor(resp.headers.get("content-type")):
+            _, parts = decode_message(resp_data, {"x": self.x_cls, "y": self.y_cls})
+            return (parts["x"], parts["y"])
+
+        jdict = json.loads(bytes(resp_data).decode("utf-8"))
         x = self.x_cls.load_dict(jdict["x"])
         y = self.y_cls.load_dict(jdict["y"])
         return (x, y)
@@ -539,6 +1063,9 @@ class SupervisedJobClient(Generic[X, Y]):
         model: SupervisedModel[X, Y] | SupervisedModelClient[X, Y],
         batch_size: int = DEFAULT_BATCH_SIZE,
         store: bool = True,
+        target_ms: Optional[float] = None,
+        min_batch_size: int = 1,
+        max_batch_size: Optional[int] = None,
     ) -> EvalReport:
         """Evaluate a model
 
@@ -546,6 +1073,11 @@ class SupervisedJobClient(Generic[X, Y]):
             model (SupervisedModel | SupervisedModelClient): Model to evaluate
             batch_size (int): Batch size. Defaults to 32
             store (bool): Store the report as an artifact. Defaults to True
+            target_ms (float, optional): Milliseconds per prediction to resize the batches for, starting at
+                `batch_size`. Defaults to None, which keeps `batch_size`.
+            min_batch_size (int, optional): Smallest batch size when resizing. Defaults to 1.
+            max_batch_size (int, optional): Largest batch size when resizing. Defaults to None, which is 64 times
+                `batch_size`.
 
         Returns:
             Report: A report of the evaluation
@@ -575,7 +1107,10 @@ class SupervisedJobClient(Generic[X, Y]):
         if uri is None:
             raise ValueError("model uri cannot be none")
 
-        params = json.dumps({"model_uri": uri, "batch_size": batch_size, "store": store}).encode("utf8")
+        params = {"model_uri": uri, "batch_size": batch_size, "store": store}
+        if target_ms is not None:
+            params.update(target_ms=target_ms, min_batch_size=min_batch_size, max_batch_size=max_batch_size)
+        params = json.dumps(params).encode("utf8")
         req = request.Request(f"{self.server_addr}/evaluate", data=params, headers={"content-type": "application/json"})
         resp = request.urlopen(req)
         resp_data = resp.read().decode("utf-8")
@@ -616,6 +1151,119 @@ class SupervisedJobClient(Generic[X, Y]):
         return reports
 
 
+class ShardedJobClient(Generic[X, Y]):
+    """A client for several replicas of a supervised job, streaming a shard of the epoch from each
+
+    Batch `i` of the epoch comes from replica `i % n`. Each shard is received and decoded on its own thread and the
+    shards are interleaved round robin, so batches come out in the same order as from a single replica while throughput
+    scales with the number of replicas.
+    """
+
+    clients: List[SupervisedJobClient[X, Y]]
+    cursors: List[Optional[Cursor]]
+
+    def __init__(self, clients: List[SupervisedJobClient[X, Y]]) -> None:
+        """Create a ShardedJobClient
+
+        Args:
+            clients (List[SupervisedJobClient[X, Y]]): A client for each replica, in replica order
+        """
+        if len(clients) == 0:
+            raise ValueError("a sharded job needs at least one replica")
+        self.clients = clients
+        self.cursors = [None] * len(clients)
+
+    def stream(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        resume_from: Optional[List[Union[Cursor, str]]] = None,
+        seed: Optional[int] = None,
+        shuffle: bool = True,
+        options: Optional[StreamOptions] = None,
+        **kwargs,
+    ) -> Iterator[Tuple[X, Y]]:
+        """Stream data from every replica
+
+        Args:
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            resume_from (List[Union[Cursor, str]], optional): Cursor of each shard to resume from, e.g. `cursors`
+                which is kept up to date as batches are yielded. Defaults to None, which starts a new epoch.
+            seed (int, optional): Seed of the epochs' permutations, the replicas cache the epochs of a seed given here,
+                pass it again when resuming to keep them cached. Defaults to None, which picks one.
+            shuffle (bool, optional): Shuffle each epoch, if the job supports it. Defaults to True.
+            options (StreamOptions, optional): Options for the stream of each shard. Defaults to None, which
+                receives 2 batches ahead on each shard.
+            **kwargs: Other options for `SupervisedJobClient.stream`
+
+        Raises:
+            ValueError: If the stream is broadcast, shards are always streamed from a cursor
+
+        Yields:
+            Iterator[Tuple[X, Y]]: An iterator of X and Y
+        """
+        if options is None:
+            options = StreamOptions(prefetch=2)
+        if options.broadcast:
+            raise ValueError("sharded streams can't be broadcast, each shard is streamed from its own cursor")
+        num_shards = len(self.clients)
+        # only a seed the caller picked is asked for again, the replicas only cache those epochs
+        explicit_seed = seed if shuffle else None
+        if resume_from is None:
+            # every shard has to use the same permutation to be disjoint
+            if shuffle and seed is None:
+                seed = random.randrange(2**31)
+            resume_from = [Cursor(seed=seed if shuffle else None)] * num_shards
+        elif len(resume_from) != num_shards:
+            raise ValueError(f"got {len(resume_from)} cursors for {num_shards} shards")
+        resume_from = [Cursor.parse(c) if isinstance(c, str) else c for c in resume_from]
+
+        streams = [
+            client.stream(
+                batch_size,
+                batch_type,
+                resume_from=resume_from[i],
+                seed=explicit_seed,
+                shard=i,
+                num_shards=num_shards,
+                options=options,
+                **kwargs,
+            )
+            for i, client in enumerate(self.clients)
+        ]
+        try:
+            # a stream stopped partway through a round resumes with the shard furthest behind
+            first = min(range(num_shards), key=lambda i: (resume_from[i].epoch, resume_from[i].index, i))
+            active = list(range(first, num_shards)) + list(range(first))
+            while active:
+                for i in list(active):
+                    try:
+                        x, y = next(streams[i])
+                    except StopIteration:
+                        active.remove(i)
+                        continue
+                    self.cursors[i] = self.clients[i].cursor
+                    yield x, y
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def sample(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, strategy: SampleStrategy = SampleStrategy.RANDOM
+    ) -> Tuple[X, Y]:
+        """Sample data from one of the replicas
+
+        Args:
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            strategy (SampleStrategy, optional): How rows are picked. Defaults to SampleStrategy.RANDOM.
+
+        Returns:
+            Tuple[X, Y]: A tuple of X and Y
+        """
+        return random.choice(self.clients).sample(batch_size, strategy)
+
+
 class Job(ABC):
     """A machine learning job"""
 
@@ -667,6 +1315,11 @@ class SupervisedJob(Generic[X, Y], Job):
     x_cls: Optional[Type[X]] = None
     y_cls: Optional[Type[Y]] = None
     _uri: Optional[str] = None
+    frame_cache: Optional[FrameCache] = None
+    batch_workers: Optional[BatchWorkers] = None
+    augment: Optional[Callable[[Any, np.random.Generator], Any]] = None
+    """Augments the x of each training batch given a generator seeded for that batch, e.g. an ImageAugment. A plain
+    function assigned on the class is called as it is, not bound as a method"""
 
     @abstractmethod
     def stream(
@@ -685,6 +1338,288 @@ class SupervisedJob(Generic[X, Y], Job):
         """
         pass
 
+    def stream_from(
+        self,
+        cursor: Cursor,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        shard: int = 0,
+        num_shards: int = 1,
+        drop_last: bool = True,
+    ) -> Iterator[Tuple[X, Y]]:
+        """Stream a shard of one epoch starting at a cursor, used by the server to resume and shard streams
+
+        Shard `i` of `n` is batches `i, i + n, i + 2n...` of the epoch and `cursor.index` counts batches within the
+        shard. The default skips the batches it doesn't need from `stream`, which still generates them and ignores the
+        seed and `drop_last`. Jobs with array data should override this with `arc.data.shuffle.gather_batches`, which
+        seeks straight to the cursor and shuffles each epoch by `cursor.seed`, so every shard sees the same order, or
+        return an `arc.data.pipeline.Pipeline` run, whose stage timings the server then reports.
+
+        Args:
+            cursor (Cursor): Position to start at
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            shard (int, optional): Index of the shard. Defaults to 0.
+            num_shards (int, optional): Number of shards. Defaults to 1.
+            drop_last (bool, optional): Drop the last partial batch. Defaults to True.
+
+        Yields:
+            Iterator[Tuple[X, Y]]: An iterator of X and Y
+        """
+        start = shard + cursor.index * num_shards
+        return itertools.islice(self.stream(batch_size, batch_type), start, None, num_shards)
+
+    @property
+    def repeatable(self) -> bool:
+        """Whether epochs without a seed are the same batches every time, which needs `stream_from` overridden
+
+        The default `stream_from` takes its batches from `stream`, which may shuffle them on its own.
+        """
+        return type(self).stream_from is not SupervisedJob.stream_from
+
+    def stream_epochs(
+        self,
+        cursor: Cursor,
+        epochs: int = 1,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        shard: int = 0,
+        num_shards: int = 1,
+        drop_last: bool = True,
+        cache: Optional[FrameCache] = None,
+        strategy: SampleStrategy = SampleStrategy.RANDOM,
+        sizer: Optional[BatchSizer] = None,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Iterator[Tuple[Cursor, X, Y]]:
+        """Stream epochs up to `epochs` starting at a cursor, with the cursor of each batch
+
+        Each epoch after the first starts at index 0 with the same seed, the permutation comes from the seed and epoch.
+        Stratified and balanced epochs have as many batches as a plain one, each drawn from the class index with a
+        generator seeded by its cursor, see `sample_classes`. With a sizer, the batch size follows `sizer.size` and the
+        cursors carry it, resizing only at row offsets both sizes divide, which needs an unsharded stream. A cursor that
+        carries a batch size is resumed at that size, since its index counts batches of it. With a
+        cache, batches are read from it while they are cached and the job only streams from the first one that isn't,
+        caching what it yields. Only pass one for seeds that will be asked for again.
+
+        Args:
+            cursor (Cursor): Position to start at
+            epochs (int, optional): Epoch to stop before. Defaults to 1.
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            shard (int, optional): Index of the shard. Defaults to 0.
+            num_shards (int, optional): Number of shards. Defaults to 1.
+            drop_last (bool, optional): Drop the last partial batch of each epoch. Defaults to True.
+            cache (FrameCache, optional): Cache of encoded batches. Defaults to None.
+            strategy (SampleStrategy, optional): How batches are drawn, the job's own order for RANDOM.
+                Defaults to SampleStrategy.RANDOM.
+            sizer (BatchSizer, optional): Picks the batch size as the stream goes. Defaults to None.
+            pipeline_runs (List[PipelineStats], optional): Collects the stage timing of each pipeline run the batches
+                come from, for jobs streaming from an `arc.data.pipeline.Pipeline`, see `PipelineStats.merge`.
+                Defaults to None.
+
+        Raises:
+            ValueError: If a sizer is used on a sharded stream
+
+        Yields:
+            Iterator[Tuple[Cursor, X, Y]]: An iterator of cursor, X and Y
+        """
+        if sizer is not None and num_shards > 1:
+            raise ValueError("batches of sharded streams can't be resized")
+        if sizer is None and cursor.batch_size is not None:
+            batch_size = cursor.batch_size
+        if cursor.seed is None and self._augmenter() is not None and BatchType(batch_type) == BatchType.TRAIN:
+            # unseeded augmentation is drawn afresh each time, cached frames would replay it
+            cache = None
+
+        for epoch in range(cursor.epoch, epochs):
+            if epoch != cursor.epoch:
+                cursor = Cursor(epoch, cursor.seed, 0, cursor.batch_size)
+            if sizer is not None:
+                cursor = yield from self._sized_epoch(
+                    cursor, batch_size, batch_type, drop_last, cache, strategy, sizer, pipeline_runs
+                )
+                continue
+            args = (cursor, batch_size, batch_type, shard, num_shards, drop_last, strategy, pipeline_runs)
+            batches = self._epoch(*args) if cache is None else self._cached_epoch(cache, *args)
+            for x, y in batches:
+                yield cursor, x, y
+                cursor = cursor.advance()
+
+    def _sized_epoch(
+        self,
+        cursor: Cursor,
+        batch_size: int,
+        batch_type: BatchType,
+        drop_last: bool,
+        cache: Optional[FrameCache],
+        strategy: SampleStrategy,
+        sizer: BatchSizer,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Generator[Tuple[Cursor, X, Y], None, Cursor]:
+        # the index of a cursor without a size counts batches of the size the stream was asked for
+        size = cursor.batch_size or (batch_size if cursor.index else sizer.size)
+        rows = cursor.index * size
+        while True:
+            cursor = Cursor(cursor.epoch, cursor.seed, rows // size, size)
+            args = (cursor, size, batch_type, 0, 1, drop_last, strategy, pipeline_runs)
+            batches = self._epoch(*args) if cache is None else self._cached_epoch(cache, *args)
+            resized = False
+            try:
+                for x, y in batches:
+                    yield cursor, x, y
+                    cursor = cursor.advance()
+                    rows += size
+                    if sizer.target_bytes is not None:
+                        sizer.observe_bytes(size, len(x.repr_batch_bytes()) + len(y.repr_batch_bytes()))
+                    # switch once the rows so far are a whole number of batches of the new size
+                    if sizer.size != size and rows % sizer.size == 0:
+                        size = sizer.size
+                        resized = True
+                        break
+            finally:
+                batches.close()
+            if not resized:
+                return cursor
+
+    def _epoch(
+        self,
+        cursor: Cursor,
+        batch_size: int,
+        batch_type: BatchType,
+        shard: int,
+        num_shards: int,
+        drop_last: bool,
+        strategy: SampleStrategy,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Iterator[Tuple[X, Y]]:
+        args = (cursor, batch_size, batch_type, shard, num_shards, drop_last, strategy, pipeline_runs)
+        if self.batch_workers is not None:
+            return self.batch_workers.epoch(*args)
+        return self._produce_epoch(*args)
+
+    def _produce_epoch(
+        self,
+        cursor: Cursor,
+        batch_size: int,
+        batch_type: BatchType,
+        shard: int,
+        num_shards: int,
+        drop_last: bool,
+        strategy: SampleStrategy,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Iterator[Tuple[X, Y]]:
+        batches = self._draw_epoch(
+            cursor, batch_size, batch_type, shard, num_shards, drop_last, strategy, pipeline_runs
+        )
+        augment = self._augmenter()
+        if augment is None or BatchType(batch_type) != BatchType.TRAIN:
+            return batches
+        return self._augmented(augment, batches, cursor, shard, num_shards)
+
+    def _augmenter(self) -> Optional[Callable[[Any, np.random.Generator], Any]]:
+        # looked up without binding, a function set on the class would otherwise be passed the job as its x
+        if "augment" in self.__dict__:
+            return self.__dict__["augment"]
+        for klass in type(self).__mro__:
+            if "augment" in klass.__dict__:
+                augment = klass.__dict__["augment"]
+                return augment.__func__ if isinstance(augment, staticmethod) else augment
+        return None
+
+    def _augmented(
+        self,
+        augment: Callable[[Any, np.random.Generator], Any],
+        batches: Iterator[Tuple[X, Y]],
+        cursor: Cursor,
+        shard: int,
+        num_shards: int,
+    ) -> Iterator[Tuple[X, Y]]:
+        if cursor.seed is None:
+            # unseeded streams differ between runs, so does their augmentation
+            rng = np.random.default_rng()
+            for x, y in batches:
+                yield augment(x, rng), y
+            return
+
+        # seeded by the batch's index in the epoch, so shards, workers and resumed streams augment it the same way
+        for k, (x, y) in enumerate(batches):
+            i = shard + (cursor.index + k) * num_shards
+            rng = np.random.default_rng([cursor.seed, cursor.epoch, i, 1])
+            yield augment(x, rng), y
+
+    def _draw_epoch(
+        self,
+        cursor: Cursor,
+        batch_size: int,
+        batch_type: BatchType,
+        shard: int,
+        num_shards: int,
+        drop_last: bool,
+        strategy: SampleStrategy,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Iterator[Tuple[X, Y]]:
+        if SampleStrategy(strategy) == SampleStrategy.RANDOM:
+            batches = self.stream_from(cursor, batch_size, batch_type, shard, num_shards, drop_last)
+            # jobs streaming from a pipeline report the timing of its stages to the stream, see arc.data.pipeline
+            if isinstance(batches, PipelineRun) and pipeline_runs is not None:
+                pipeline_runs.append(batches.stats)
+            yield from batches
+            return
+
+        index = self._require_class_index(batch_type)
+        for i in range(shard + cursor.index * num_shards, num_batches(len(index), batch_size, drop_last), num_shards):
+            rng = np.random.default_rng([cursor.seed or 0, cursor.epoch, i])
+            yield self.take(index.sample(batch_size, strategy, rng), batch_type)
+
+    def _cached_epoch(
+        self,
+        cache: FrameCache,
+        cursor: Cursor,
+        batch_size: int,
+        batch_type: BatchType,
+        shard: int,
+        num_shards: int,
+        drop_last: bool,
+        strategy: SampleStrategy,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Iterator[Tuple[X, Y]]:
+        self._resolve_types()
+        classes = {"x": self.x_cls, "y": self.y_cls}
+
+        # batches are cached by their index in the epoch so every shard shares them
+        key = (BatchType(batch_type).value, SampleStrategy(strategy).value, batch_size, drop_last, cursor.seed)
+        key += (cursor.epoch,)
+        end_key = key + ("end", shard, num_shards)
+        end = cache.get(end_key)
+        index = cursor.index
+        while end is None or index < int(end):
+            frame = cache.get(key + (shard + index * num_shards,))
+            if frame is None:
+                break
+            batch = decode_batch(frame, classes)
+            yield batch["x"], batch["y"]
+            index += 1
+        else:
+            return
+
+        resumed = Cursor(cursor.epoch, cursor.seed, index)
+        for x, y in self._epoch(resumed, batch_size, batch_type, shard, num_shards, drop_last, strategy, pipeline_runs):
+            cache.put(key + (shard + index * num_shards,), encode_batch({"x": x, "y": y}))
+            yield x, y
+            index += 1
+        cache.put(end_key, str(index).encode("utf-8"))
+
+    def _resolve_types(self) -> None:
+        if self.y_cls is None:
+            orig_bases = self.__orig_bases__
+            if len(orig_bases) == 0:
+                raise ValueError("No X/Y was provided to base class")
+
+            orig_class = orig_bases[0]
+            args = typing.get_args(orig_class)
+            self.x_cls: Type[X] = args[0]
+            self.y_cls: Type[Y] = args[1]
+
     @abstractmethod
     def sample(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[X, Y]:
         """Sample data
@@ -697,6 +1632,90 @@ class SupervisedJob(Generic[X, Y], Job):
         """
         pass
 
+    def class_labels(self, batch_type: BatchType = BatchType.TRAIN) -> Optional[np.ndarray]:
+        """Categorical label of every row, for jobs with ClassData targets
+
+        Jobs that return labels here and implement `take` get stratified and balanced sampling and streams.
+
+        Args:
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+
+        Returns:
+            Optional[np.ndarray]: Labels indexed by row, None if the job doesn't have them
+        """
+        return None
+
+    def take(self, indices: np.ndarray, batch_type: BatchType = BatchType.TRAIN) -> Tuple[X, Y]:
+        """Gather rows into a batch
+
+        Args:
+            indices (np.ndarray): Rows to gather, as numbered by `class_labels`
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+
+        Raises:
+            ValueError: If the job can't gather rows
+
+        Returns:
+            Tuple[X, Y]: A tuple of X and Y
+        """
+        raise ValueError(f"{type(self).__name__} can't gather rows, override take to sample by class")
+
+    def class_index(self, batch_type: BatchType = BatchType.TRAIN) -> Optional[ClassIndex]:
+        """Index of the rows of each class, built from `class_labels` the first time it is asked for
+
+        Args:
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+
+        Returns:
+            Optional[ClassIndex]: The index, None if the job doesn't have labels
+        """
+        batch_type = BatchType(batch_type)
+        indexes = self.__dict__.setdefault("_class_indexes", {})
+        if batch_type not in indexes:
+            labels = self.class_labels(batch_type)
+            if labels is None:
+                indexes[batch_type] = None
+            else:
+                num_classes = int(labels.max()) + 1 if len(labels) else 0
+                indexes[batch_type] = ClassIndex(labels, num_classes)
+                logging.info(f"indexed {len(labels)} {batch_type.value} rows of {num_classes} classes")
+        return indexes[batch_type]
+
+    def _require_class_index(self, batch_type: BatchType) -> ClassIndex:
+        index = self.class_index(batch_type)
+        if index is None:
+            raise ValueError(f"{type(self).__name__} has no class labels, override class_labels to sample by class")
+        if getattr(self.take, "__func__", None) is SupervisedJob.take:
+            raise ValueError(f"{type(self).__name__} can't gather rows, override take to sample by class")
+        return index
+
+    def sample_classes(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        strategy: SampleStrategy = SampleStrategy.STRATIFIED,
+        batch_type: BatchType = BatchType.TRAIN,
+        rng: Optional[np.random.Generator] = None,
+    ) -> Tuple[X, Y]:
+        """Sample a batch with the classes stratified or balanced, in O(batch_size) with the class index
+
+        Args:
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            strategy (SampleStrategy, optional): How rows are picked, RANDOM uses `sample`.
+                Defaults to SampleStrategy.STRATIFIED.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            rng (np.random.Generator, optional): Random generator. Defaults to None, which uses a new one.
+
+        Raises:
+            ValueError: If the job has no class labels or can't gather rows
+
+        Returns:
+            Tuple[X, Y]: A tuple of X and Y
+        """
+        if SampleStrategy(strategy) == SampleStrategy.RANDOM:
+            return self.sample(batch_size)
+        index = self._require_class_index(batch_type)
+        return self.take(index.sample(batch_size, strategy, rng), batch_type)
+
     @property
     def uri(self) -> str:
         if self._uri is None:
@@ -712,6 +1731,9 @@ class SupervisedJob(Generic[X, Y], Job):
         model: SupervisedModel[X, Y] | SupervisedModelClient[X, Y],
         batch_size: int = DEFAULT_BATCH_SIZE,
         store: bool = True,
+        target_ms: Optional[float] = None,
+        min_batch_size: int = 1,
+        max_batch_size: Optional[int] = None,
     ) -> EvalReport:
         """Evaluate a model
 
@@ -719,23 +1741,32 @@ class SupervisedJob(Generic[X, Y], Job):
             model (SupervisedModel | SupervisedModelClient): Model to evaluate
             batch_size (int): Batch size. Defaults to 32
             store (bool): Store the report as an artifact. Defaults to True
+            target_ms (float, optional): Milliseconds per prediction to resize the batches for, starting at
+                `batch_size`. Defaults to None, which keeps `batch_size`.
+            min_batch_size (int, optional): Smallest batch size when resizing. Defaults to 1.
+            max_batch_size (int, optional): Largest batch size when resizing. Defaults to None, which is 64 times
+                `batch_size`.
 
         Returns:
             Report: A report of the evaluation
         """
         score: Score = None
-        if self.y_cls is None:
-            orig_bases = self.__orig_bases__
-            if len(orig_bases) == 0:
-                raise ValueError("No X/Y was provided to base class")
+        self._resolve_types()
 
-            orig_class = orig_bases[0]
-            args = typing.get_args(orig_class)
-            self.x_cls: Type[X] = args[0]
-            self.y_cls: Type[Y] = args[1]
+        sizer = None
+        if target_ms is not None:
+            sizer = BatchSizer(batch_size, min_batch_size, max_batch_size, target_ms=target_ms)
 
-        for x, y in self.stream(batch_size=batch_size, batch_type=BatchType.TEST):
+        # the test set is the same for every evaluation, so it is read from the frame cache when the server has one
+        if self.frame_cache is None and sizer is None:
+            batches = ((None, x, y) for x, y in self.stream(batch_size=batch_size, batch_type=BatchType.TEST))
+        else:
+            batches = self.stream_epochs(Cursor(), 1, batch_size, BatchType.TEST, cache=self.frame_cache, sizer=sizer)
+        for cursor, x, y in batches:
+            start = time.perf_counter()
             y_pred = model.predict(x)
+            if sizer is not None:
+                sizer.observe_ms(cursor.batch_size, (time.perf_counter() - start) * 1000)
             score = self.y_cls.score_cls()(y, y_pred) + score
             print(str(score))
 
@@ -849,8 +1880,11 @@ class SupervisedJob(Generic[X, Y], Job):
         # https://github.com/encode/starlette
 
         server_file = f"""
+import asyncio
+import itertools
 import json
 import logging
+import random
 from typing import Any, Dict
 from dataclasses import dataclass
 import sys
@@ -860,11 +1894,45 @@ import os
 
 from simple_parsing import ArgumentParser
 from starlette.applications import Starlette
-from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from starlette.schemas import SchemaGenerator
 import uvicorn
 
-from arc.data.encoding import ShapeEncoder
+from arc.data.cache import FrameCache
+from arc.data.shapes.classes import SampleStrategy
+from arc.data.encoding import ShapeEncoder, TENSOR_CONTENT_TYPE, is_tensor, encode_message
+from arc.data.compression import IDENTITY, Compressor, get_codec, negotiate, compress_response
+from arc.data.pipeline import PipelineStats
+from arc.data.prefetch import AsyncPrefetcher
+from arc.data.workers import BatchWorkers
+from arc.data.stream import (
+    BROADCAST_PARAM,
+    COUNT_PARAM,
+    CURSOR_PARAM,
+    DROP_LAST_PARAM,
+    EPOCHS_PARAM,
+    NUM_SHARDS_PARAM,
+    RESUME_PARAM,
+    SEED_PARAM,
+    SHARD_PARAM,
+    SHM_PARAM,
+    SHUFFLE_PARAM,
+    STRAGGLER_PARAM,
+    STRATEGY_PARAM,
+    SUBSCRIBERS_PARAM,
+    WINDOW_PARAM,
+    BatchSizer,
+    Broadcast,
+    CreditWindow,
+    Cursor,
+    StragglerPolicy,
+    close_stream,
+    encode_stream,
+    length_prefixed,
+    offer_ring,
+    send_stream,
+)
 from arc.model.metrics import Metrics
 from arc.model.types import SupervisedModel, SupervisedModelClient
 from arc.scm import SCM
@@ -896,13 +1964,29 @@ uri = os.getenv("JOB_URI")
 print("setting job uri: ", uri)
 job.uri = uri
 
+# keeps encoded batches of the streams that can be asked for again, see FrameCache.from_env
+job.frame_cache = FrameCache.from_env()
+
+# jobs with class labels index them once so class aware batches don't scan them
+job.class_index(BatchType.TRAIN)
+
 global_client_uuid = ""
 
 async def on_start():
     global global_client_uuid
     global_client_uuid = ""
 
-app = Starlette(debug=True, on_startup=[on_start])
+    # batches are produced on worker processes when ARC_BATCH_WORKERS is set, see BatchWorkers.from_env. They are
+    # forked here, in the serving process before it starts any threads
+    job.batch_workers = BatchWorkers.from_env(job)
+    if job.batch_workers is not None:
+        logging.info(f"producing batches on {{job.batch_workers.num_workers}} worker processes")
+
+async def on_stop():
+    if job.batch_workers is not None:
+        job.batch_workers.close()
+
+app = Starlette(debug=True, on_startup=[on_start], on_shutdown=[on_stop])
 
 schemas = SchemaGenerator(
     {{"openapi": "3.0.0", "info": {{"title": "{cls_name}", "version": "{version}"}}}}
@@ -914,7 +1998,22 @@ def health(request):
 
 @app.route("/info")
 def info(request):
-    return JSONResponse({{"version": scm.sha()}})
+    frame_cache = job.frame_cache.stats.repr_json() if job.frame_cache is not None else None
+    batch_workers = job.batch_workers.stats.repr_json() if job.batch_workers is not None else None
+    # stage timing of each stream in progress from a job with a pipeline
+    pipeline = {{
+        str(stream_id): PipelineStats.merge(list(runs)).repr_json() for stream_id, runs in pipelines.items() if runs
+    }}
+    return JSONResponse(
+        {{
+            "version": scm.sha(),
+            "augment": job.augment is not None,
+            "repeatable": job.repeatable,
+            "frame_cache": frame_cache,
+            "batch_workers": batch_workers,
+            "pipeline": pipeline,
+        }}
+    )
 
 
 @app.route("/description")
@@ -946,54 +2045,212 @@ class ShapeJSONResponse(JSONResponse):
         return json.dumps(content, cls=ShapeEncoder).encode('utf-8')
 
 
+# streams shared by several clients, by their parameters
+broadcasts = {{}}
+
+# stage timing of the pipeline runs each stream in progress came from, by stream id
+pipelines = {{}}
+stream_ids = itertools.count()
+
+
 # Use websockets...
 @app.websocket_route('/stream')
 async def stream(websocket):
     await websocket.accept()
 
-    # TODO: ugly hack to not deal with concurrency
-    if "client-uuid" not in websocket.headers:
-        raise ValueError("'client-uuid' must be present in headers")
-    client_uuid = websocket.headers["client-uuid"]
-    global global_client_uuid
-    if global_client_uuid == "":
-        global_client_uuid = client_uuid
-    if global_client_uuid != client_uuid:
-        raise ValueError("arc jobs currently do not support multiple clients; create another job for your client")
-
     # Process incoming messages
     params = websocket.query_params
 
-    batch_size = params.get("batch_size", DEFAULT_BATCH_SIZE)
+    batch_size = int(params.get("batch_size", DEFAULT_BATCH_SIZE))
     batch_type = params.get("batch_type", BatchType.TRAIN.value)
+    batches_per_message = int(params.get("batches_per_message", 1))
+    shard = int(params.get(SHARD_PARAM, 0))
+    num_shards = int(params.get(NUM_SHARDS_PARAM, 1))
+    epochs = int(params.get(EPOCHS_PARAM, 1))
+    drop_last = params.get(DROP_LAST_PARAM, "1") != "0"
+    strategy = SampleStrategy(params.get(STRATEGY_PARAM, SampleStrategy.RANDOM.value))
+    shuffle = params.get(SHUFFLE_PARAM, "1") != "0"
+    encoding = None
+    if is_tensor(websocket.headers.get("accept")):
+        encoding = negotiate(websocket.headers.get("accept-encoding"))
+
+    # resumed streams start at the client's cursor, new ones pick the seed of the epochs' permutations
+    if params.get(RESUME_PARAM):
+        cursor = Cursor.parse(params[RESUME_PARAM])
+        logging.info(f"resuming stream from {{cursor}}")
+    elif not shuffle:
+        cursor = Cursor()
+    elif params.get(SEED_PARAM):
+        cursor = Cursor(seed=int(params[SEED_PARAM]))
+    else:
+        cursor = Cursor(seed=random.randrange(2**31))
+    # a seed the server picked won't be asked for again
+    cache = job.frame_cache if cursor.seed is None or params.get(SEED_PARAM) else None
+    # batches are resized for one client at a time, broadcasts keep theirs
+    sizer = BatchSizer.from_params(params, batch_size) if not params.get(BROADCAST_PARAM) else None
+    pipeline_runs = []
+
+    # the job's generator runs and is encoded on a worker thread so the event loop keeps serving other routes
+    def source():
+        compressor = Compressor(get_codec(encoding)) if encoding is not None else None
+        batches = job.stream_epochs(
+            cursor,
+            epochs,
+            batch_size,
+            BatchType(batch_type),
+            shard,
+            num_shards,
+            drop_last,
+            cache,
+            strategy,
+            sizer,
+            pipeline_runs,
+        )
+        return encode_stream(batches, compressor, batches_per_message)
+
+    global global_client_uuid
+    broadcast = None
+    if params.get(BROADCAST_PARAM):
+        key = (
+            batch_size,
+            batch_type,
+            batches_per_message,
+            shard,
+            num_shards,
+            epochs,
+            drop_last,
+            shuffle,
+            strategy,
+            params.get(SEED_PARAM),
+            encoding,
+        )
+        broadcast = broadcasts.get(key)
+        if broadcast is None or broadcast.done:
+            broadcast = Broadcast(source, subscribers=int(params.get(SUBSCRIBERS_PARAM, 1)))
+            broadcasts[key] = broadcast
+        sub = broadcast.subscribe(StragglerPolicy(params.get(STRAGGLER_PARAM, StragglerPolicy.BLOCK.value)))
+        messages = broadcast.messages(sub)
+    else:
+        # TODO: ugly hack to not deal with concurrency
+        if "client-uuid" not in websocket.headers:
+            raise ValueError("'client-uuid' must be present in headers")
+        client_uuid = websocket.headers["client-uuid"]
+        if global_client_uuid == "":
+            global_client_uuid = client_uuid
+        if global_client_uuid != client_uuid:
+            raise ValueError(
+                "arc jobs only support multiple clients on broadcast streams; create another job for your client"
+            )
+        messages = AsyncPrefetcher(source, size=2)
+
+    stream_id = next(stream_ids)
+    pipelines[stream_id] = pipeline_runs
+    window = CreditWindow(int(params.get(WINDOW_PARAM, 0)))
+    shm_ring = None
+    reader = None
+    try:
+        # clients on this host take the binary messages through shared memory
+        shm_ring = await offer_ring(websocket, params.get(SHM_PARAM))
+        reader = asyncio.create_task(window.read(websocket, sizer))
+        await send_stream(websocket, messages, window, shm_ring)
+    except ConnectionError as e:
+        logging.info(f"client left the stream early: {{e}}")
+        return
+    finally:
+        if reader is not None:
+            reader.cancel()
+        if shm_ring is not None:
+            logging.info(f"stream sent {{shm_ring.messages}} messages through shared memory")
+            shm_ring.close()
+        if broadcast is not None:
+            await broadcast.unsubscribe(sub)
+            if not broadcast.subscribers and broadcasts.get(key) is broadcast:
+                del broadcasts[key]
+            logging.info(f"broadcast subscriber dropped {{sub.dropped}} messages")
+        else:
+            messages.close()
+            # reset the uid to unlock
+            global_client_uuid = ""
+            logging.info(f"stream waited on the job for {{messages.stats.empty}}/{{messages.stats.items}} messages")
+        logging.info(f"stream waited on client credits {{window.waits}} times")
+        if sizer is not None:
+            logging.info(f"stream resized its batches {{sizer.resizes}} times, to {{sizer.size}} last")
+        del pipelines[stream_id]
+        if pipeline_runs:
+            logging.info(f"pipeline stage seconds: {{PipelineStats.merge(pipeline_runs)}}")
 
-    for x, y in job.stream(int(batch_size), BatchType(batch_type)):
-        total_start = time.time()
-        # rec = await websocket.receive_json()
-        print("prepping data")
-        x_repr = x.repr_json()
-        y_repr = y.repr_json()
-        print("sending")
-        d = {{"x": x_repr, "y": y_repr, "end": False}}
-        await websocket.send_json(d)
-        print("sent")
-        total_end = time.time()
-        print("total loop time: ", total_end - total_start)
-
-    # reset the uid to unlock
-    global_client_uuid = ""
-    print("sending end")
-    await websocket.send_json({{"end": True}})
     print("all done sending data, closing socket")
-    await websocket.close()
+    await close_stream(websocket, window)
+
+
+@app.route("/batches", methods=["GET"])
+async def batches(request):
+    params = request.query_params
+
+    batch_size = int(params.get("batch_size", DEFAULT_BATCH_SIZE))
+    batch_type = params.get("batch_type", BatchType.TRAIN.value)
+    batches_per_message = int(params.get("batches_per_message", 1))
+    shard = int(params.get(SHARD_PARAM, 0))
+    num_shards = int(params.get(NUM_SHARDS_PARAM, 1))
+    epochs = int(params.get(EPOCHS_PARAM, 1))
+    drop_last = params.get(DROP_LAST_PARAM, "1") != "0"
+    strategy = SampleStrategy(params.get(STRATEGY_PARAM, SampleStrategy.RANDOM.value))
+    count = int(params.get(COUNT_PARAM, 1))
+    cursor = Cursor.parse(params.get(CURSOR_PARAM, Cursor().token()))
+    encoding = None
+    media_type = "application/json"
+    if is_tensor(request.headers.get("accept")):
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        media_type = TENSOR_CONTENT_TYPE
+
+    # clients send the seed only when they picked it to be repeatable
+    cache = job.frame_cache if cursor.seed is None or params.get(SEED_PARAM) else None
+
+    stream_id = next(stream_ids)
+    pipeline_runs = pipelines[stream_id] = []
+
+    # requests are stateless, each one picks the stream up again at the client's cursor
+    def source():
+        compressor = Compressor(get_codec(encoding)) if encoding is not None else None
+        batches = job.stream_epochs(
+            cursor,
+            epochs,
+            batch_size,
+            BatchType(batch_type),
+            shard,
+            num_shards,
+            drop_last,
+            cache,
+            strategy,
+            pipeline_runs=pipeline_runs,
+        )
+        return encode_stream(itertools.islice(batches, count), compressor, batches_per_message)
+
+    messages = AsyncPrefetcher(source, size=2)
+
+    async def body():
+        try:
+            async for msg, _ in messages:
+                yield length_prefixed(msg)
+        finally:
+            messages.close()
+            del pipelines[stream_id]
+
+    return StreamingResponse(body(), media_type=media_type)
 
 
 @app.route("/sample", methods=["GET"])
 async def sample(request):
     params = request.query_params
     batch_size = params.get("batch_size", DEFAULT_BATCH_SIZE)
+    strategy = SampleStrategy(params.get(STRATEGY_PARAM, SampleStrategy.RANDOM.value))
+
+    x, y = await run_in_threadpool(job.sample_classes, int(batch_size), strategy)
+    if is_tensor(request.headers.get("accept")):
+        encoding, body = compress_response(request.headers.get("accept-encoding"), encode_message({{"x": x, "y": y}}))
+        headers = {{"content-encoding": encoding}} if encoding != IDENTITY else None
+        return Response(body, media_type=TENSOR_CONTENT_TYPE, headers=headers)
 
-    x, y = job.sample(int(batch_size))
     resp = {{"x": x.repr_json(), "y": y.repr_json()}}
     return JSONResponse(resp)
 
@@ -1008,6 +2265,9 @@ async def evaluate(request):
         opts = jdict.get("opts", None)
         batch_size = jdict.get("batch_size", 32)
         store = jdict.get("store", True)
+        target_ms = jdict.get("target_ms")
+        min_batch_size = jdict.get("min_batch_size", 1)
+        max_batch_size = jdict.get("max_batch_size")
 
         if opts is None:
             model = SupervisedModelClient[{x_cls.__name__}, {y_cls.__name__}](model_uri)
@@ -1018,7 +2278,7 @@ async def evaluate(request):
         print(e)
         raise
 
-    report = job.evaluate(model, batch_size, store)
+    report = job.evaluate(model, batch_size, store, target_ms, min_batch_size, max_batch_size)
 
     return JSONResponse({{"report": report.repr_json()}})
 
@@ -1129,9 +2389,14 @@ if __name__ == "__main__":
         clean: bool = True,
         dev_dependencies: bool = False,
         sync_strategy: RemoteSyncStrategy = RemoteSyncStrategy.IMAGE,
+        replicas: int = 1,
         **kwargs,
-    ) -> SupervisedJobClient[X, Y]:
-        """Create a deployment of the class, which will allow for the generation of instances remotely"""
+    ) -> Union[SupervisedJobClient[X, Y], ShardedJobClient[X, Y]]:
+        """Create a deployment of the class, which will allow for the generation of instances remotely
+
+        With more than one replica a server is started for each and a ShardedJobClient is returned, which streams a
+        shard of every epoch from each of them.
+        """
 
         if "__orig_class__" in cls.__dict__:
             raise ValueError("not yet supported")
@@ -1150,6 +2415,15 @@ if __name__ == "__main__":
 
         img_id = cls.base_image(scm, clean, dev_dependencies, sync_strategy=sync_strategy)
 
+        if replicas > 1:
+            clients = [
+                SupervisedJobClient[x_cls, y_cls](
+                    uri=img_id, sync_strategy=sync_strategy, dev_dependencies=dev_dependencies, replica=i, **kwargs
+                )
+                for i in range(replicas)
+            ]
+            return ShardedJobClient[x_cls, y_cls](clients)
+
         client = SupervisedJobClient[x_cls, y_cls](
             uri=img_id, sync_strategy=sync_strategy, dev_dependencies=dev_dependencies, **kwargs
         )
@@ -1,20 +1,31 @@
 from typing import Optional, Iterator, Dict
 from pathlib import Path
+import itertools
+import json
 import logging
 import random
+import socket
 
+import pytest
 from tableschema import Schema
+from websocket import ABNF
 import pandas as pd
 import numpy as np
 from mnist import MNIST as MNISTLoader
 
-from arc.data.cache import ResourceCache
+from arc.data.cache import EpochCache, FrameCache, ResourceCache
+from arc.data.buffers_test import FakeWebSocket, _frame
 from arc.data.cache_test import TEST_CACHE
+from arc.data.compression import IDENTITY, CompressionStats, Compressor, get_codec
+from arc.data.encoding import encode_message
 from arc.data.types import *
-from arc.data.job import SupervisedJob, DEFAULT_BATCH_SIZE, DEFAULT_EPOCH_SIZE, SupervisedJobClient
+from arc.data.job import SupervisedJob, DEFAULT_BATCH_SIZE, DEFAULT_EPOCH_SIZE, SupervisedJobClient, ShardedJobClient
+from arc.data.stream import BatchSizer, Cursor, StreamOptions, encode_stream
+from arc.data.pipeline import Pipeline
 from arc.model.types import Model, SupervisedModel
-from arc.data.shapes.classes import ClassData, ClassEncoding
+from arc.data.shapes.classes import ClassData, ClassEncoding, SampleStrategy
 from arc.data.shapes.image import ImageData
+from arc.data.workers_test import ArangeJob
 from arc.config import RemoteSyncStrategy
 
 
@@ -33,17 +44,33 @@ class ClassifyDigitsJob(SupervisedJob[ImageData, ClassData]):
             cache = ResourceCache()
 
         self.cache = cache
+
+        # pixels are kept as uint8 on disk and normalized per batch
+        arrays = self.cache.arrays("mnist-v1", self._parse)
+        self.x_train, self.y_train = arrays["x_train"], arrays["y_train"]
+        self.x_test, self.y_test = arrays["x_test"], arrays["y_test"]
+
+    def _parse(self) -> Dict[str, np.ndarray]:
         train_images_path = self.cache.get("http://yann.lecun.com/exdb/mnist/train-images-idx3-ubyte.gz")
         self.cache.get("http://yann.lecun.com/exdb/mnist/train-labels-idx1-ubyte.gz")
         self.cache.get("http://yann.lecun.com/exdb/mnist/t10k-images-idx3-ubyte.gz")
         self.cache.get("http://yann.lecun.com/exdb/mnist/t10k-labels-idx1-ubyte.gz")
 
         mnist = MNISTLoader(Path(train_images_path).parent.absolute(), return_type="numpy")
-        self.x_train, self.y_train = mnist.load_training()
-        self.x_test, self.y_test = mnist.load_testing()
+        x_train, y_train = mnist.load_training()
+        x_test, y_test = mnist.load_testing()
 
-        self.x_train = self.x_train / 255
-        self.x_test = self.x_test / 255
+        return {
+            "x_train": x_train.astype(np.uint8),
+            "y_train": y_train,
+            "x_test": x_test.astype(np.uint8),
+            "y_test": y_test,
+        }
+
+    def _batch(self, xb: np.ndarray, yb: np.ndarray) -> Tuple[ImageData, ClassData]:
+        # shuffled batches are views of buffers the next batches are gathered into, xb / 255 already copies
+        size = len(xb)
+        return ImageData(xb / 255, 28, 28, 1, size), ClassData(np.array(yb), 10, size, ClassEncoding.CATEGORICAL)
 
     @property
     def description(self) -> str:
@@ -68,27 +95,48 @@ class ClassifyDigitsJob(SupervisedJob[ImageData, ClassData]):
         Args:
             batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
             batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
-            shuffle (bool, optional): Shuffle data on epoch end. Default to True
+            shuffle (bool, optional): Shuffle the epoch. Default to True
 
         Yields:
             Iterator[Tuple[ImageData, ClassData]]: An iterator of X and Y
         """
 
-        x, y = self._data_by_type(batch_type)
+        cursor = Cursor(seed=random.randrange(2**31) if shuffle else None)
+        return self.stream_from(cursor, batch_size, batch_type)
 
-        for i in range(x.shape[0] // batch_size):
-            xb = x[batch_size * i : batch_size * (i + 1)]
-            yb = y[batch_size * i : batch_size * (i + 1)]
+    def stream_from(
+        self,
+        cursor: Cursor,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        shard: int = 0,
+        num_shards: int = 1,
+        drop_last: bool = True,
+    ) -> Iterator[Tuple[ImageData, ClassData]]:
+        """Stream a shard of one epoch starting at a cursor, shuffled by the cursor's seed
 
-            # is this too costly computationally?
-            yield ImageData(xb, 28, 28, 1, batch_size), ClassData(yb, 10, batch_size, ClassEncoding.CATEGORICAL)
+        Args:
+            cursor (Cursor): Position to start at
+            batch_size (int, optional): Size of the batch. Defaults to DEFAULT_BATCH_SIZE.
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+            shard (int, optional): Index of the shard. Defaults to 0.
+            num_shards (int, optional): Number of shards. Defaults to 1.
+            drop_last (bool, optional): Drop the last partial batch. Defaults to True.
 
-        indices = np.arange(len(x))
+        Yields:
+            Iterator[Tuple[ImageData, ClassData]]: An iterator of X and Y
+        """
+        x, y = self._data_by_type(batch_type)
 
-        if shuffle:
-            logging.info(f"shuffling data")
-            np.random.shuffle(indices)
-            # TODO: this may not be working
+        return (
+            Pipeline.from_arrays({"x": x, "y": y})
+            .shuffle(len(x))
+            .batch(batch_size, drop_last)
+            .shard(shard, num_shards)
+            .skip(cursor.index)
+            .map(lambda batch: self._batch(batch["x"], batch["y"]))
+            .iterate(cursor.seed, cursor.epoch)
+        )
 
     def sample(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[ImageData, ClassData]:
         """Sample data
@@ -101,12 +149,34 @@ class ClassifyDigitsJob(SupervisedJob[ImageData, ClassData]):
         """
 
         x, y = self.x_train, self.y_train
-        i = random.randint(1, x.shape[0] // batch_size)
+        i = random.randint(0, x.shape[0] // batch_size - 1)
+
+        return self._batch(x[batch_size * i : batch_size * (i + 1)], y[batch_size * i : batch_size * (i + 1)])
 
-        xb = x[batch_size * i : batch_size * (i + 1)]
-        yb = y[batch_size * i : batch_size * (i + 1)]
+    def class_labels(self, batch_type: BatchType = BatchType.TRAIN) -> Optional[np.ndarray]:
+        """Label of every row
 
-        return ImageData(xb, 28, 28, 1, batch_size), ClassData(yb, 10, batch_size, ClassEncoding.CATEGORICAL)
+        Args:
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+
+        Returns:
+            Optional[np.ndarray]: Labels indexed by row
+        """
+        _, y = self._data_by_type(batch_type)
+        return y
+
+    def take(self, indices: np.ndarray, batch_type: BatchType = BatchType.TRAIN) -> Tuple[ImageData, ClassData]:
+        """Gather rows into a batch
+
+        Args:
+            indices (np.ndarray): Rows to gather
+            batch_type (BatchType, optional): Type of the batch. Defaults to BatchType.TRAIN.
+
+        Returns:
+            Tuple[ImageData, ClassData]: A tuple of X and Y
+        """
+        x, y = self._data_by_type(batch_type)
+        return self._batch(x[indices], y[indices])
 
     def _data_by_type(self, batch_type: BatchType) -> Tuple[np.ndarray, np.ndarray]:
         x: Optional[np.ndarray] = None
@@ -171,3 +241,334 @@ def test_job_container():
     print("leaderboard: ", leaderboard)
 
     return
+
+
+class LocalJobClient:
+    """Streams from a local job the way a SupervisedJobClient streams from its server"""
+
+    def __init__(self, job: SupervisedJob) -> None:
+        self.job = job
+        self.cursor: Optional[Cursor] = None
+        self.shards = []
+        self.seeds = []
+
+    def stream(self, batch_size, batch_type, resume_from=None, shard=0, num_shards=1, **kwargs):
+        self.cursor = resume_from
+        self.shards.append((shard, num_shards))
+        self.seeds.append(kwargs.get("seed"))
+        for x, y in self.job.stream_from(resume_from, batch_size, batch_type, shard, num_shards):
+            self.cursor = self.cursor.advance()
+            yield x, y
+
+
+def test_sharded_client():
+    job = ArangeJob()
+    expected = [list(y.data) for _, y in job.stream_from(Cursor(0, 5, 0), 8)]
+    assert len(expected) == 12
+
+    # each shard gets every num_shards'th batch of the same permutation
+    for shard in range(3):
+        ys = [list(y.data) for _, y in job.stream_from(Cursor(0, 5, 0), 8, shard=shard, num_shards=3)]
+        assert ys == expected[shard::3]
+
+    # shards are interleaved round robin, in the order of a single stream
+    clients = [LocalJobClient(job) for _ in range(3)]
+    sharded = ShardedJobClient(clients)
+    assert [list(y.data) for _, y in sharded.stream(8, seed=5)] == expected
+    assert [c.shards for c in clients] == [[(0, 3)], [(1, 3)], [(2, 3)]]
+    # a seed the caller picked is sent along with the cursors so the replicas cache its epochs
+    assert [c.seeds for c in clients] == [[5], [5], [5]]
+    assert [c.index for c in sharded.cursors] == [4, 4, 4]
+
+    # stopping partway through a round resumes from each shard's cursor with the shard furthest behind
+    sharded = ShardedJobClient([LocalJobClient(job) for _ in range(3)])
+    batches = sharded.stream(8, seed=5)
+    head = [list(next(batches)[1].data) for _ in range(4)]
+    batches.close()
+    assert [c.index for c in sharded.cursors] == [2, 1, 1]
+    resumed = ShardedJobClient([LocalJobClient(job) for _ in range(3)])
+    tokens = [c.token() for c in sharded.cursors]
+    assert head + [list(y.data) for _, y in resumed.stream(8, resume_from=tokens)] == expected
+    assert resumed.clients[0].seeds == [None]
+
+    with pytest.raises(ValueError):
+        next(sharded.stream(8, resume_from=sharded.cursors[:2]))
+    with pytest.raises(ValueError):
+        next(sharded.stream(8, options=StreamOptions(broadcast=True)))
+
+
+def test_cached_epoch():
+    job = ArangeJob()
+    cache = FrameCache()
+    expected = [list(y.data) for _, y in job.stream_from(Cursor(0, 5, 0), 8)]
+
+    # leaving the first epoch early caches the batches so far, but not where it ends
+    batches = job.stream_epochs(Cursor(0, 5, 0), 1, 8, cache=cache)
+    head = [list(y.data) for _, _, y in itertools.islice(batches, 5)]
+    batches.close()
+    assert head == expected[:5]
+    assert cache.get((BatchType.TRAIN.value, SampleStrategy.RANDOM.value, 8, True, 5, 0, "end", 0, 1)) is None
+
+    # the next stream hits the cached batches, misses the sixth and has the job stream the rest
+    hits, misses = cache.stats.hits, cache.stats.misses
+    cursors = []
+    ys = []
+    for cursor, _, y in job.stream_epochs(Cursor(0, 5, 0), 1, 8, cache=cache):
+        cursors.append(cursor)
+        ys.append(list(y.data))
+    assert ys == expected
+    assert cursors == [Cursor(0, 5, i) for i in range(12)]
+    assert cache.stats.hits - hits == 5
+    assert cache.stats.misses - misses == 2
+    assert cache.get((BatchType.TRAIN.value, SampleStrategy.RANDOM.value, 8, True, 5, 0, "end", 0, 1)) == b"12"
+
+    # the whole epoch and its end are cached, the job isn't asked again even when it can't stream
+    job.y = job.y - 1
+    hits, misses = cache.stats.hits, cache.stats.misses
+    assert [list(y.data) for _, _, y in job.stream_epochs(Cursor(0, 5, 0), 1, 8, cache=cache)] == expected
+    assert cache.stats.misses == misses
+
+    # another seed is another epoch
+    with pytest.raises(ValueError):
+        list(job.stream_epochs(Cursor(0, 6, 0), 1, 8, cache=cache))
+
+
+class LabeledJob(ArangeJob):
+    """Numbered rows with a class each, most of them in class 0"""
+
+    def class_labels(self, batch_type: BatchType = BatchType.TRAIN) -> Optional[np.ndarray]:
+        return np.where(self.y < 64, 0, self.y % 3 + 1)
+
+    def take(self, indices: np.ndarray, batch_type: BatchType = BatchType.TRAIN) -> Tuple[ImageData, ClassData]:
+        size = len(indices)
+        x, y = self.x[indices], self.y[indices]
+        return ImageData(x, 2, 2, 1, size), ClassData(y, 100, size, ClassEncoding.CATEGORICAL)
+
+
+class LabelsOnlyJob(ArangeJob):
+    """Labeled rows it can't gather by index"""
+
+    class_labels = LabeledJob.class_labels
+
+
+def test_class_epochs():
+    job = LabeledJob()
+    labels = job.class_labels()
+
+    def epoch(strategy, cursor, **kwargs):
+        return [(c, list(y.data)) for c, _, y in job.stream_epochs(cursor, 2, 8, strategy=strategy, **kwargs)]
+
+    for strategy in (SampleStrategy.STRATIFIED, SampleStrategy.BALANCED):
+        # as many batches as a plain epoch, drawn the same way for the same seed and epoch
+        batches = epoch(strategy, Cursor(0, 5, 0))
+        assert [c for c, _ in batches] == [Cursor(0, 5, i) for i in range(12)] + [Cursor(1, 5, i) for i in range(12)]
+        assert batches == epoch(strategy, Cursor(0, 5, 0))
+        assert batches != epoch(strategy, Cursor(0, 6, 0))
+        assert [ys for _, ys in batches[:12]] != [ys for _, ys in batches[12:]]
+
+        counts = np.bincount(labels[[row for _, ys in batches for row in ys]], minlength=4)
+        if strategy == SampleStrategy.BALANCED:
+            assert list(counts) == [48] * 4
+        else:
+            assert counts[0] > counts[1:].sum()
+
+        # resuming draws the rest of the epochs again, shards draw every num_shards'th batch
+        assert epoch(strategy, Cursor(0, 5, 7)) == batches[7:]
+        for shard in range(3):
+            sharded = epoch(strategy, Cursor(0, 5, 0), shard=shard, num_shards=3)
+            assert [ys for _, ys in sharded] == [ys for _, ys in batches[:12][shard::3] + batches[12:][shard::3]]
+
+    # jobs without labels or take can't sample by class
+    with pytest.raises(ValueError, match="class_labels"):
+        next(ArangeJob().stream_epochs(Cursor(0, 5, 0), 1, 8, strategy=SampleStrategy.BALANCED))
+    with pytest.raises(ValueError, match="take"):
+        next(LabelsOnlyJob().stream_epochs(Cursor(0, 5, 0), 1, 8, strategy=SampleStrategy.STRATIFIED))
+    with pytest.raises(ValueError, match="take"):
+        LabelsOnlyJob().sample_classes(8)
+
+
+def test_sized_epoch():
+    job = ArangeJob()
+    order = [int(y.data[0]) for _, y in job.stream_from(Cursor(0, 5, 0), 1)]
+
+    # shrink and grow mid epoch, each switch waits for a row offset both sizes divide
+    sizer = BatchSizer(4, max_size=16)
+    rows = []
+    sizes = []
+    for cursor, _, y in job.stream_epochs(Cursor(0, 5, 0), 1, 4, sizer=sizer):
+        assert cursor.batch_size == len(y.data) and cursor.index * cursor.batch_size == len(rows)
+        rows += list(y.data)
+        sizes.append(len(y.data))
+        if len(sizes) == 2:
+            sizer.size = 2
+        elif len(sizes) == 5:
+            sizer.size = 16
+    # asked to grow at row 14, it switches after one more batch of 2 at row 16
+    assert sizes[:7] == [4, 4, 2, 2, 2, 2, 16] and set(sizes[7:]) == {16}
+    assert rows == order[: len(rows)] and len(rows) > 100 - 16
+
+    # resuming keeps the cursor's size with or without a sizer, so no row is repeated or skipped
+    resumed = [list(y.data) for _, _, y in job.stream_epochs(Cursor(0, 5, 3, 2), 1, 8)]
+    assert [len(ys) for ys in resumed] == [2] * 47
+    assert sum(resumed, []) == order[6:]
+    resumed = job.stream_epochs(Cursor(0, 5, 3, 2), 1, 8, sizer=BatchSizer(8))
+    cursor, _, y = next(resumed)
+    assert cursor == Cursor(0, 5, 3, 2) and list(y.data) == order[6:8]
+    cursor, _, y = next(resumed)
+    assert cursor == Cursor(0, 5, 1, 8) and list(y.data) == order[8:16]
+
+    # the index of a cursor without a size counts batches of the size asked for
+    cursor, _, y = next(job.stream_epochs(Cursor(0, 5, 2), 1, 6, sizer=BatchSizer(6)))
+    assert cursor == Cursor(0, 5, 2, 6) and list(y.data) == order[12:18]
+
+
+class ShmWebSocket(FakeWebSocket):
+    """The parts of a websocket used to accept a shared memory ring"""
+
+    def __init__(self, sock: socket.socket) -> None:
+        super().__init__(sock)
+        self.sent = []
+
+    def send(self, payload: str) -> None:
+        self.sent.append(json.loads(payload))
+
+
+def test_accept_ring():
+    # attaching to a ring doesn't need a deployed job
+    client = SupervisedJobClient.__new__(SupervisedJobClient)
+    server, sock = socket.socketpair()
+    ws = ShmWebSocket(sock)
+
+    # servers that don't offer rings start with the stream, the first message is handed on
+    msg = encode_message({"x": ImageData(np.zeros((2, 4)), 2, 2, 1, 2)}, end=False)
+    server.sendall(_frame(msg))
+    shm_ring, first = client._accept_ring(ws)
+    assert shm_ring is None and first[0] == ABNF.OPCODE_BINARY and bytes(first[1]) == msg
+
+    server.sendall(_frame(json.dumps({"shm": None}).encode("utf-8"), ABNF.OPCODE_TEXT))
+    assert client._accept_ring(ws) == (None, None)
+
+    # a ring that can't be attached to is declined
+    offer = {"shm": {"name": "arc-no-such-ring", "nonce": "00" * 8}}
+    server.sendall(_frame(json.dumps(offer).encode("utf-8"), ABNF.OPCODE_TEXT))
+    assert client._accept_ring(ws) == (None, None)
+    assert ws.sent == [{"shm": False}]
+
+
+def _jitter(x: ImageData, rng: np.random.Generator) -> ImageData:
+    return ImageData(x.data + rng.random(x.data.shape), x.width, x.height, x.channels, x.num_images)
+
+
+class JitteredJob(ArangeJob):
+    """Numbered rows with noise added, from a function set on the class"""
+
+    augment = _jitter
+
+
+def test_augment():
+    def xs(job, cursor, cache=None):
+        return [x.data.copy() for _, x, _ in job.stream_epochs(cursor, 1, 8, cache=cache)]
+
+    job = JitteredJob()
+    rows = xs(ArangeJob(), Cursor(0, 3))
+    seeded = xs(job, Cursor(0, 3))
+    assert all(np.all((a > r) & (a < r + 1)) for a, r in zip(seeded, rows))
+
+    # seeded streams augment each batch the same way, resumed or not
+    assert all(np.array_equal(a, b) for a, b in zip(seeded[2:], xs(job, Cursor(0, 3, 2))))
+
+    # unseeded ones don't, even when their frames could be cached
+    cache = FrameCache()
+    a, b = xs(job, Cursor(), cache), xs(job, Cursor(), cache)
+    assert not any(np.array_equal(x, y) for x, y in zip(a, b))
+
+
+class StreamOnlyJob(ArangeJob):
+    """Numbered rows from `stream` alone, with the default `stream_from`"""
+
+    stream_from = SupervisedJob.stream_from
+
+    def stream(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, batch_type: BatchType = BatchType.TRAIN
+    ) -> Iterator[Tuple[ImageData, ClassData]]:
+        return ArangeJob.stream_from(self, Cursor(), batch_size, batch_type)
+
+
+class ReplayClient(SupervisedJobClient[ImageData, ClassData]):
+    """Receives streams of a local job over a socket pair, as a SupervisedJobClient does from its server"""
+
+    x_cls = ImageData
+    y_cls = ClassData
+
+    def __init__(self, job: SupervisedJob, augment: bool = False, encoding: str = IDENTITY) -> None:
+        self.job = job
+        self.augment = augment
+        self.encoding = encoding
+        self.streamed = []
+
+    def info(self) -> Dict[str, Any]:
+        return {"version": "1", "augment": self.augment, "repeatable": self.job.repeatable}
+
+    def stream(self, batch_size=DEFAULT_BATCH_SIZE, batch_type=BatchType.TRAIN, resume_from=None, epochs=1, **kwargs):
+        self.streamed.append(resume_from)
+        batches = self.job.stream_epochs(
+            resume_from, epochs, batch_size, batch_type, strategy=kwargs.get("strategy", SampleStrategy.RANDOM)
+        )
+        server, sock = socket.socketpair()
+        try:
+            for msg, _ in encode_stream(batches, Compressor(get_codec(self.encoding), min_size=0)):
+                server.sendall(_frame(msg))
+            self.received_stats = CompressionStats()
+            segment, self._recording = self._recording, None
+            for x, y, cursor in self._recv_batches(FakeWebSocket(sock), None, 0, segment=segment):
+                self.cursor = cursor
+                yield x, y
+        finally:
+            server.close()
+            sock.close()
+
+
+def test_writable_batches():
+    # batches can be modified in place whether or not their message was compressed
+    for encoding in (IDENTITY, "deflate"):
+        client = ReplayClient(ArangeJob(), encoding=encoding)
+        for x, y in client.stream(8, resume_from=Cursor()):
+            assert x.data.flags.writeable and y.data.flags.writeable
+            x.data += 1
+        assert (client.received_stats.compressed > 0) == (encoding != IDENTITY)
+
+
+def test_epoch_cache(tmp_path):
+    def ys(client, **kwargs):
+        return [y.data.tolist() for _, y in client.stream_cached(cache, 8, epochs=3, **kwargs)]
+
+    job = LabeledJob()
+    cache = EpochCache(str(tmp_path))
+    expected = [y.data.tolist() for _, _, y in job.stream_epochs(Cursor(0, 5, 0), 3, 8)]
+
+    # each epoch is recorded as it is received and replayed the next time
+    client = ReplayClient(job)
+    assert ys(client, seed=5) == expected
+    assert client.streamed == [Cursor(0, 5), Cursor(1, 5), Cursor(2, 5)]
+    assert ys(client, seed=5) == expected
+    assert len(client.streamed) == 3 and client.cursor == Cursor(2, 5, 12)
+    assert cache.stats.hits == 3
+
+    # unshuffled epochs in the job's own order are recorded once for every epoch
+    unshuffled = [y.data.tolist() for _, _, y in job.stream_epochs(Cursor(), 1, 8)]
+    client = ReplayClient(job)
+    assert ys(client, shuffle=False) == unshuffled * 3
+    assert client.streamed == [Cursor(0)]
+
+    # unless they are augmented or drawn by class, and jobs without stream_from may shuffle in stream
+    assert not StreamOnlyJob().repeatable
+    for i, (client, kwargs) in enumerate(
+        (
+            (ReplayClient(job, augment=True), {}),
+            (ReplayClient(job), {"strategy": SampleStrategy.BALANCED}),
+            (ReplayClient(StreamOnlyJob()), {}),
+        )
+    ):
+        cache = EpochCache(str(tmp_path / str(i)))
+        ys(client, shuffle=False, **kwargs)
+        assert client.streamed == [Cursor(0), Cursor(1), Cursor(2)]
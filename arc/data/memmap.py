@@ -0,0 +1,108 @@
+"""Datasets cached on disk as .npy files and opened memory mapped
+
+Parsing a dataset into memory on every job start costs time and leaves the job holding the whole dataset (plus any
+normalized copy) in RSS. Saving the parsed arrays once and opening them with `np.memmap` means restarts skip parsing
+and batches are paged in from disk as they are sliced.
+"""
+
+from typing import Callable, Dict, Mapping
+import json
+import logging
+import os
+
+import numpy as np
+
+MANIFEST_FILE = "arrays.json"
+
+
+def _replace(path: str, write: Callable[[str], None]) -> None:
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def save_arrays(path: str, arrays: Mapping[str, np.ndarray]) -> None:
+    """Save arrays to a directory as one .npy file each
+
+    The manifest is written last, so an interrupted save is never mistaken for a complete one.
+
+    Args:
+        path (str): Directory to save to
+        arrays (Mapping[str, np.ndarray]): Arrays by name
+    """
+    os.makedirs(path, exist_ok=True)
+
+    manifest: Dict[str, Dict] = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        if arr.dtype.hasobject:
+            raise ValueError(f"array '{name}' has an object dtype and cannot be memory mapped")
+
+        def _save(tmp: str) -> None:
+            with open(tmp, "wb") as f:
+                np.save(f, arr, allow_pickle=False)
+
+        _replace(os.path.join(path, f"{name}.npy"), _save)
+        manifest[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape)}
+
+    def _save_manifest(tmp: str) -> None:
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+
+    _replace(os.path.join(path, MANIFEST_FILE), _save_manifest)
+
+
+def has_arrays(path: str) -> bool:
+    """Whether a directory holds a complete set of saved arrays
+
+    Args:
+        path (str): Directory to check
+
+    Returns:
+        bool: True if `save_arrays` finished writing to it
+    """
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def load_arrays(path: str, mmap_mode: str = "r") -> Dict[str, np.ndarray]:
+    """Open arrays saved with `save_arrays`
+
+    Args:
+        path (str): Directory to open
+        mmap_mode (str, optional): Memory map mode passed to `np.load`. Defaults to "r" (read only).
+
+    Raises:
+        ValueError: If an array doesn't match the manifest
+
+    Returns:
+        Dict[str, np.ndarray]: Memory mapped arrays by name
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    arrays: Dict[str, np.ndarray] = {}
+    for name, desc in manifest.items():
+        arr = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        if arr.dtype.str != desc["dtype"] or list(arr.shape) != desc["shape"]:
+            raise ValueError(f"array '{name}' in {path} doesn't match its manifest")
+        arrays[name] = arr
+    return arrays
+
+
+def cached_arrays(
+    path: str, build: Callable[[], Mapping[str, np.ndarray]], mmap_mode: str = "r"
+) -> Dict[str, np.ndarray]:
+    """Open memory mapped arrays, building and saving them first if they aren't cached
+
+    Args:
+        path (str): Directory to cache the arrays in
+        build (Callable[[], Mapping[str, np.ndarray]]): Parses the dataset into arrays by name, only called on a miss
+        mmap_mode (str, optional): Memory map mode passed to `np.load`. Defaults to "r" (read only).
+
+    Returns:
+        Dict[str, np.ndarray]: Memory mapped arrays by name
+    """
+    if not has_arrays(path):
+        logging.info(f"arrays not cached at {path}, building...")
+        save_arrays(path, build())
+    return load_arrays(path, mmap_mode)
@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+
+from arc.data.memmap import MANIFEST_FILE, cached_arrays, has_arrays
+
+
+def test_cached_arrays(tmp_path):
+    path = str(tmp_path / "digits")
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {"x": np.arange(24, dtype=np.uint8).reshape(4, 6), "y": np.arange(4)}
+
+    arrays = cached_arrays(path, build)
+    assert isinstance(arrays["x"], np.memmap)
+    assert np.array_equal(arrays["x"][1:3], build()["x"][1:3])
+    assert not arrays["x"].flags.writeable
+
+    # a restart opens the cache without building
+    calls.clear()
+    arrays = cached_arrays(path, build)
+    assert calls == []
+    assert arrays["y"].shape == (4,)
+
+    # an interrupted save is rebuilt
+    os.remove(os.path.join(path, MANIFEST_FILE))
+    assert not has_arrays(path)
+    cached_arrays(path, build)
+    assert calls == [1]
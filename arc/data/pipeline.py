@@ -0,0 +1,556 @@
+"""Composable stages for a job's batches
+
+A `Pipeline` describes how a job turns its arrays into batches, as a chain of stages, instead of every `stream_from`
+slicing and shuffling by hand:
+
+    Pipeline.from_arrays({"x": x, "y": y}).shuffle(len(x)).batch(batch_size).shard(shard, num_shards)
+        .skip(cursor.index).map(to_batch).prefetch(2).iterate(cursor.seed, cursor.epoch)
+
+Elements flow through the stages as blocks of rows, dicts of arrays with the same number of rows, until a `map` turns
+them into something else. Stages work on whole blocks so a `map` or `filter` is vectorized over a batch.
+
+`iterate` compiles the stages into one generator. A source followed by a full shuffle, a batch and a shard or skip is
+run by `arc.data.shuffle.gather_batches`, which seeks straight to the first batch and gathers each batch with one
+`np.take`, and consecutive maps are called as one stage. Each compiled stage is timed, see `PipelineStats`.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+import itertools
+import time
+
+import numpy as np
+
+from arc.data.prefetch import Prefetcher
+from arc.data.shuffle import gather_batches
+from arc.data.stream import Cursor
+
+DEFAULT_BLOCK_SIZE = 1024
+
+Block = Dict[str, np.ndarray]
+
+
+@dataclass
+class StageStats:
+    """Timing of one compiled stage of a pipeline"""
+
+    name: str
+    """Name of the stage, fused stages are joined with '>'"""
+
+    items: int = 0
+    """Number of elements the stage produced"""
+
+    seconds: float = 0.0
+    """Time spent getting elements from the stage, including the stages before it"""
+
+    own_seconds: float = 0.0
+    """Time spent in the stage itself, the stage limiting throughput has the most"""
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {"name": self.name, "items": self.items, "seconds": self.seconds, "own_seconds": self.own_seconds}
+
+
+@dataclass
+class PipelineStats:
+    """Timing of the stages of a pipeline run
+
+    A stage's own time is its time less that of the stage before it. Stages before a `prefetch` run on its thread, so
+    the prefetch's own time is how long the stages after it waited on them.
+    """
+
+    stages: List[StageStats] = field(default_factory=list)
+    """Stats of each compiled stage, source first"""
+
+    @property
+    def bottleneck(self) -> Optional[StageStats]:
+        """The stage that spent the most time on its own, None before any ran"""
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda stage: stage.own_seconds)
+
+    @classmethod
+    def merge(cls, runs: Iterable["PipelineStats"]) -> "PipelineStats":
+        """Add up the stats of several runs of the same pipeline, e.g. each epoch of a stream
+
+        Args:
+            runs (Iterable[PipelineStats]): Stats of each run
+
+        Returns:
+            PipelineStats: The totals of each stage
+        """
+        merged = cls()
+        for run in runs:
+            if not merged.stages:
+                merged.stages = [StageStats(stage.name) for stage in run.stages]
+            for total, stage in zip(merged.stages, run.stages):
+                total.items += stage.items
+                total.seconds += stage.seconds
+                total.own_seconds += stage.own_seconds
+        return merged
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        bottleneck = self.bottleneck
+        return {
+            "stages": [stage.repr_json() for stage in self.stages],
+            "bottleneck": bottleneck.name if bottleneck is not None else None,
+        }
+
+    def __str__(self) -> str:
+        return ", ".join(f"{stage.name} {stage.own_seconds:.3f}s" for stage in self.stages)
+
+
+def _rows(block: Mapping[str, np.ndarray]) -> int:
+    return len(next(iter(block.values())))
+
+
+def _slice(block: Mapping[str, np.ndarray], start: int, stop: int) -> Block:
+    return {name: arr[start:stop] for name, arr in block.items()}
+
+
+def _concat(parts: List[Block]) -> Block:
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+@dataclass(frozen=True)
+class _Stage:
+    kind: str
+    args: Tuple[Any, ...] = ()
+
+
+@dataclass
+class _Compiled:
+    name: str
+    run: Callable[[Optional[Iterator[Any]]], Iterator[Any]]
+    boundary: bool = False
+
+
+class Pipeline:
+    """A chain of stages producing a job's batches, built up with the stage methods and run with `iterate`
+
+    Pipelines are immutable, each stage method returns a new one, so a job can build one and run it per epoch.
+    """
+
+    def __init__(self, stages: Tuple[_Stage, ...] = ()) -> None:
+        """Create a Pipeline, use a source like `from_arrays` instead
+
+        Args:
+            stages (Tuple[_Stage, ...], optional): Stages so far. Defaults to ().
+        """
+        self.stages = stages
+
+    def _then(self, kind: str, *args: Any) -> "Pipeline":
+        if not self.stages:
+            raise ValueError("pipelines start with a source e.g. Pipeline.from_arrays")
+        return Pipeline(self.stages + (_Stage(kind, args),))
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray], block_size: int = DEFAULT_BLOCK_SIZE) -> "Pipeline":
+        """Start a pipeline from arrays with the same number of rows, e.g. memory mapped by `ResourceCache.arrays`
+
+        Args:
+            arrays (Mapping[str, np.ndarray]): Arrays by name
+            block_size (int, optional): Rows per block, batch stages rebatch them. Defaults to DEFAULT_BLOCK_SIZE.
+
+        Raises:
+            ValueError: If the arrays have different numbers of rows
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        lengths = {len(arr) for arr in arrays.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"arrays must have the same number of rows, got {sorted(lengths)}")
+        return cls((_Stage("from_arrays", (dict(arrays), block_size)),))
+
+    def map(self, fn: Callable[[Any], Any]) -> "Pipeline":
+        """Apply a function to each element, e.g. to normalize a batch or turn it into X and Y
+
+        Args:
+            fn (Callable[[Any], Any]): Function of an element
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        return self._then("map", fn)
+
+    def parallel_map(self, fn: Callable[[Any], Any], workers: int) -> "Pipeline":
+        """Apply a function to each element on a pool of threads, keeping the order of the elements
+
+        Threads only run in parallel while the function releases the GIL, as most numpy operations on large arrays
+        do. To spread pure Python work over cores run the job server with `arc.data.workers.BatchWorkers`.
+
+        Args:
+            fn (Callable[[Any], Any]): Function of an element
+            workers (int): Number of threads
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        return self._then("parallel_map", fn, workers)
+
+    def filter(self, fn: Callable[[Any], Any]) -> "Pipeline":
+        """Keep the elements, or the rows of blocks, a predicate is true for
+
+        Args:
+            fn (Callable[[Any], Any]): Predicate of an element, for blocks it may return a boolean mask of the rows
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        return self._then("filter", fn)
+
+    def shuffle(self, buffer: int) -> "Pipeline":
+        """Shuffle rows through a buffer, by the seed passed to `iterate`
+
+        Each row coming in replaces a random row of the buffer, which goes out, so no row comes out more than `buffer`
+        places early, and a buffer holding every row shuffles uniformly. Without a seed the rows keep their order, as
+        with cursors.
+
+        Args:
+            buffer (int): Rows in the buffer
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        if buffer < 1:
+            raise ValueError("shuffle buffer must be at least 1")
+        return self._then("shuffle", buffer)
+
+    def batch(self, batch_size: int, drop_last: bool = True) -> "Pipeline":
+        """Rebatch blocks into blocks of `batch_size` rows
+
+        Args:
+            batch_size (int): Size of the batch
+            drop_last (bool, optional): Drop the last partial batch. Defaults to True.
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        return self._then("batch", batch_size, drop_last)
+
+    def shard(self, shard: int, num_shards: int) -> "Pipeline":
+        """Keep every `num_shards`th element starting at `shard`, as the job server's shards do
+
+        Args:
+            shard (int): Index of the shard
+            num_shards (int): Number of shards
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"shard {shard} out of range for {num_shards} shards")
+        return self._then("shard", shard, num_shards)
+
+    def skip(self, count: int) -> "Pipeline":
+        """Skip the first `count` elements, e.g. `cursor.index` batches to resume a stream
+
+        Args:
+            count (int): Number of elements
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        return self._then("skip", count)
+
+    def prefetch(self, size: int = 2) -> "Pipeline":
+        """Run the stages so far on a background thread, up to `size` elements ahead
+
+        Args:
+            size (int, optional): Number of elements to prefetch. Defaults to 2.
+
+        Returns:
+            Pipeline: The pipeline
+        """
+        if size < 1:
+            raise ValueError("prefetch size must be at least 1")
+        return self._then("prefetch", size)
+
+    def iterate(self, seed: Optional[int] = None, epoch: int = 0) -> "PipelineRun":
+        """Compile the stages and run them
+
+        Args:
+            seed (int, optional): Seed of the shuffle stages, None keeps the order. Defaults to None.
+            epoch (int, optional): Epoch, each one shuffles differently. Defaults to 0.
+
+        Returns:
+            PipelineRun: An iterator over the elements, with the timing of its stages
+        """
+        return PipelineRun(self._compile(seed, epoch))
+
+    def __iter__(self) -> Iterator[Any]:
+        return self.iterate()
+
+    def _compile(self, seed: Optional[int], epoch: int) -> List[_Compiled]:
+        stages = list(self.stages)
+        compiled: List[_Compiled] = []
+
+        gather = self._fused_gather(stages, seed, epoch)
+        if gather is not None:
+            compiled.append(gather)
+        else:
+            arrays, block_size = stages.pop(0).args
+            n = _rows(arrays)
+            compiled.append(
+                _Compiled(
+                    "from_arrays",
+                    lambda _: (_slice(arrays, i, i + block_size) for i in range(0, n, block_size)),
+                )
+            )
+
+        while stages:
+            stage = stages.pop(0)
+            if stage.kind == "map":
+                # consecutive maps are one call per element
+                fns = [stage.args[0]]
+                while stages and stages[0].kind == "map":
+                    fns.append(stages.pop(0).args[0])
+                compiled.append(_Compiled(">".join(["map"] * len(fns)), _map(fns)))
+            elif stage.kind == "parallel_map":
+                compiled.append(_Compiled("parallel_map", _parallel_map(*stage.args)))
+            elif stage.kind == "filter":
+                compiled.append(_Compiled("filter", _filter(*stage.args)))
+            elif stage.kind == "shuffle":
+                compiled.append(_Compiled("shuffle", _shuffle(stage.args[0], seed, epoch)))
+            elif stage.kind == "batch":
+                compiled.append(_Compiled("batch", _batch(*stage.args)))
+            elif stage.kind == "shard":
+                index, num_shards = stage.args
+                compiled.append(_Compiled("shard", lambda it, n=num_shards, i=index: itertools.islice(it, i, None, n)))
+            elif stage.kind == "skip":
+                compiled.append(_Compiled("skip", lambda it, n=stage.args[0]: itertools.islice(it, n, None)))
+            elif stage.kind == "prefetch":
+                compiled.append(_Compiled("prefetch", _prefetch(stage.args[0]), boundary=True))
+            else:
+                raise ValueError(f"unknown stage {stage.kind}")
+        return compiled
+
+    @staticmethod
+    def _fused_gather(stages: List[_Stage], seed: Optional[int], epoch: int) -> Optional[_Compiled]:
+        # from_arrays [> shuffle(all rows)] > batch [> shard] [> skip] is gather_batches from a cursor
+        kinds = [stage.kind for stage in stages]
+        arrays, _ = stages[0].args
+        pos = 1
+        names = ["from_arrays"]
+        if kinds[pos : pos + 1] == ["shuffle"]:
+            if stages[pos].args[0] < _rows(arrays):
+                return None
+            names.append("shuffle")
+            pos += 1
+        else:
+            seed = None
+        if kinds[pos : pos + 1] != ["batch"]:
+            return None
+        batch_size, drop_last = stages[pos].args
+        names.append("batch")
+        pos += 1
+        num_shards, shard, skip = 1, 0, 0
+        if kinds[pos : pos + 1] == ["shard"]:
+            shard, num_shards = stages[pos].args
+            names.append("shard")
+            pos += 1
+        if kinds[pos : pos + 1] == ["skip"]:
+            skip = stages[pos].args[0]
+            names.append("skip")
+            pos += 1
+
+        # gathered batches live in rotating buffers, there need to be enough for every batch held after this stage
+        held = 2
+        for stage in stages[pos:]:
+            if stage.kind == "prefetch":
+                held += stage.args[0] + 1
+            elif stage.kind == "parallel_map":
+                held += 2 * stage.args[1]
+        del stages[:pos]
+
+        cursor = Cursor(epoch, seed, skip)
+        return _Compiled(
+            ">".join(names),
+            lambda _: gather_batches(arrays, batch_size, cursor, drop_last, shard, num_shards, buffers=held),
+        )
+
+
+def _map(fns: List[Callable[[Any], Any]]) -> Callable[[Iterator[Any]], Iterator[Any]]:
+    def run(it: Iterator[Any]) -> Iterator[Any]:
+        for item in it:
+            for fn in fns:
+                item = fn(item)
+            yield item
+
+    return run
+
+
+def _parallel_map(fn: Callable[[Any], Any], workers: int) -> Callable[[Iterator[Any]], Iterator[Any]]:
+    def run(it: Iterator[Any]) -> Iterator[Any]:
+        pool = ThreadPoolExecutor(workers, thread_name_prefix="arc-pipeline")
+        pending: Deque[Future] = deque()
+        try:
+            for item in it:
+                pending.append(pool.submit(fn, item))
+                # keep every worker busy with one more queued, results come back in order
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    return run
+
+
+def _filter(fn: Callable[[Any], Any]) -> Callable[[Iterator[Any]], Iterator[Any]]:
+    def run(it: Iterator[Any]) -> Iterator[Any]:
+        for item in it:
+            keep = fn(item)
+            if isinstance(keep, np.ndarray) and keep.ndim == 1:
+                if keep.any():
+                    yield {name: arr[keep] for name, arr in item.items()}
+            elif keep:
+                yield item
+
+    return run
+
+
+def _shuffle(buffer: int, seed: Optional[int], epoch: int) -> Callable[[Iterator[Block]], Iterator[Block]]:
+    def run(it: Iterator[Block]) -> Iterator[Block]:
+        if seed is None:
+            yield from it
+            return
+
+        # the same generator as epoch_permutation, so a buffer holding every row gives the same order
+        rng = np.random.default_rng([seed, epoch])
+        buf: Optional[Block] = None
+        filled = 0
+        for block in it:
+            n = _rows(block)
+            if buf is None:
+                buf = {name: np.empty((buffer,) + arr.shape[1:], dtype=arr.dtype) for name, arr in block.items()}
+            start = 0
+            while start < n:
+                if filled < buffer:
+                    k = min(buffer - filled, n - start)
+                    for name, arr in block.items():
+                        buf[name][filled : filled + k] = arr[start : start + k]
+                    filled += k
+                    start += k
+                    continue
+                # each incoming row takes the place of a random row of the buffer, which goes out
+                k = min(buffer, n - start)
+                pos = rng.choice(buffer, k, replace=False)
+                out = {name: arr[pos] for name, arr in buf.items()}
+                for name, arr in block.items():
+                    buf[name][pos] = arr[start : start + k]
+                start += k
+                yield out
+
+        if buf is not None and filled > 0:
+            perm = rng.permutation(filled)
+            yield {name: arr[:filled][perm] for name, arr in buf.items()}
+
+    return run
+
+
+def _batch(batch_size: int, drop_last: bool) -> Callable[[Iterator[Block]], Iterator[Block]]:
+    def run(it: Iterator[Block]) -> Iterator[Block]:
+        parts: List[Block] = []
+        count = 0
+        for block in it:
+            n = _rows(block)
+            start = 0
+            while start < n:
+                # whole batches inside a block are views of it
+                if not parts and n - start >= batch_size:
+                    yield _slice(block, start, start + batch_size)
+                    start += batch_size
+                    continue
+                k = min(batch_size - count, n - start)
+                parts.append(_slice(block, start, start + k))
+                count += k
+                start += k
+                if count == batch_size:
+                    yield _concat(parts)
+                    parts, count = [], 0
+        if parts and not drop_last:
+            yield _concat(parts)
+
+    return run
+
+
+def _prefetch(size: int) -> Callable[[Iterator[Any]], Iterator[Any]]:
+    def run(it: Iterator[Any]) -> Iterator[Any]:
+        prefetcher = Prefetcher(lambda: it, size)
+        try:
+            yield from prefetcher
+        finally:
+            prefetcher.close()
+
+    return run
+
+
+def _timed(it: Iterator[Any], stats: StageStats) -> Iterator[Any]:
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            stats.seconds += time.perf_counter() - start
+            return
+        stats.seconds += time.perf_counter() - start
+        stats.items += 1
+        yield item
+
+
+class PipelineRun:
+    """An iterator over a pipeline's elements, timing each of its compiled stages"""
+
+    def __init__(self, compiled: List[_Compiled]) -> None:
+        """Chain the compiled stages, use `Pipeline.iterate` instead
+
+        Args:
+            compiled (List[_Compiled]): Compiled stages, source first
+        """
+        self.stats = PipelineStats([StageStats(stage.name) for stage in compiled])
+        self._boundaries = [stage.boundary for stage in compiled]
+        it: Optional[Iterator[Any]] = None
+        for stage, stats in zip(compiled, self.stats.stages):
+            it = _timed(iter(stage.run(it)), stats)
+        self._it: Iterator[Any] = it  # type: ignore
+
+    def __iter__(self) -> "PipelineRun":
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return next(self._it)
+        finally:
+            self._update()
+
+    def _update(self) -> None:
+        upstream = 0.0
+        for stats, boundary in zip(self.stats.stages, self._boundaries):
+            stats.own_seconds = max(stats.seconds - (0.0 if boundary else upstream), 0.0)
+            upstream = stats.seconds
+
+    def close(self) -> None:
+        """Stop the pipeline early, closing its stages"""
+        close = getattr(self._it, "close", None)
+        if close is not None:
+            close()
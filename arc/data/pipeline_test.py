@@ -0,0 +1,95 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from arc.data.pipeline import Pipeline, PipelineStats
+from arc.data.shuffle import gather_batches
+from arc.data.stream import Cursor
+
+
+def _arrays(n: int = 100):
+    return {"x": np.arange(n * 2).reshape(n, 2), "y": np.arange(n)}
+
+
+def _ys(batches):
+    return [batch["y"].tolist() for batch in batches]
+
+
+def test_pipeline_gather():
+    arrays = _arrays()
+    # the fused source, shuffle, batch, shard and skip gather the same batches as a cursor
+    run = Pipeline.from_arrays(arrays).shuffle(100).batch(8).shard(1, 3).skip(2).iterate(seed=4, epoch=1)
+    expected = _ys(gather_batches(arrays, 8, Cursor(1, 4, 2), shard=1, num_shards=3))
+    assert _ys(run) == expected and len(run.stats.stages) == 1
+    assert run.stats.stages[0].name == "from_arrays>shuffle>batch>shard>skip"
+
+    # unfused stages give the same batches
+    unfused = Pipeline.from_arrays(arrays, block_size=7).map(dict).shuffle(100).batch(8).shard(1, 3).skip(2)
+    assert _ys(unfused.iterate(seed=4, epoch=1)) == expected
+
+    # without a seed the rows keep their order, and partial batches can be kept
+    ys = _ys(Pipeline.from_arrays(arrays, block_size=30).shuffle(10).batch(16, drop_last=False).iterate())
+    assert ys[-1] == list(range(96, 100)) and sum(ys, []) == list(range(100))
+
+
+def test_pipeline_shuffle_buffer():
+    ys = _ys(Pipeline.from_arrays(_arrays(), block_size=10).shuffle(20).batch(10).iterate(seed=1))
+    rows = sum(ys, [])
+    assert sorted(rows) == list(range(100)) and rows != list(range(100))
+    # no row comes out before the buffer could have held it
+    assert all(row < i + 20 for i, row in enumerate(rows))
+
+
+def test_pipeline_stages():
+    pipeline = (
+        Pipeline.from_arrays(_arrays())
+        .filter(lambda block: block["y"] % 2 == 0)
+        .batch(10)
+        .map(lambda block: block["y"])
+        .map(lambda y: y * 10)
+        .parallel_map(lambda y: y + 1, workers=3)
+        .prefetch(2)
+    )
+    run = pipeline.iterate()
+    out = [y.tolist() for y in run]
+    assert out == [[20 * i + 1 for i in range(j * 10, (j + 1) * 10)] for j in range(5)]
+    names = [stage.name for stage in run.stats.stages]
+    assert names == ["from_arrays", "filter", "batch", "map>map", "parallel_map", "prefetch"]
+    assert run.stats.stages[-1].items == 5
+
+    with pytest.raises(ValueError):
+        Pipeline().batch(4)
+    with pytest.raises(ValueError):
+        Pipeline.from_arrays({"x": np.zeros(3), "y": np.zeros(4)})
+
+
+def test_pipeline_timing():
+    def slow(block):
+        time.sleep(0.01)
+        return block
+
+    run = Pipeline.from_arrays(_arrays()).batch(10).map(slow).map(lambda block: block).iterate()
+    list(run)
+    assert run.stats.bottleneck.name == "map>map"
+    assert run.stats.bottleneck.own_seconds >= 0.09
+    assert run.stats.repr_json()["bottleneck"] == "map>map"
+
+    # runs of the same pipeline add up stage by stage
+    again = Pipeline.from_arrays(_arrays()).batch(10).map(slow).map(lambda block: block).iterate()
+    list(again)
+    merged = PipelineStats.merge([run.stats, again.stats])
+    assert [stage.name for stage in merged.stages] == [stage.name for stage in run.stats.stages]
+    assert merged.stages[-1].items == 20
+    assert merged.bottleneck.own_seconds == run.stats.bottleneck.own_seconds + again.stats.bottleneck.own_seconds
+    assert PipelineStats.merge([]).repr_json() == {"stages": [], "bottleneck": None}
+
+
+def test_pipeline_close():
+    before = threading.active_count()
+    run = Pipeline.from_arrays(_arrays(1000), block_size=10).batch(10).prefetch(2).iterate()
+    next(run)
+    run.close()
+    time.sleep(0.3)
+    assert threading.active_count() == before
@@ -0,0 +1,271 @@
+"""Prefetch items from an iterator on a background thread"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generic, Iterator, Optional, TypeVar
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+T = TypeVar("T")
+
+
+@dataclass
+class PrefetchStats:
+    """Queue occupancy counters for a Prefetcher
+
+    A queue that is usually full means the consumer is the bottleneck, one that is usually empty means the producer is.
+    """
+
+    capacity: int
+    """Size of the queue"""
+
+    items: int = 0
+    """Number of items taken from the queue"""
+
+    occupancy: int = 0
+    """Sum of the queue sizes seen each time an item was taken"""
+
+    empty: int = 0
+    """Number of times the queue was empty, so the consumer had to wait on the producer"""
+
+    wait_seconds: float = 0.0
+    """Time the consumer spent waiting on the producer"""
+
+    @property
+    def mean_occupancy(self) -> float:
+        """Mean fraction of the queue that was filled when an item was taken"""
+        if self.items == 0:
+            return 0.0
+        return self.occupancy / (self.items * self.capacity)
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {
+            "capacity": self.capacity,
+            "items": self.items,
+            "occupancy": self.occupancy,
+            "empty": self.empty,
+            "wait_seconds": self.wait_seconds,
+            "mean_occupancy": self.mean_occupancy,
+        }
+
+
+class _End:
+    pass
+
+
+class _Error:
+    def __init__(self, e: BaseException) -> None:
+        self.e = e
+
+
+class Prefetcher(Generic[T]):
+    """Runs an iterator on a background thread, feeding a bounded queue
+
+    The iterator is created and exhausted on the producer thread, so anything it blocks on (receiving, decoding)
+    overlaps with whatever the consumer does with each item. Closing the prefetcher stops the producer even if it is
+    blocked, by calling `interrupt` to unblock it e.g. by shutting down a socket.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], Iterator[T]],
+        size: int,
+        interrupt: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Create a Prefetcher and start its producer thread
+
+        Args:
+            source (Callable[[], Iterator[T]]): Creates the iterator to prefetch from
+            size (int): Maximum number of items to prefetch
+            interrupt (Callable[[], None], optional): Unblocks the iterator when closing early. Defaults to None.
+        """
+        if size < 1:
+            raise ValueError("prefetch size must be at least 1")
+        self.stats = PrefetchStats(capacity=size)
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=size)
+        self._interrupt = interrupt
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce, args=(source,), name="arc-prefetch", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, source: Callable[[], Iterator[T]]) -> None:
+        it: Optional[Iterator[T]] = None
+        try:
+            it = source()
+            for item in it:
+                if not self._put(item):
+                    return
+            self._put(_End())
+        except BaseException as e:
+            if not self._stop.is_set():
+                self._put(_Error(e))
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logging.debug(f"error closing prefetched iterator: {e}")
+
+    def __iter__(self) -> "Prefetcher[T]":
+        return self
+
+    def __next__(self) -> T:
+        if self._done:
+            raise StopIteration
+
+        size = self._queue.qsize()
+        start = time.perf_counter()
+        item = self._queue.get()
+        waited = time.perf_counter() - start
+
+        if isinstance(item, _End):
+            self._done = True
+            raise StopIteration
+        if isinstance(item, _Error):
+            self._done = True
+            raise item.e
+
+        self.stats.items += 1
+        self.stats.occupancy += size
+        if size == 0:
+            self.stats.empty += 1
+            self.stats.wait_seconds += waited
+        return item
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the producer and wait for it to exit
+
+        Args:
+            timeout (float, optional): Seconds to wait for the producer thread. Defaults to 5.0.
+        """
+        self._done = True
+        if not self._thread.is_alive():
+            return
+        self._stop.set()
+        if self._interrupt is not None:
+            self._interrupt()
+        # free up space in case the producer is blocked putting
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("prefetch thread did not exit in time")
+
+
+class AsyncPrefetcher(Generic[T]):
+    """Runs a blocking iterator on a background thread, feeding a bounded asyncio queue
+
+    Lets an async handler consume a synchronous generator without blocking the event loop. It must be created on the
+    event loop it is consumed from.
+    """
+
+    def __init__(self, source: Callable[[], Iterator[T]], size: int) -> None:
+        """Create an AsyncPrefetcher and start its producer thread
+
+        Args:
+            source (Callable[[], Iterator[T]]): Creates the iterator to prefetch from
+            size (int): Maximum number of items to prefetch
+        """
+        if size < 1:
+            raise ValueError("prefetch size must be at least 1")
+        self.stats = PrefetchStats(capacity=size)
+        self._loop = asyncio.get_running_loop()
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=size)
+        # free queue slots, the producer only hands an item to the loop once there is room for it
+        self._slots = threading.Semaphore(size)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce, args=(source,), name="arc-producer", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            if not self._slots.acquire(timeout=0.1):
+                continue
+            try:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+            except RuntimeError:
+                # the loop was closed under us
+                return False
+            return True
+        return False
+
+    def _produce(self, source: Callable[[], Iterator[T]]) -> None:
+        it: Optional[Iterator[T]] = None
+        try:
+            it = source()
+            for item in it:
+                if not self._put(item):
+                    return
+            self._put(_End())
+        except BaseException as e:
+            if not self._stop.is_set():
+                self._put(_Error(e))
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logging.debug(f"error closing prefetched iterator: {e}")
+
+    def __aiter__(self) -> "AsyncPrefetcher[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        if self._done:
+            raise StopAsyncIteration
+
+        size = self._queue.qsize()
+        start = time.perf_counter()
+        item = await self._queue.get()
+        waited = time.perf_counter() - start
+        self._slots.release()
+
+        if isinstance(item, _End):
+            self._done = True
+            raise StopAsyncIteration
+        if isinstance(item, _Error):
+            self._done = True
+            raise item.e
+
+        self.stats.items += 1
+        self.stats.occupancy += size
+        if size == 0:
+            self.stats.empty += 1
+            self.stats.wait_seconds += waited
+        return item
+
+    def close(self) -> None:
+        """Stop the producer without waiting for it
+
+        The producer notices on its next put, an item it is blocked computing is discarded once it is done.
+        """
+        self._done = True
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from arc.data.prefetch import AsyncPrefetcher, Prefetcher
+
+
+def test_prefetch_order():
+    prefetcher = Prefetcher(lambda: iter(range(100)), 4)
+    assert list(prefetcher) == list(range(100))
+    assert prefetcher.stats.items == 100
+    assert 0.0 <= prefetcher.stats.mean_occupancy <= 1.0
+
+    # a slow consumer finds the queue full
+    prefetcher = Prefetcher(lambda: iter(range(10)), 2)
+    time.sleep(0.1)
+    assert next(prefetcher) == 0
+    assert prefetcher.stats.occupancy == 2
+    assert prefetcher.stats.empty == 0
+    prefetcher.close()
+
+
+def test_prefetch_close_early():
+    closed = threading.Event()
+
+    def gen():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    prefetcher = Prefetcher(gen, 3)
+    for i, item in enumerate(prefetcher):
+        assert item == i
+        if i == 50:
+            break
+    prefetcher.close()
+    assert closed.is_set()
+    assert not prefetcher._thread.is_alive()
+
+
+def test_prefetch_interrupt():
+    unblock = threading.Event()
+
+    def gen():
+        yield 1
+        # stands in for a blocking receive
+        unblock.wait()
+        raise ConnectionError("socket shut down")
+
+    prefetcher = Prefetcher(gen, 2, interrupt=unblock.set)
+    assert next(prefetcher) == 1
+    prefetcher.close(timeout=1.0)
+    assert not prefetcher._thread.is_alive()
+    with pytest.raises(StopIteration):
+        next(prefetcher)
+
+
+def test_prefetch_error():
+    def gen():
+        yield 1
+        raise ValueError("bad batch")
+
+    prefetcher = Prefetcher(gen, 2)
+    assert next(prefetcher) == 1
+    with pytest.raises(ValueError, match="bad batch"):
+        next(prefetcher)
+    with pytest.raises(StopIteration):
+        next(prefetcher)
+
+    with pytest.raises(ValueError):
+        Prefetcher(lambda: iter([]), 0)
+
+
+# closing early must not leave a queue put un-awaited
+@pytest.mark.filterwarnings("error")
+def test_async_prefetch():
+    closed = threading.Event()
+
+    def gen():
+        try:
+            for i in range(1000):
+                # blocking work on the producer thread
+                time.sleep(0.001)
+                yield i
+        finally:
+            closed.set()
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker = asyncio.create_task(tick())
+        prefetcher = AsyncPrefetcher(lambda: iter(range(20)), 2)
+        assert [i async for i in prefetcher] == list(range(20))
+
+        # the event loop keeps running while the producer works, and closing stops it early
+        prefetcher = AsyncPrefetcher(gen, 2)
+        async for i in prefetcher:
+            if i == 20:
+                break
+        prefetcher.close()
+        assert ticks > 5
+        ticker.cancel()
+
+        prefetcher = AsyncPrefetcher(lambda: (1 // 0 for _ in range(1)), 2)
+        with pytest.raises(ZeroDivisionError):
+            await prefetcher.__anext__()
+
+    asyncio.run(run())
+    assert closed.wait(1.0)
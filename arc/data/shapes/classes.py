@@ -60,6 +60,8 @@ class ClassData(Data):
     names: Optional[List[str]] = None
     """Names of the classes"""
 
+    batch_fields = ("size",)
+
     def __add__(self, s: ClassData) -> ClassData:
         if s.encoding != self.encoding:
             raise ValueError("cannot add class datas of two different encoding types")
@@ -127,7 +129,7 @@ class ClassData(Data):
         Returns:
             Dict[str, Any]: A JSON serializable dict
         """
-        d = self.__dict__
+        d = super().repr_json()
         d["data"] = self.data.tolist()
         return d
 
@@ -150,6 +152,102 @@ class ClassData(Data):
         return ClassDataScore
 
 
+class SampleStrategy(str, Enum):
+    """How the rows of a sampled batch are picked"""
+
+    RANDOM = "random"
+    """However the job samples"""
+
+    STRATIFIED = "stratified"
+    """Each class in proportion to its share of the data"""
+
+    BALANCED = "balanced"
+    """Each class equally often"""
+
+
+class ClassIndex:
+    """Rows of each class, built once so class aware batches can be drawn without scanning the labels
+
+    Rows are grouped by class in one array, class `c` is `rows[offsets[c] : offsets[c] + counts[c]]`. Drawing a batch
+    is O(batch_size), rows are drawn with replacement within their class.
+    """
+
+    def __init__(self, labels: NDArray, num_classes: int) -> None:
+        """Create a ClassIndex
+
+        Args:
+            labels (NDArray): Categorical label of every row
+            num_classes (int): Number of possible classes
+        """
+        labels = np.asarray(labels).astype(np.int64, copy=False)
+        self.num_classes = num_classes
+        self.rows = np.argsort(labels, kind="stable")
+        self.counts = np.bincount(labels, minlength=num_classes)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.classes = np.flatnonzero(self.counts)
+
+    @classmethod
+    def from_data(cls, y: ClassData) -> ClassIndex:
+        """Build the index of the class data of a whole dataset
+
+        Args:
+            y (ClassData): Class data of every row
+
+        Returns:
+            ClassIndex: The index
+        """
+        return cls(y.as_categorical().data, y.num_classes)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def class_counts(self, batch_size: int, strategy: SampleStrategy, rng: np.random.Generator) -> NDArray:
+        """Number of rows of each class in a batch
+
+        Args:
+            batch_size (int): Size of the batch
+            strategy (SampleStrategy): Stratified or balanced
+            rng (np.random.Generator): Picks the classes that get the rows left over after an even split
+
+        Returns:
+            NDArray: Rows of each class
+        """
+        if strategy == SampleStrategy.STRATIFIED:
+            share = batch_size * self.counts / self.counts.sum()
+        elif strategy == SampleStrategy.BALANCED:
+            share = np.zeros(self.num_classes)
+            share[self.classes] = batch_size / len(self.classes)
+        else:
+            raise ValueError(f"class index can't sample with strategy '{strategy}'")
+
+        counts = np.floor(share).astype(np.int64)
+        left = batch_size - counts.sum()
+        if left:
+            # the rows left over go to classes with the largest remainders, ties broken at random
+            remainder = share - counts + rng.random(self.num_classes) * 1e-9
+            remainder[self.counts == 0] = -1
+            counts[np.argpartition(-remainder, left - 1)[:left]] += 1
+        return counts
+
+    def sample(self, batch_size: int, strategy: SampleStrategy, rng: Optional[np.random.Generator] = None) -> NDArray:
+        """Draw the rows of a batch, grouped by class
+
+        Args:
+            batch_size (int): Size of the batch
+            strategy (SampleStrategy): Stratified or balanced
+            rng (np.random.Generator, optional): Random generator. Defaults to None, which uses a new one.
+
+        Returns:
+            NDArray: Row indices
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        counts = self.class_counts(batch_size, strategy, rng)
+        cls = np.repeat(np.arange(self.num_classes), counts)
+        pos = self.offsets[cls] + (rng.random(batch_size) * self.counts[cls]).astype(np.int64)
+        return self.rows[pos]
+
+
 @dataclass
 class ClassDataReport(EvalReport):
     """A report for Class Data"""
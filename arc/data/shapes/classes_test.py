@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from arc.data.shapes.classes import ClassData, ClassEncoding, ClassIndex, SampleStrategy
+
+
+def test_class_index():
+    # 90% class 0, no class 2
+    labels = np.array([0] * 900 + [1] * 60 + [3] * 40)
+    np.random.default_rng(0).shuffle(labels)
+    index = ClassIndex(labels, 4)
+    assert list(index.counts) == [900, 60, 0, 40] and list(index.classes) == [0, 1, 3]
+    for c in range(4):
+        rows = index.rows[index.offsets[c] : index.offsets[c] + index.counts[c]]
+        assert (labels[rows] == c).all()
+
+    rng = np.random.default_rng(1)
+    rows = index.sample(100, SampleStrategy.STRATIFIED, rng)
+    assert list(np.bincount(labels[rows], minlength=4)) == [90, 6, 0, 4]
+
+    rows = index.sample(32, SampleStrategy.BALANCED, rng)
+    counts = np.bincount(labels[rows], minlength=4)
+    assert counts[2] == 0 and sorted(counts[[0, 1, 3]]) == [10, 11, 11]
+
+    # the same seed draws the same batch
+    a = index.sample(16, SampleStrategy.BALANCED, np.random.default_rng([7, 0, 3]))
+    b = index.sample(16, SampleStrategy.BALANCED, np.random.default_rng([7, 0, 3]))
+    assert np.array_equal(a, b)
+
+    one_hot = ClassData(np.arange(4) % 2, 2, 4, ClassEncoding.CATEGORICAL).as_one_hot()
+    assert list(ClassIndex.from_data(one_hot).counts) == [2, 2]
+
+    with pytest.raises(ValueError):
+        index.sample(8, SampleStrategy.RANDOM)
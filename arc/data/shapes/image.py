@@ -31,6 +31,8 @@ class ImageData(Data):
     num_images: int
     """Number of images"""
 
+    batch_fields = ("num_images",)
+
     @classmethod
     def short_name(self) -> str:
         """Short name for the data
@@ -62,7 +64,7 @@ class ImageData(Data):
         Returns:
             Dict[str, Any]: A JSON serializable dict
         """
-        d = self.__dict__
+        d = super().repr_json()
         d["data"] = self.data.tolist()
         return d
 
@@ -79,3 +81,91 @@ class ImageData(Data):
         """
         data["data"] = np.asarray(data["data"])
         return cls(**data)
+
+
+@dataclass
+class ImageAugment:
+    """Random flips, crops, brightness and noise applied to a whole batch of images at once
+
+    Every image gets its own draw, but the batch is transformed with array operations over its
+    `(num_images, height, width, channels)` tensor rather than image by image. Given the same generator the result is
+    the same, jobs seed it per batch so shards, worker processes and resumed streams augment a batch identically, see
+    `SupervisedJob.augment`.
+    """
+
+    flip_horizontal: float = 0.0
+    """Probability of flipping an image left to right"""
+
+    flip_vertical: float = 0.0
+    """Probability of flipping an image upside down"""
+
+    crop_padding: int = 0
+    """Pixels each image is padded by on every side, by reflection, before cropping back to its size at a random
+    offset, so it shifts by up to this many pixels"""
+
+    brightness: float = 0.0
+    """Largest change of brightness, each image is offset by a uniform draw between plus and minus this"""
+
+    noise: float = 0.0
+    """Standard deviation of the gaussian noise added to every pixel"""
+
+    clip: Optional[Tuple[float, float]] = None
+    """Range to clip pixels to after brightness and noise e.g. (0, 1), integer images are always clipped to their
+    dtype's range"""
+
+    def apply(self, images: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Augment a tensor of images
+
+        Args:
+            images (np.ndarray): Images of shape `(num_images, height, width, channels)`
+            rng (np.random.Generator): Generator of the random draws
+
+        Returns:
+            np.ndarray: Augmented images of the same shape and dtype, the input is not modified
+        """
+        n, h, w, _ = images.shape
+        out = images
+
+        if self.flip_horizontal > 0:
+            flip = rng.random(n) < self.flip_horizontal
+            out = np.where(flip[:, None, None, None], out[:, :, ::-1], out)
+        if self.flip_vertical > 0:
+            flip = rng.random(n) < self.flip_vertical
+            out = np.where(flip[:, None, None, None], out[:, ::-1], out)
+
+        if self.crop_padding > 0:
+            pad = self.crop_padding
+            padded = np.pad(out, ((0, 0), (pad, pad), (pad, pad), (0, 0)), mode="reflect")
+            # one gather of every image's window, rows and columns offset per image
+            rows = rng.integers(0, 2 * pad + 1, n)[:, None] + np.arange(h)
+            cols = rng.integers(0, 2 * pad + 1, n)[:, None] + np.arange(w)
+            out = padded[np.arange(n)[:, None, None], rows[:, :, None], cols[:, None, :]]
+
+        if self.brightness > 0 or self.noise > 0:
+            dtype = images.dtype
+            work = out.astype(np.float32) if not np.issubdtype(dtype, np.floating) else out
+            if self.brightness > 0:
+                work = work + rng.uniform(-self.brightness, self.brightness, n).astype(work.dtype)[:, None, None, None]
+            if self.noise > 0:
+                work = work + rng.normal(0, self.noise, work.shape).astype(work.dtype)
+            if self.clip is not None:
+                work = np.clip(work, *self.clip)
+            if np.issubdtype(dtype, np.integer):
+                info = np.iinfo(dtype)
+                work = np.clip(np.rint(work), info.min, info.max)
+            out = work.astype(dtype, copy=False)
+
+        return out if out is not images else images.copy()
+
+    def __call__(self, images: ImageData, rng: np.random.Generator) -> ImageData:
+        """Augment a batch of image data
+
+        Args:
+            images (ImageData): The batch
+            rng (np.random.Generator): Generator of the random draws
+
+        Returns:
+            ImageData: The augmented batch, its data in the same layout as the input's
+        """
+        data = self.apply(images.as_image_shape(), rng).reshape(images.data.shape)
+        return ImageData(data, images.width, images.height, images.channels, images.num_images)
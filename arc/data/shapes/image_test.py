@@ -0,0 +1,50 @@
+import numpy as np
+
+from arc.data.shapes.image import ImageAugment, ImageData
+
+
+def _images(n: int = 6, dtype=np.uint8) -> ImageData:
+    data = np.arange(n * 5 * 4 * 3).reshape(n, 5 * 4 * 3).astype(dtype)
+    return ImageData(data, 4, 5, 3, n)
+
+
+def test_image_augment_flips():
+    images = _images()
+    square = images.as_image_shape()
+
+    flipped = ImageAugment(flip_horizontal=1.0).apply(square, np.random.default_rng(0))
+    assert np.array_equal(flipped, square[:, :, ::-1])
+    flipped = ImageAugment(flip_vertical=1.0).apply(square, np.random.default_rng(0))
+    assert np.array_equal(flipped, square[:, ::-1])
+
+    # each image is flipped on its own draw
+    flipped = ImageAugment(flip_horizontal=0.5).apply(square, np.random.default_rng(3))
+    for image, out in zip(square, flipped):
+        assert np.array_equal(out, image) or np.array_equal(out, image[:, ::-1])
+
+    # the input isn't modified, even when nothing is drawn
+    same = ImageAugment().apply(square, np.random.default_rng(0))
+    assert np.array_equal(same, square) and same is not square
+
+
+def test_image_augment():
+    images = _images()
+    augment = ImageAugment(flip_horizontal=0.5, crop_padding=2, brightness=20, noise=3)
+
+    out = augment(images, np.random.default_rng([1, 2]))
+    assert out.data.shape == images.data.shape
+    assert out.data.dtype == np.uint8
+    assert (out.width, out.height, out.channels, out.num_images) == (4, 5, 3, 6)
+    assert np.array_equal(out.data, augment(images, np.random.default_rng([1, 2])).data)
+    assert not np.array_equal(out.data, augment(images, np.random.default_rng([1, 3])).data)
+
+    # crops are windows of the reflected image
+    square = images.as_image_shape()
+    cropped = ImageAugment(crop_padding=1).apply(square, np.random.default_rng(0))
+    padded = np.pad(square, ((0, 0), (1, 1), (1, 1), (0, 0)), mode="reflect")
+    for image, out in zip(padded, cropped):
+        assert any(np.array_equal(out, image[r : r + 5, c : c + 4]) for r in range(3) for c in range(3))
+
+    floats = _images(dtype=np.float32)
+    out = ImageAugment(noise=100.0, clip=(0.0, 1.0)).apply(floats.as_image_shape(), np.random.default_rng(0))
+    assert out.dtype == np.float32 and out.min() >= 0 and out.max() <= 1
@@ -0,0 +1,311 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+import numpy as np
+import pandas as pd
+from tableschema import Schema
+
+from arc.data.types import NDArray, Data
+
+# dtypes of the column arrays by Table Schema field type, string columns hold codes into their dictionary
+_FIELD_DTYPES = {
+    "integer": "int64",
+    "number": "float64",
+    "boolean": "bool",
+    "string": "int32",
+    "datetime": "datetime64[ns]",
+    "date": "datetime64[ns]",
+}
+
+_COLUMN_PREFIX = "c:"
+_VALID_PREFIX = "v:"
+
+
+def _field_type(col: pd.Series) -> str:
+    kind = col.dtype.kind
+    if kind in "iu":
+        return "integer"
+    if kind == "f":
+        return "number"
+    if kind == "b":
+        return "boolean"
+    if kind == "M":
+        return "datetime"
+    return "string"
+
+
+@dataclass
+class TableData(Data):
+    """Tabular data stored by column
+
+    Each column is its own contiguous typed array, string columns are dictionary encoded as int32 codes and columns
+    with nulls have a validity bitmap. Slicing rows only takes views of the column arrays and the binary encoding sends
+    them as they are, so batches never go through rows or DataFrames.
+    """
+
+    columns: Dict[str, NDArray]
+    """Values of each column, string columns hold codes into their dictionary"""
+
+    valid: Dict[str, NDArray]
+    """Validity bitmaps packed little endian as uint8, for the columns that have nulls"""
+
+    dictionaries: Dict[str, List[str]]
+    """Dictionary of each string column"""
+
+    schema: Dict[str, Any]
+    """Table Schema descriptor of the columns"""
+
+    size: int
+    """Number of rows"""
+
+    valid_offset: int = 0
+    """Bit offset of the first row in the validity bitmaps"""
+
+    batch_fields = ("size", "valid_offset")
+
+    @classmethod
+    def from_dataframe(
+        cls: Type[TableData], df: pd.DataFrame, schema: Optional[Union[Schema, Dict[str, Any]]] = None
+    ) -> TableData:
+        """Create TableData from a DataFrame
+
+        Args:
+            df (pd.DataFrame): The DataFrame
+            schema (Union[Schema, Dict[str, Any]], optional): Table Schema of the columns to take. Defaults to None,
+                which infers it from the DataFrame dtypes.
+
+        Raises:
+            ValueError: If the schema is invalid or has unsupported field types
+
+        Returns:
+            TableData: A TableData object
+        """
+        if schema is None:
+            schema = {"fields": [{"name": str(name), "type": _field_type(df[name])} for name in df.columns]}
+        if not isinstance(schema, Schema):
+            schema = Schema(schema)
+        if not schema.valid:
+            raise ValueError(f"invalid table schema: {schema.errors}")
+
+        columns: Dict[str, NDArray] = {}
+        valid: Dict[str, NDArray] = {}
+        dictionaries: Dict[str, List[str]] = {}
+        for field in schema.fields:
+            if field.type not in _FIELD_DTYPES:
+                raise ValueError(f"field '{field.name}' has unsupported type '{field.type}'")
+
+            col = df[field.name]
+            nulls = col.isna().to_numpy()
+            has_nulls = bool(nulls.any())
+
+            if field.type == "string":
+                codes, uniques = pd.factorize(col)
+                codes = codes.astype(np.int32)
+                codes[nulls] = 0
+                columns[field.name] = codes
+                dictionaries[field.name] = [str(u) for u in uniques]
+            elif field.type == "number":
+                columns[field.name] = col.to_numpy(dtype=np.float64, na_value=np.nan)
+            elif field.type in ("datetime", "date"):
+                columns[field.name] = pd.to_datetime(col).to_numpy(dtype="datetime64[ns]")
+            else:
+                dtype = np.dtype(_FIELD_DTYPES[field.type])
+                columns[field.name] = col.to_numpy(dtype=dtype, na_value=dtype.type(0))
+
+            if has_nulls:
+                valid[field.name] = np.packbits(~nulls, bitorder="little")
+
+        return cls(columns, valid, dictionaries, schema.descriptor, len(df))
+
+    @classmethod
+    def short_name(cls) -> str:
+        """Short name for the data
+
+        Returns:
+            str: The short name
+        """
+        return "tbl"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def field_types(self) -> Dict[str, str]:
+        """Table Schema type of each column
+
+        Returns:
+            Dict[str, str]: Types by column name
+        """
+        return {field["name"]: field.get("type", "string") for field in self.schema["fields"]}
+
+    def is_valid(self, name: str) -> NDArray:
+        """Which rows of a column are not null
+
+        Args:
+            name (str): Name of the column
+
+        Returns:
+            NDArray: A bool NDArray
+        """
+        bits = self.valid.get(name)
+        if bits is None:
+            return np.ones(self.size, dtype=bool)
+        unpacked = np.unpackbits(bits, bitorder="little")
+        return unpacked[self.valid_offset : self.valid_offset + self.size].astype(bool)
+
+    def slice(self, start: int, stop: int) -> TableData:
+        """Slice rows without copying
+
+        Args:
+            start (int): Index of the first row
+            stop (int): Index after the last row
+
+        Returns:
+            TableData: A view of the rows
+        """
+        start, stop, _ = slice(start, stop).indices(self.size)
+        stop = max(start, stop)
+        first = self.valid_offset + start
+        last = self.valid_offset + stop
+        return type(self)(
+            {name: col[start:stop] for name, col in self.columns.items()},
+            {name: bits[first // 8 : (last + 7) // 8] for name, bits in self.valid.items()},
+            self.dictionaries,
+            self.schema,
+            stop - start,
+            first % 8,
+        )
+
+    def batches(self, batch_size: int) -> Iterator[TableData]:
+        """Iterate over the rows in batches, dropping the last partial batch
+
+        Args:
+            batch_size (int): Number of rows in each batch
+
+        Yields:
+            Iterator[TableData]: Views of each batch
+        """
+        for i in range(self.size // batch_size):
+            yield self.slice(batch_size * i, batch_size * (i + 1))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Convert to a DataFrame, nulls become NA
+
+        Returns:
+            pd.DataFrame: The DataFrame
+        """
+        types = self.field_types()
+        data: Dict[str, Any] = {}
+        for name, col in self.columns.items():
+            valid = self.is_valid(name)
+            if types[name] == "string":
+                data[name] = pd.Categorical.from_codes(np.where(valid, col, -1), categories=self.dictionaries[name])
+            elif types[name] == "integer" and name in self.valid:
+                data[name] = pd.arrays.IntegerArray(col.astype(np.int64), ~valid)
+            elif types[name] == "boolean" and name in self.valid:
+                data[name] = pd.arrays.BooleanArray(col, ~valid)
+            elif types[name] in ("datetime", "date") and name in self.valid:
+                data[name] = np.where(valid, col, np.datetime64("NaT"))
+            elif name in self.valid:
+                data[name] = np.where(valid, col, np.nan)
+            else:
+                data[name] = col
+        return pd.DataFrame(data)
+
+    def as_ndarray(self) -> NDArray:
+        """Table data as a 2D NDArray with one column per column, string columns are their dictionary codes
+
+        Returns:
+            NDArray: An NDArray of the table
+        """
+        return np.column_stack(list(self.columns.values()))
+
+    def repr_wire(self) -> Tuple[Dict[str, Any], Dict[str, NDArray]]:
+        """Split the object into scalar fields and arrays for the binary wire format
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, NDArray]]: JSON serializable fields and arrays
+        """
+        arrays: Dict[str, NDArray] = {}
+        for name, col in self.columns.items():
+            arrays[_COLUMN_PREFIX + name] = col
+        for name, bits in self.valid.items():
+            arrays[_VALID_PREFIX + name] = bits
+
+        scalars = {
+            "dictionaries": self.dictionaries,
+            "schema": self.schema,
+            "size": self.size,
+            "valid_offset": self.valid_offset,
+        }
+        return scalars, arrays
+
+    @classmethod
+    def load_wire(cls: Type[TableData], scalars: Dict[str, Any], arrays: Dict[str, NDArray]) -> TableData:
+        """Load object from the binary wire format
+
+        Args:
+            cls (Type[TableData]): the TableData class
+            scalars (Dict[str, Any]): Scalar fields
+            arrays (Dict[str, NDArray]): Array fields
+
+        Returns:
+            TableData: A TableData object
+        """
+        columns: Dict[str, NDArray] = {}
+        valid: Dict[str, NDArray] = {}
+        for key, arr in arrays.items():
+            if key.startswith(_COLUMN_PREFIX):
+                columns[key[len(_COLUMN_PREFIX) :]] = arr
+            elif key.startswith(_VALID_PREFIX):
+                valid[key[len(_VALID_PREFIX) :]] = arr
+        return cls(columns, valid, scalars["dictionaries"], scalars["schema"], scalars["size"], scalars["valid_offset"])
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        columns: Dict[str, Any] = {}
+        for name, col in self.columns.items():
+            if col.dtype.kind == "M":
+                col = col.astype(np.int64)
+            columns[name] = col.tolist()
+        return {
+            "columns": columns,
+            "valid": {name: bits.tolist() for name, bits in self.valid.items()},
+            "dictionaries": self.dictionaries,
+            "schema": self.schema,
+            "size": self.size,
+            "valid_offset": self.valid_offset,
+        }
+
+    @classmethod
+    def load_dict(cls: Type[TableData], data: Dict[str, Any]) -> TableData:
+        """Load object from JSON
+
+        Args:
+            cls (Type[TableData]): the TableData class
+            data (Dict[str, Any]): the dict to create from
+
+        Returns:
+            TableData: A TableData object
+        """
+        types = {field["name"]: field.get("type", "string") for field in data["schema"]["fields"]}
+        columns: Dict[str, NDArray] = {}
+        for name, col in data["columns"].items():
+            dtype = _FIELD_DTYPES[types[name]]
+            if dtype.startswith("datetime64"):
+                columns[name] = np.asarray(col, dtype=np.int64).view(dtype)
+            else:
+                columns[name] = np.asarray(col, dtype=dtype)
+        valid = {name: np.asarray(bits, dtype=np.uint8) for name, bits in data["valid"].items()}
+        return cls(
+            columns,
+            valid,
+            data["dictionaries"],
+            data["schema"],
+            data["size"],
+            data.get("valid_offset", 0),
+        )
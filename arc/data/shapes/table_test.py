@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from arc.data.encoding import ShapeEncoder, encode_session, encode_batches, decode_batches
+from arc.data.shapes.table import TableData
+
+
+def _frame(n: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "id": np.arange(n),
+            "score": np.where(np.arange(n) % 3 == 0, np.nan, np.arange(n) / 2),
+            "city": [None if i % 5 == 0 else ["sf", "nyc", "la"][i % 3] for i in range(n)],
+            "active": np.arange(n) % 2 == 0,
+            "count": pd.array([None if i % 4 == 0 else i for i in range(n)], dtype="Int64"),
+            "seen": pd.date_range("2022-01-01", periods=n, freq="D"),
+        }
+    )
+
+
+def test_table_data():
+    df = _frame(20)
+    table = TableData.from_dataframe(df)
+    assert {f["name"]: f["type"] for f in table.schema["fields"]} == {
+        "id": "integer",
+        "score": "number",
+        "city": "string",
+        "active": "boolean",
+        "count": "integer",
+        "seen": "datetime",
+    }
+    assert table.columns["city"].dtype == np.int32
+    assert sorted(table.valid) == ["city", "count", "score"]
+    pd.testing.assert_frame_equal(table.to_dataframe(), df, check_dtype=False, check_categorical=False)
+
+    # slices are views, including bitmaps that don't start on a byte boundary
+    batch = table.slice(3, 14)
+    assert batch.valid_offset == 3
+    assert np.shares_memory(batch.columns["id"], table.columns["id"])
+    assert np.array_equal(batch.is_valid("count"), df["count"].notna().to_numpy()[3:14])
+    expected = df.iloc[3:14].reset_index(drop=True)
+    pd.testing.assert_frame_equal(batch.to_dataframe(), expected, check_dtype=False, check_categorical=False)
+
+    # the session header carries the schema and dictionaries, batches only carry column buffers
+    fields, _ = decode_batches(encode_session({"t": batch}), {"t": TableData}, {})
+    session = {name: part["fields"] for name, part in fields["session"].items()}
+    msg = encode_batches([{"t": b} for b in table.batches(8)])
+    assert b"nyc" not in msg
+    _, batches = decode_batches(msg, {"t": TableData}, session, copy=False)
+    assert len(batches) == 2
+    expected = df.iloc[8:16].reset_index(drop=True)
+    pd.testing.assert_frame_equal(batches[1]["t"].to_dataframe(), expected, check_dtype=False, check_categorical=False)
+
+    d = json.loads(json.dumps(batch, cls=ShapeEncoder))
+    pd.testing.assert_frame_equal(
+        TableData.load_dict(d).to_dataframe(), batch.to_dataframe(), check_dtype=False, check_categorical=False
+    )
@@ -1,35 +1,151 @@
 from __future__ import annotations
-from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Generic, Iterator, List, Optional, Tuple, TypeVar, Dict, Type, NewType
-from enum import Enum
+from typing import Any, Iterator, List, Sequence, Dict, Type
 
 import numpy as np
-from dataclasses_jsonschema import JsonSchemaMixin, DEFAULT_SCHEMA_TYPE, JsonDict, SchemaType
-from dataclasses_jsonschema import JsonSchemaMixin, FieldEncoder
 
 from arc.data.types import NDArray, Data
 
 
 @dataclass
 class TextData(Data):
-    """Text data"""
+    """Text data as a ragged array
 
-    data: NDArray
-    """The text data as an ND array"""
+    Strings are stored Arrow style as one contiguous UTF-8 buffer of `values` and an `offsets` array of `size + 1`
+    byte offsets. Offsets are absolute, `values` starts at `offsets[0]`, so string `i` is
+    `values[offsets[i] - offsets[0] : offsets[i + 1] - offsets[0]]`. This lets slices keep the offsets of the batch
+    they came from, so slicing, batching and wire encoding are all views that never touch per-string objects.
+    """
+
+    values: NDArray
+    """UTF-8 bytes of the strings as a uint8 NDArray"""
+
+    offsets: NDArray
+    """Absolute byte offsets of the strings as an int32 or int64 NDArray"""
+
+    size: int
+    """Number of strings"""
+
+    batch_fields = ("size",)
+
+    @classmethod
+    def from_strings(cls: Type[TextData], strings: Sequence[str]) -> TextData:
+        """Create TextData from strings
+
+        Args:
+            strings (Sequence[str]): The strings
+
+        Returns:
+            TextData: A TextData object
+        """
+        encoded = [s.encode("utf-8") for s in strings]
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+        total = int(lengths.sum())
+
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int32 if total < 2**31 else np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(values, offsets, len(encoded))
+
+    @classmethod
+    def short_name(cls) -> str:
+        """Short name for the data
+
+        Returns:
+            str: The short name
+        """
+        return "txt"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(f"index {i} out of range for TextData of size {self.size}")
+        base = self.offsets[0]
+        return self.values[self.offsets[i] - base : self.offsets[i + 1] - base].tobytes().decode("utf-8")
+
+    def slice(self, start: int, stop: int) -> TextData:
+        """Slice the strings without copying
+
+        Args:
+            start (int): Index of the first string
+            stop (int): Index after the last string
+
+        Returns:
+            TextData: A view of the strings
+        """
+        start, stop, _ = slice(start, stop).indices(self.size)
+        stop = max(start, stop)
+        base = self.offsets[0]
+        offsets = self.offsets[start : stop + 1]
+        values = self.values[offsets[0] - base : offsets[-1] - base]
+        return type(self)(values, offsets, stop - start)
+
+    def batches(self, batch_size: int) -> Iterator[TextData]:
+        """Iterate over the strings in batches, dropping the last partial batch
+
+        Args:
+            batch_size (int): Number of strings in each batch
+
+        Yields:
+            Iterator[TextData]: Views of each batch
+        """
+        for i in range(self.size // batch_size):
+            yield self.slice(batch_size * i, batch_size * (i + 1))
+
+    def lengths(self) -> NDArray:
+        """Byte length of each string
+
+        Returns:
+            NDArray: An NDArray of lengths
+        """
+        return np.diff(self.offsets)
+
+    def to_strings(self) -> List[str]:
+        """Decode the strings
+
+        Returns:
+            List[str]: The strings
+        """
+        text = self.values.tobytes()
+        base = int(self.offsets[0])
+        bounds = (self.offsets - base).tolist()
+        return [text[bounds[i] : bounds[i + 1]].decode("utf-8") for i in range(self.size)]
 
     def as_ndarray(self) -> NDArray:
-        """Image data as an NDArray
+        """Text data as an object NDArray of strings
+
+        Returns:
+            NDArray: An NDArray of strings
+        """
+        return np.array(self.to_strings(), dtype=object)
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
 
         Returns:
-            NDArray: An NDArray of image data
+            Dict[str, Any]: A JSON serializable dict
         """
-        return self.data
+        # offsets fall on string boundaries, so the whole buffer is valid UTF-8
+        return {
+            "values": self.values.tobytes().decode("utf-8"),
+            "offsets": (self.offsets - self.offsets[0]).tolist(),
+            "size": self.size,
+        }
+
+    @classmethod
+    def load_dict(cls: Type[TextData], data: Dict[str, Any]) -> TextData:
+        """Load object from JSON
 
-    def serialize(self):
-        """Serialize data to JSON"""
-        pass
+        Args:
+            cls (Type[TextData]): the TextData class
+            data (Dict[str, Any]): the dict to create from
 
-    def load_json(self) -> "Data":
-        """Load object from JSON"""
-        pass
+        Returns:
+            TextData: A TextData object
+        """
+        values = np.frombuffer(data["values"].encode("utf-8"), dtype=np.uint8)
+        return cls(values, np.asarray(data["offsets"]), data["size"])
@@ -0,0 +1,36 @@
+import json
+
+import numpy as np
+
+from arc.data.encoding import ShapeEncoder, encode_batches, decode_batches
+from arc.data.shapes.text import TextData
+
+
+def test_text_data():
+    strings = ["hello", "", "wörld", "arc", "🙂 emoji", "last"]
+    text = TextData.from_strings(strings)
+    assert text.offsets.dtype == np.int32
+    assert text.to_strings() == strings
+    assert text[2] == "wörld" and text[-1] == "last"
+    assert list(text.lengths()) == [len(s.encode("utf-8")) for s in strings]
+
+    # slices and batches are views over the same buffers
+    batch = text.slice(2, 5)
+    assert batch.to_strings() == strings[2:5]
+    assert np.shares_memory(batch.values, text.values)
+    assert np.shares_memory(batch.offsets, text.offsets)
+    assert batch.slice(1, 3).to_strings() == strings[3:5]
+    assert [b.to_strings() for b in text.batches(4)] == [strings[:4]]
+
+    # only the batch's bytes are encoded
+    buf = batch.repr_bytes()
+    assert len(buf) < text.values.nbytes + 256
+    batch2 = TextData.load_bytes(buf, copy=False)
+    assert batch2.to_strings() == strings[2:5]
+    assert batch2[0] == "wörld"
+
+    fields, batches = decode_batches(encode_batches([{"t": batch}]), {"t": TextData}, {"t": batch.repr_static()})
+    assert batches[0]["t"].to_strings() == strings[2:5]
+
+    d = json.loads(json.dumps(batch, cls=ShapeEncoder))
+    assert TextData.load_dict(d).to_strings() == strings[2:5]
@@ -0,0 +1,196 @@
+"""Shared memory ring for streams between processes on the same host
+
+When the job and the model run on the same host, stream messages can skip the socket (and any port forward in between)
+by going through a shared memory ring, with only a small descriptor of each message sent over the websocket. The
+server creates the ring and offers it to clients that report the same host, the client proves it can see it by checking
+a nonce written at its start, and if anything doesn't match both ends keep using the socket.
+
+The ring has one writer and one reader. Message bytes are contiguous, a message that doesn't fit before the end of the
+ring starts again at the front. The reader copies each message out and advances the tail in the ring's header, which
+is what frees the space for the writer.
+"""
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+import logging
+import os
+import platform
+import struct
+
+DEFAULT_SHM_RING_BYTES = 32 * 2**20
+SHM_RING_BYTES_ENV = "ARC_SHM_RING_BYTES"
+
+_NONCE_SIZE = 16
+_TAIL = struct.Struct("<Q")
+_TAIL_OFFSET = _NONCE_SIZE
+_HEADER_SIZE = 64
+
+
+def host_id() -> str:
+    """Identify the host and IPC namespace of this process, processes with the same id can share memory
+
+    Returns:
+        str: The boot id and IPC namespace on Linux, else the node name
+    """
+    try:
+        boot_id = Path("/proc/sys/kernel/random/boot_id").read_text().strip()
+        return f"{boot_id}.{os.stat('/proc/self/ns/ipc').st_ino}"
+    except OSError:
+        return platform.node()
+
+
+class ShmRing:
+    """A single writer, single reader ring of messages in shared memory"""
+
+    def __init__(self, shm: SharedMemory, nonce: bytes, owner: bool) -> None:
+        """Wrap a shared memory segment, use `create` or `attach` instead
+
+        Args:
+            shm (SharedMemory): Segment holding the header and the ring
+            nonce (bytes): Nonce at the start of the segment
+            owner (bool): Whether this end created the segment and unlinks it on close
+        """
+        self.shm = shm
+        self.nonce = nonce
+        self.owner = owner
+        self.capacity = shm.size - _HEADER_SIZE
+        self.messages = 0
+        """Number of messages written or read"""
+        self.bytes = 0
+        """Bytes of the messages written or read"""
+        self._head = 0
+
+    @classmethod
+    def create(cls, size: int = DEFAULT_SHM_RING_BYTES) -> "ShmRing":
+        """Create a ring, as the writer
+
+        Args:
+            size (int, optional): Bytes of messages the ring holds. Defaults to DEFAULT_SHM_RING_BYTES.
+
+        Returns:
+            ShmRing: The ring
+        """
+        shm = SharedMemory(create=True, size=size + _HEADER_SIZE)
+        nonce = os.urandom(_NONCE_SIZE)
+        shm.buf[:_NONCE_SIZE] = nonce
+        _TAIL.pack_into(shm.buf, _TAIL_OFFSET, 0)
+        return cls(shm, nonce, owner=True)
+
+    @classmethod
+    def from_env(cls) -> "ShmRing":
+        """Create a ring sized by the ARC_SHM_RING_BYTES variable
+
+        Returns:
+            ShmRing: The ring
+        """
+        return cls.create(int(os.getenv(SHM_RING_BYTES_ENV, DEFAULT_SHM_RING_BYTES)))
+
+    @classmethod
+    def attach(cls, name: str, nonce: str) -> "ShmRing":
+        """Attach to a ring another process created, as the reader
+
+        Args:
+            name (str): Name of the shared memory segment
+            nonce (str): Hex nonce the creator wrote at its start
+
+        Raises:
+            FileNotFoundError: If there is no segment with the name here
+            ValueError: If the segment doesn't start with the nonce, so it isn't the same ring
+
+        Returns:
+            ShmRing: The ring
+        """
+        # the creator unlinks the segment, the reader's resource tracker would otherwise unlink it too when it exits
+        try:
+            shm = SharedMemory(name=name, track=False)  # type: ignore
+        except TypeError:  # python < 3.13 tracks every segment
+            shm = SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+        expected = bytes.fromhex(nonce)
+        if bytes(shm.buf[:_NONCE_SIZE]) != expected:
+            shm.close()
+            raise ValueError(f"shared memory {name} isn't the ring that was offered")
+        return cls(shm, expected, owner=False)
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory segment"""
+        return self.shm.name
+
+    def offer(self) -> Dict[str, Any]:
+        """Describe the ring for a reader to attach to
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict of the arguments of `attach`
+        """
+        return {"name": self.name, "nonce": self.nonce.hex()}
+
+    @property
+    def tail(self) -> int:
+        """Position up to which the reader has released messages"""
+        return _TAIL.unpack_from(self.shm.buf, _TAIL_OFFSET)[0]
+
+    def write(self, msg: Any) -> Optional[Tuple[int, int, int]]:
+        """Write a message if there is space for it
+
+        Args:
+            msg (Buffer): The message
+
+        Raises:
+            ValueError: If the message is larger than the ring
+
+        Returns:
+            Optional[Tuple[int, int, int]]: Offset, length and end position of the message to pass to `read`, or None
+                if the reader has yet to release enough space
+        """
+        msg = memoryview(msg).cast("B")
+        size = len(msg)
+        if size > self.capacity:
+            raise ValueError(f"message of {size} bytes is larger than the ring of {self.capacity}")
+
+        pos = self._head
+        offset = pos % self.capacity
+        if self.capacity - offset < size:
+            # skip to the front, the reader frees the skipped bytes along with the message
+            pos += self.capacity - offset
+            offset = 0
+        if pos + size - self.tail > self.capacity:
+            return None
+
+        start = _HEADER_SIZE + offset
+        self.shm.buf[start : start + size] = msg
+        self._head = pos + size
+        self.messages += 1
+        self.bytes += size
+        return offset, size, self._head
+
+    def read(self, desc: Sequence[int], out: Optional[memoryview] = None) -> memoryview:
+        """Copy a message out of the ring and release its space
+
+        Args:
+            desc (Sequence[int]): Offset, length and end position from `write`
+            out (memoryview, optional): Buffer of the message's length to copy into. Defaults to None, which allocates.
+
+        Returns:
+            memoryview: The message
+        """
+        offset, size, end = desc
+        if out is None:
+            out = memoryview(bytearray(size))
+        start = _HEADER_SIZE + offset
+        out[:] = self.shm.buf[start : start + size]
+        _TAIL.pack_into(self.shm.buf, _TAIL_OFFSET, end)
+        self.messages += 1
+        self.bytes += size
+        return out
+
+    def close(self) -> None:
+        """Close the ring, unlinking it on the end that created it"""
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except (BufferError, FileNotFoundError) as e:
+            logging.debug(f"error closing shared memory {self.name}: {e}")
@@ -0,0 +1,77 @@
+import multiprocessing
+import time
+
+import pytest
+
+from arc.data.shm import ShmRing, host_id
+
+
+def _message(i: int) -> bytes:
+    # sizes that don't divide the ring, so messages wrap around to the front
+    return bytes([i % 256]) * (100 + 37 * (i % 11))
+
+
+def _produce(offers, descs, n: int) -> None:
+    ring = ShmRing.create(1024)
+    offers.put(ring.offer())
+    for i in range(n):
+        desc = ring.write(_message(i))
+        while desc is None:
+            time.sleep(0.001)
+            desc = ring.write(_message(i))
+        descs.put(desc)
+    descs.put(None)
+    # the reader has the last message once it asks for the ring to go
+    offers.get()
+    ring.close()
+
+
+def test_shm_ring_processes():
+    ctx = multiprocessing.get_context("spawn")
+    offers, descs = ctx.Queue(), ctx.Queue()
+    producer = ctx.Process(target=_produce, args=(offers, descs, 200))
+    producer.start()
+    try:
+        offer = offers.get(timeout=30)
+        ring = ShmRing.attach(offer["name"], offer["nonce"])
+        got = []
+        while True:
+            desc = descs.get(timeout=30)
+            if desc is None:
+                break
+            got.append(bytes(ring.read(desc)))
+            # a slow reader makes the writer wait for space rather than overwrite
+            time.sleep(0.0005)
+        assert got == [_message(i) for i in range(200)]
+        ring.close()
+        offers.put("done")
+    finally:
+        producer.join(30)
+    assert producer.exitcode == 0
+
+
+def test_shm_ring():
+    ring = ShmRing.create(256)
+    try:
+        first = ring.write(b"a" * 200)
+        assert first == (0, 200, 200)
+        # no room until the reader releases the first message
+        assert ring.write(b"b" * 100) is None
+
+        reader = ShmRing.attach(**ring.offer())
+        assert bytes(reader.read(first)) == b"a" * 200
+        assert ring.tail == 200
+        # the message wraps to the front, skipping the last 56 bytes
+        assert ring.write(b"b" * 100) == (0, 100, 356)
+        reader.close()
+
+        with pytest.raises(ValueError):
+            ring.write(b"c" * 300)
+        with pytest.raises(ValueError):
+            ShmRing.attach(ring.name, "00" * 16)
+    finally:
+        ring.close()
+
+    with pytest.raises(FileNotFoundError):
+        ShmRing.attach(ring.name, ring.nonce.hex())
+    assert host_id() == host_id()
@@ -0,0 +1,102 @@
+"""Shuffled batches gathered from arrays by index
+
+Each epoch gets its own permutation, derived from the stream's seed and the epoch number so any epoch can be replayed
+or resumed on any replica. Batches are gathered with `np.take` into a few reused output buffers rather than permuting
+the whole dataset, so memory stays at a few batches no matter how large the (possibly memory mapped) arrays are.
+"""
+
+from typing import Dict, Iterator, List, Mapping, Optional
+
+import numpy as np
+
+from arc.data.stream import Cursor
+
+
+def epoch_permutation(n: int, seed: Optional[int], epoch: int = 0) -> np.ndarray:
+    """Order of the rows in an epoch
+
+    Args:
+        n (int): Number of rows
+        seed (int, optional): Seed of the stream, None keeps the rows in order
+        epoch (int, optional): The epoch. Defaults to 0.
+
+    Returns:
+        np.ndarray: Row indices
+    """
+    if seed is None:
+        return np.arange(n)
+    return np.random.default_rng([seed, epoch]).permutation(n)
+
+
+def num_batches(n: int, batch_size: int, drop_last: bool = True) -> int:
+    """Number of batches in an epoch
+
+    Args:
+        n (int): Number of rows
+        batch_size (int): Size of the batch
+        drop_last (bool, optional): Drop the last partial batch. Defaults to True.
+
+    Returns:
+        int: Number of batches
+    """
+    if drop_last:
+        return n // batch_size
+    return -(-n // batch_size)
+
+
+def gather_batches(
+    arrays: Mapping[str, np.ndarray],
+    batch_size: int,
+    cursor: Cursor,
+    drop_last: bool = True,
+    shard: int = 0,
+    num_shards: int = 1,
+    buffers: int = 2,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Iterate over the batches of one epoch of arrays, in the epoch's permutation
+
+    When shuffling, each batch is gathered into one of `buffers` output arrays that are reused round robin, so a batch
+    is only valid until `buffers` more have been yielded. Copy it, or encode it as the job server does, to keep it.
+    Without a seed the batches are views of the arrays.
+
+    Args:
+        arrays (Mapping[str, np.ndarray]): Arrays with the same number of rows, by name
+        batch_size (int): Size of the batch
+        cursor (Cursor): Epoch, seed and index of the first batch within the shard
+        drop_last (bool, optional): Drop the last partial batch. Defaults to True.
+        shard (int, optional): Index of the shard, which gets every `num_shards`th batch. Defaults to 0.
+        num_shards (int, optional): Number of shards. Defaults to 1.
+        buffers (int, optional): Number of output buffers to rotate through. Defaults to 2.
+
+    Raises:
+        ValueError: If the arrays have different numbers of rows
+
+    Yields:
+        Iterator[Dict[str, np.ndarray]]: Batch of each array by name
+    """
+    lengths = {len(arr) for arr in arrays.values()}
+    if len(lengths) != 1:
+        raise ValueError(f"arrays must have the same number of rows, got {sorted(lengths)}")
+    n = lengths.pop()
+
+    total = num_batches(n, batch_size, drop_last)
+    start = shard + cursor.index * num_shards
+
+    if cursor.seed is None:
+        for i in range(start, total, num_shards):
+            yield {name: arr[i * batch_size : (i + 1) * batch_size] for name, arr in arrays.items()}
+        return
+
+    perm = epoch_permutation(n, cursor.seed, cursor.epoch)
+    out: Dict[str, List[np.ndarray]] = {
+        name: [np.empty((batch_size,) + arr.shape[1:], dtype=arr.dtype) for _ in range(buffers)]
+        for name, arr in arrays.items()
+    }
+    for k, i in enumerate(range(start, total, num_shards)):
+        idx = perm[i * batch_size : (i + 1) * batch_size]
+        batch: Dict[str, np.ndarray] = {}
+        for name, arr in arrays.items():
+            buf = out[name][k % buffers][: len(idx)]
+            np.take(arr, idx, axis=0, out=buf)
+            batch[name] = buf
+        yield batch
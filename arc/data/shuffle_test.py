@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from arc.data.shuffle import epoch_permutation, gather_batches, num_batches
+from arc.data.stream import Cursor
+
+
+def test_epoch_permutation():
+    perm = epoch_permutation(100, 7)
+    assert sorted(perm) == list(range(100))
+    assert np.array_equal(perm, epoch_permutation(100, 7))
+    assert not np.array_equal(perm, epoch_permutation(100, 7, 1))
+    assert not np.array_equal(perm, epoch_permutation(100, 8))
+    assert np.array_equal(epoch_permutation(5, None), np.arange(5))
+
+    assert num_batches(10, 4) == 2
+    assert num_batches(10, 4, drop_last=False) == 3
+
+
+def test_gather_batches():
+    x = np.arange(100 * 3).reshape(100, 3)
+    y = np.arange(100)
+    cursor = Cursor(1, 42, 0)
+    perm = epoch_permutation(100, 42, 1)
+
+    batches = [{k: v.copy() for k, v in b.items()} for b in gather_batches({"x": x, "y": y}, 16, cursor)]
+    assert len(batches) == 6
+    for i, batch in enumerate(batches):
+        assert np.array_equal(batch["y"], perm[i * 16 : (i + 1) * 16])
+        assert np.array_equal(batch["x"], x[batch["y"]])
+
+    # resuming skips straight to the cursor
+    resumed = [b["y"].copy() for b in gather_batches({"y": y}, 16, cursor.advance(4))]
+    assert np.array_equal(np.concatenate(resumed), perm[64:96])
+
+    # the output buffers are reused, not allocated per batch
+    bufs = [b["y"] for b in gather_batches({"y": y}, 16, cursor, buffers=2)]
+    assert np.shares_memory(bufs[0], bufs[2]) and not np.shares_memory(bufs[0], bufs[1])
+
+    last = list(gather_batches({"y": y}, 16, cursor, drop_last=False))[-1]
+    assert np.array_equal(last["y"], perm[96:])
+
+    # shards are disjoint and together cover the epoch
+    shards = [
+        np.concatenate([b["y"].copy() for b in gather_batches({"y": y}, 10, cursor, shard=i, num_shards=3)])
+        for i in range(3)
+    ]
+    assert sorted(np.concatenate(shards)) == list(range(100))
+
+    # without a seed the batches are views in order
+    first = next(gather_batches({"x": x}, 8, Cursor()))
+    assert np.shares_memory(first["x"], x) and np.array_equal(first["x"], x[:8])
+
+    with pytest.raises(ValueError):
+        next(gather_batches({"x": x, "y": y[:10]}, 8, Cursor()))
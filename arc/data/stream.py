@@ -0,0 +1,813 @@
+"""Server side of the batch stream
+
+The job's generator runs on a worker thread (see `AsyncPrefetcher`), where the batches are also encoded and compressed,
+so the event loop stays free to serve other routes while a stream is running. Clients grant credits for the batches
+they have consumed, the server only sends while it holds credits, so a slow client can't make it buffer without bound.
+
+A `Broadcast` encodes a stream once and fans the same messages out to several clients, e.g. to train several models
+from one job.
+
+Where websockets aren't allowed, the same messages are served over plain HTTP by `/batches`, `count` batches per
+request from a cursor, each message prefixed with its length.
+
+Clients on the same host as the job can take the binary messages through a shared memory ring instead of the socket,
+see `arc.data.shm`. The websocket then only carries a descriptor of each message, its credits and the JSON messages.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+import asyncio
+import json
+import logging
+import math
+import struct
+import threading
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    from websockets.exceptions import ConnectionClosed
+except ImportError:  # uvicorn can serve websockets without the websockets package
+    ConnectionClosed = WebSocketDisconnect  # type: ignore
+
+from arc.data.compression import Compressor, compress_message
+from arc.data.encoding import Buffer, encode_batches, encode_session, pack, static_fields
+from arc.data.prefetch import AsyncPrefetcher
+from arc.data.shm import ShmRing, host_id
+from arc.data.types import Data
+
+WINDOW_PARAM = "window"
+RESUME_PARAM = "resume_from"
+SHARD_PARAM = "shard"
+NUM_SHARDS_PARAM = "num_shards"
+EPOCHS_PARAM = "epochs"
+SEED_PARAM = "seed"
+SHUFFLE_PARAM = "shuffle"
+DROP_LAST_PARAM = "drop_last"
+BROADCAST_PARAM = "broadcast"
+SUBSCRIBERS_PARAM = "subscribers"
+STRAGGLER_PARAM = "straggler"
+STRATEGY_PARAM = "strategy"
+TARGET_BYTES_PARAM = "target_bytes"
+TARGET_MS_PARAM = "target_ms"
+MIN_BATCH_SIZE_PARAM = "min_batch_size"
+MAX_BATCH_SIZE_PARAM = "max_batch_size"
+STEP_MS_KEY = "step_ms"
+BATCH_SIZE_KEY = "batch_size"
+CURSOR_PARAM = "cursor"
+COUNT_PARAM = "count"
+CREDIT_KEY = "credit"
+SHM_PARAM = "shm_host"
+SHM_KEY = "shm"
+DEFAULT_WINDOW = 16
+
+# length of each message in a `/batches` response
+_LENGTH = struct.Struct("<I")
+
+Message = Tuple[Union[bytes, Dict[str, Any]], int]
+"""An encoded websocket message and the number of batches in it"""
+
+
+@dataclass(frozen=True)
+class Cursor:
+    """Position in a job's stream, so a dropped stream can resume where it left off"""
+
+    epoch: int = 0
+    """Epoch of the stream"""
+
+    seed: Optional[int] = None
+    """Seed of the epoch's permutation, None if the job doesn't shuffle"""
+
+    index: int = 0
+    """Index of the next batch in the epoch"""
+
+    batch_size: Optional[int] = None
+    """Size of the batches `index` counts, set by streams that resize their batches"""
+
+    def advance(self, n: int = 1) -> "Cursor":
+        """Cursor n batches further on
+
+        Args:
+            n (int, optional): Number of batches. Defaults to 1.
+
+        Returns:
+            Cursor: The new cursor
+        """
+        return Cursor(self.epoch, self.seed, self.index + n, self.batch_size)
+
+    def token(self) -> str:
+        """Encode as a URL safe token e.g. `2.1234.57`, or `2.1234.57.64` with a batch size
+
+        Returns:
+            str: The token
+        """
+        seed = "" if self.seed is None else str(self.seed)
+        token = f"{self.epoch}.{seed}.{self.index}"
+        if self.batch_size is not None:
+            token += f".{self.batch_size}"
+        return token
+
+    @classmethod
+    def parse(cls, token: str) -> "Cursor":
+        """Parse a token created with `token`
+
+        Args:
+            token (str): The token
+
+        Raises:
+            ValueError: If the token is malformed
+
+        Returns:
+            Cursor: The cursor
+        """
+        try:
+            epoch, seed, index, *batch_size = token.split(".")
+            if len(batch_size) > 1:
+                raise ValueError("too many fields")
+            size = int(batch_size[0]) if batch_size else None
+            return cls(int(epoch), int(seed) if seed else None, int(index), size)
+        except ValueError:
+            raise ValueError(f"invalid stream cursor '{token}'")
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        d: Dict[str, Any] = {"epoch": self.epoch, "seed": self.seed, "index": self.index}
+        if self.batch_size is not None:
+            d["batch_size"] = self.batch_size
+        return d
+
+    @classmethod
+    def load_dict(cls, data: Dict[str, Any]) -> "Cursor":
+        """Load object from a dict
+
+        Args:
+            data (Dict[str, Any]): the dict to create from
+
+        Returns:
+            Cursor: A Cursor object
+        """
+        return cls(data.get("epoch", 0), data.get("seed"), data.get("index", 0), data.get("batch_size"))
+
+
+def encode_stream(
+    batches: Iterable[Tuple[Cursor, Data, Data]],
+    compressor: Optional[Compressor] = None,
+    batches_per_message: int = 1,
+) -> Iterator[Message]:
+    """Encode a stream of X and Y batches into websocket messages
+
+    Binary messages start with a session header and resend it whenever the static fields change. Batches are packed
+    `batches_per_message` at a time, never across epochs, and the last message carries the compression counters.
+    Without a compressor the batches are sent as JSON dicts, one per message. Each message with batches carries the
+    cursor of its first batch.
+
+    Every batch is encoded as soon as it arrives, so jobs can reuse their buffers for the next one.
+
+    Args:
+        batches (Iterable[Tuple[Cursor, Data, Data]]): Cursor, X and Y of each batch
+        compressor (Compressor, optional): Compressor for binary messages. Defaults to None, which sends JSON.
+        batches_per_message (int, optional): Number of batches in each binary message. Defaults to 1.
+
+    Yields:
+        Iterator[Message]: Each message and the number of batches in it
+    """
+    if compressor is None:
+        for cursor, x, y in batches:
+            yield {"x": x.repr_json(), "y": y.repr_json(), "end": False, "cursor": cursor.repr_json()}, 1
+        yield {"end": True}, 0
+        return
+
+    def flush(first: Cursor, pending: List[Dict[str, Data]]) -> Message:
+        msg = encode_batches(pending, end=False, cursor=first.repr_json())
+        return compress_message(compressor, msg), len(pending)
+
+    session = None
+    first = Cursor()
+    pending: List[Dict[str, Data]] = []
+    for cursor, x, y in batches:
+        batch = {"x": x, "y": y}
+        static = static_fields(batch)
+        x.repr_batch_bytes()
+        y.repr_batch_bytes()
+
+        if pending and (static != session or cursor.epoch != first.epoch):
+            yield flush(first, pending)
+            pending = []
+        if static != session:
+            session = static
+            yield encode_session(batch), 0
+
+        if not pending:
+            first = cursor
+        pending.append(batch)
+        if len(pending) >= batches_per_message:
+            yield flush(first, pending)
+            pending = []
+
+    if pending:
+        yield flush(first, pending)
+
+    stats = compressor.stats
+    logging.info(f"stream compression '{compressor.codec.name}' ratio: {stats.ratio:.2f}, seconds: {stats.seconds:.3f}")
+    yield pack({"end": True, "compression": stats.repr_json()}), 0
+
+
+class CreditWindow:
+    """Credits a client has granted for batches
+
+    The server spends a credit for each batch it sends and waits for more once they run out. A message is sent as long
+    as any credit is left, so a window smaller than the batches in a message can't deadlock.
+    """
+
+    def __init__(self, credits: int) -> None:
+        """Create a CreditWindow
+
+        Args:
+            credits (int): Initial credits, 0 or less turns flow control off but still notices disconnects
+        """
+        self.credits = credits
+        self.enabled = credits > 0
+        self.waits = 0
+        self._granted = asyncio.Event()
+        self._closed = False
+
+    def grant(self, n: int) -> None:
+        """Add credits
+
+        Args:
+            n (int): Number of batches granted
+        """
+        self.credits += n
+        self._granted.set()
+
+    @property
+    def closed(self) -> bool:
+        """Whether the client disconnected"""
+        return self._closed
+
+    def close(self) -> None:
+        """Stop waiting for credits"""
+        self._closed = True
+        self._granted.set()
+
+    async def acquire(self, n: int) -> None:
+        """Spend credits, waiting until the client grants some if none are left
+
+        Args:
+            n (int): Number of batches about to be sent
+
+        Raises:
+            ConnectionError: If the client disconnected
+        """
+        if self._closed:
+            raise ConnectionError("client disconnected")
+        if not self.enabled or n == 0:
+            return
+        if self.credits <= 0:
+            self.waits += 1
+        while self.credits <= 0:
+            if self._closed:
+                raise ConnectionError("client stopped granting credits")
+            self._granted.clear()
+            await self._granted.wait()
+        self.credits -= n
+
+    async def read(self, websocket: WebSocket, sizer: Optional["BatchSizer"] = None) -> None:
+        """Read credit messages from the client until it disconnects
+
+        Args:
+            websocket (WebSocket): The stream's websocket
+            sizer (BatchSizer, optional): Gets the step times the client reports with its credits. Defaults to None.
+        """
+        try:
+            while True:
+                msg = await websocket.receive_json()
+                self.grant(int(msg.get(CREDIT_KEY, 0)))
+                if sizer is not None and msg.get(STEP_MS_KEY) is not None and msg.get(BATCH_SIZE_KEY):
+                    sizer.observe_ms(int(msg[BATCH_SIZE_KEY]), float(msg[STEP_MS_KEY]))
+        except Exception as e:
+            logging.debug(f"stopped reading credits: {e}")
+            self.close()
+
+
+async def send_stream(
+    websocket: WebSocket, messages: AsyncIterator[Message], window: CreditWindow, ring: Optional[ShmRing] = None
+) -> None:
+    """Send encoded messages to a client as it grants credits
+
+    Args:
+        websocket (WebSocket): The stream's websocket
+        messages (AsyncIterator[Message]): Messages and the number of batches in each, from `encode_stream`
+        window (CreditWindow): Credits granted by the client
+        ring (ShmRing, optional): Shared memory ring the client accepted for binary messages, those larger than the
+            ring still go over the socket. Defaults to None.
+
+    Raises:
+        ConnectionError: If the client disconnected
+    """
+    async for msg, num_batches in messages:
+        await window.acquire(num_batches)
+        try:
+            if isinstance(msg, dict):
+                await websocket.send_json(msg)
+            elif ring is not None and len(msg) <= ring.capacity:
+                await websocket.send_json({SHM_KEY: await _write_ring(ring, msg, window)})
+            else:
+                await websocket.send_bytes(msg)
+        except (WebSocketDisconnect, ConnectionClosed) as e:
+            raise ConnectionError("client disconnected") from e
+
+
+async def _write_ring(ring: ShmRing, msg: Buffer, window: CreditWindow) -> Tuple[int, int, int]:
+    # the client frees space as it reads, which isn't signalled, so poll until it has
+    while True:
+        desc = ring.write(msg)
+        if desc is not None:
+            return desc
+        if window.closed:
+            raise ConnectionError("client disconnected")
+        await asyncio.sleep(0.001)
+
+
+async def offer_ring(websocket: WebSocket, host: Optional[str]) -> Optional[ShmRing]:
+    """Offer a client a shared memory ring for the stream, if it asked for one from the same host
+
+    The server always answers a client that sent its host, with None when it can't share memory with it, then waits
+    for the client to say whether it could attach.
+
+    Args:
+        websocket (WebSocket): The stream's websocket, before any messages are sent
+        host (str, optional): The client's `host_id`, None if it didn't send one
+
+    Raises:
+        ConnectionError: If the client disconnected
+
+    Returns:
+        Optional[ShmRing]: The ring, if the client attached to it
+    """
+    if host is None:
+        return None
+
+    ring = None
+    if host == host_id():
+        try:
+            ring = ShmRing.from_env()
+        except OSError as e:
+            logging.warning(f"could not create a shared memory ring: {e}")
+
+    try:
+        await websocket.send_json({SHM_KEY: ring.offer() if ring is not None else None})
+        if ring is None:
+            return None
+        reply = await websocket.receive_json()
+    except (WebSocketDisconnect, ConnectionClosed) as e:
+        if ring is not None:
+            ring.close()
+        raise ConnectionError("client disconnected") from e
+    if not reply.get(SHM_KEY):
+        ring.close()
+        return None
+    return ring
+
+
+async def close_stream(websocket: WebSocket, window: CreditWindow) -> None:
+    """Close a stream's websocket unless the client already has
+
+    Args:
+        websocket (WebSocket): The stream's websocket
+        window (CreditWindow): Credits granted by the client, which notice it disconnecting
+    """
+    if window.closed:
+        return
+    try:
+        await websocket.close()
+    except (WebSocketDisconnect, ConnectionClosed) as e:
+        logging.debug(f"client left before the stream was closed: {e}")
+
+
+def length_prefixed(msg: Union[Buffer, Dict]) -> bytes:
+    """Frame a message for a `/batches` response, JSON messages are serialized first
+
+    Args:
+        msg (Union[Buffer, Dict]): Message from `encode_stream`
+
+    Returns:
+        bytes: The message prefixed with its length
+    """
+    if isinstance(msg, dict):
+        msg = json.dumps(msg).encode("utf-8")
+    return _LENGTH.pack(len(msg)) + bytes(msg)
+
+
+def read_length_prefixed(read: Callable[[int], bytes]) -> Iterator[bytes]:
+    """Read length prefixed messages until the end of a response
+
+    Args:
+        read (Callable[[int], bytes]): Reads up to n bytes, e.g. `HTTPResponse.read`
+
+    Raises:
+        ConnectionError: If the response ends partway through a message
+
+    Yields:
+        Iterator[bytes]: Each message
+    """
+    while True:
+        prefix = read(_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) != _LENGTH.size:
+            raise ConnectionError("response ended inside a length prefix")
+        (size,) = _LENGTH.unpack(prefix)
+        msg = read(size)
+        if len(msg) != size:
+            raise ConnectionError(f"response ended after {len(msg)} of {size} bytes")
+        yield msg
+
+
+class BatchCount:
+    """Picks how many batches to fetch per request from the measured round trip time
+
+    Each request pays a round trip before its first batch arrives, then the batches stream in. The count is sized so
+    the round trip is about `overhead` of the request's time, estimates are moving averages over the last requests.
+    """
+
+    def __init__(
+        self,
+        count: int = 8,
+        min_count: int = 1,
+        max_count: int = 256,
+        overhead: float = 0.1,
+        smoothing: float = 0.5,
+    ) -> None:
+        """Create a BatchCount
+
+        Args:
+            count (int, optional): Count for the first request. Defaults to 8.
+            min_count (int, optional): Smallest count. Defaults to 1.
+            max_count (int, optional): Largest count. Defaults to 256.
+            overhead (float, optional): Target fraction of a request spent on the round trip. Defaults to 0.1.
+            smoothing (float, optional): Weight of the newest measurement in the averages. Defaults to 0.5.
+        """
+        if not 0 < overhead < 1:
+            raise ValueError("overhead must be between 0 and 1")
+        self.min_count = min_count
+        self.max_count = max_count
+        self.overhead = overhead
+        self.smoothing = smoothing
+        self.count = min(max(count, min_count), max_count)
+        self.rtt: Optional[float] = None
+        self.batch_seconds: Optional[float] = None
+
+    def _average(self, old: Optional[float], new: float) -> float:
+        if old is None:
+            return new
+        return self.smoothing * new + (1 - self.smoothing) * old
+
+    def update(self, batches: int, first_seconds: float, total_seconds: float) -> int:
+        """Record a request and pick the count for the next one
+
+        Args:
+            batches (int): Number of batches the request returned
+            first_seconds (float): Seconds until the first batch arrived
+            total_seconds (float): Seconds until the response ended
+
+        Returns:
+            int: Count for the next request
+        """
+        if batches > 1:
+            self.batch_seconds = self._average(self.batch_seconds, (total_seconds - first_seconds) / (batches - 1))
+        # the first batch took a round trip plus one batch's time
+        self.rtt = self._average(self.rtt, max(first_seconds - (self.batch_seconds or 0.0), 0.0))
+
+        if self.batch_seconds is None:
+            return self.count
+        if self.batch_seconds <= 0:
+            self.count = self.max_count
+            return self.count
+        count = math.ceil(self.rtt * (1 - self.overhead) / (self.overhead * self.batch_seconds))
+        self.count = min(max(count, self.min_count), self.max_count)
+        return self.count
+
+
+class BatchSizer:
+    """Resizes a stream's batches to hit a target size in bytes or a target time per training step
+
+    Costs are tracked per row as moving averages, the size is the largest that fits every target. Sizes are `min_size`
+    times a power of two, so a stream can switch size at a row offset both sizes divide, without repeating or skipping
+    rows of the epoch's permutation. Measurements can come from any thread.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        min_size: int = 1,
+        max_size: Optional[int] = None,
+        target_bytes: Optional[int] = None,
+        target_ms: Optional[float] = None,
+        smoothing: float = 0.3,
+    ) -> None:
+        """Create a BatchSizer
+
+        Args:
+            batch_size (int): Size to start at, rounded down to an allowed size
+            min_size (int, optional): Smallest size. Defaults to 1.
+            max_size (int, optional): Largest size. Defaults to None, which is 64 times `batch_size`.
+            target_bytes (int, optional): Encoded bytes per batch to aim for. Defaults to None.
+            target_ms (float, optional): Milliseconds per training step to aim for. Defaults to None.
+            smoothing (float, optional): Weight of the newest measurement in the averages. Defaults to 0.3.
+        """
+        if min_size < 1:
+            raise ValueError("min_size must be at least 1")
+        self.min_size = min_size
+        self.max_size = self._allowed(max(max_size if max_size is not None else 64 * batch_size, min_size))
+        self.target_bytes = target_bytes
+        self.target_ms = target_ms
+        self.smoothing = smoothing
+        self.bytes_per_row: Optional[float] = None
+        self.ms_per_row: Optional[float] = None
+        self.resizes = 0
+        self.size = min(self._allowed(max(batch_size, min_size)), self.max_size)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_params(cls, params: Mapping[str, str], batch_size: int) -> Optional["BatchSizer"]:
+        """Create a BatchSizer from the query parameters of a stream
+
+        Args:
+            params (Mapping[str, str]): Query parameters
+            batch_size (int): Size to start at
+
+        Returns:
+            Optional[BatchSizer]: The sizer, None if the stream has no target
+        """
+        target_bytes = params.get(TARGET_BYTES_PARAM)
+        target_ms = params.get(TARGET_MS_PARAM)
+        if not target_bytes and not target_ms:
+            return None
+        max_size = params.get(MAX_BATCH_SIZE_PARAM)
+        return cls(
+            batch_size,
+            int(params.get(MIN_BATCH_SIZE_PARAM, 1)),
+            int(max_size) if max_size else None,
+            target_bytes=int(target_bytes) if target_bytes else None,
+            target_ms=float(target_ms) if target_ms else None,
+        )
+
+    def _allowed(self, size: float) -> int:
+        # largest min_size * 2^k that is at most size
+        k = max(int(math.floor(math.log2(max(size, self.min_size) / self.min_size) + 1e-9)), 0)
+        return self.min_size * 2**k
+
+    def _average(self, old: Optional[float], new: float) -> float:
+        if old is None:
+            return new
+        return self.smoothing * new + (1 - self.smoothing) * old
+
+    def observe_bytes(self, batch_size: int, nbytes: int) -> None:
+        """Record the encoded size of a batch
+
+        Args:
+            batch_size (int): Rows in the batch
+            nbytes (int): Encoded bytes
+        """
+        if self.target_bytes is None or batch_size <= 0:
+            return
+        with self._lock:
+            self.bytes_per_row = self._average(self.bytes_per_row, nbytes / batch_size)
+            self._resize()
+
+    def observe_ms(self, batch_size: int, ms: float) -> None:
+        """Record the time a training step took on a batch
+
+        Args:
+            batch_size (int): Rows in the batch
+            ms (float): Milliseconds the step took
+        """
+        if self.target_ms is None or batch_size <= 0:
+            return
+        with self._lock:
+            self.ms_per_row = self._average(self.ms_per_row, ms / batch_size)
+            self._resize()
+
+    def _resize(self) -> None:
+        limits = []
+        if self.target_bytes is not None and self.bytes_per_row:
+            limits.append(self.target_bytes / self.bytes_per_row)
+        if self.target_ms is not None and self.ms_per_row:
+            limits.append(self.target_ms / self.ms_per_row)
+        if not limits:
+            return
+        size = min(self._allowed(min(limits)), self.max_size)
+        if size != self.size:
+            self.size = size
+            self.resizes += 1
+
+
+class StragglerPolicy(str, Enum):
+    """What a broadcast does when a subscriber falls a full ring behind"""
+
+    BLOCK = "block"
+    """Stop producing until the subscriber catches up"""
+
+    DROP = "drop"
+    """Keep producing, the subscriber skips ahead to the oldest message left and gets the session header again"""
+
+
+@dataclass
+class StreamOptions:
+    """How a client receives a stream: buffering, flow control and sharing, none of which change the batches in it"""
+
+    recv_buffers: Optional[int] = None
+    """Number of preallocated receive buffers to cycle through, a batch is only valid until `recv_buffers` more
+    messages have been received. None receives each message into a new buffer"""
+
+    batches_per_message: int = 1
+    """Number of batches the job packs into each websocket message"""
+
+    prefetch: int = 0
+    """Number of batches to receive and decode ahead on a background thread, 0 receives on the calling thread.
+    Needs `recv_buffers` to be at least `prefetch + 2` when both are set"""
+
+    window: int = DEFAULT_WINDOW
+    """Number of batches the job may send ahead of the ones consumed, 0 lets the job send as fast as it can"""
+
+    shared_memory: bool = True
+    """Take binary messages through a shared memory ring when the job runs on the same host"""
+
+    broadcast: bool = False
+    """Subscribe to a stream shared with other clients asking for the same batches, encoded once for all of them"""
+
+    subscribers: int = 1
+    """Number of broadcast subscribers the job waits for before it starts, only used by the first one"""
+
+    straggler: StragglerPolicy = StragglerPolicy.BLOCK
+    """What the broadcast does when this client falls behind"""
+
+
+@dataclass
+class Subscriber:
+    """A client subscribed to a broadcast"""
+
+    policy: StragglerPolicy
+    """What to do when it falls behind"""
+
+    cursor: int = 0
+    """Sequence number of the next message to send it"""
+
+    dropped: int = 0
+    """Number of messages it skipped"""
+
+    resync: bool = False
+    """Whether it needs the session header before its next batch"""
+
+
+class Broadcast:
+    """Encodes one stream of batches once and fans it out to many subscribers
+
+    Messages are kept in a ring of `capacity` messages shared by all subscribers, so memory is bounded by the ring no
+    matter how far apart they are. Production starts once `subscribers` clients have subscribed, so they all see the
+    stream from its first message, later subscribers join at the oldest message still in the ring.
+    """
+
+    def __init__(self, source: Callable[[], Iterator[Message]], capacity: int = 64, subscribers: int = 1) -> None:
+        """Create a Broadcast
+
+        Args:
+            source (Callable[[], Iterator[Message]]): Creates the encoded messages, run on a worker thread
+            capacity (int, optional): Number of messages kept in the ring. Defaults to 64.
+            subscribers (int, optional): Number of subscribers to wait for before producing. Defaults to 1.
+        """
+        if capacity < 1:
+            raise ValueError("broadcast capacity must be at least 1")
+        self.capacity = capacity
+        self.expected = subscribers
+        self.subscribers: List[Subscriber] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._source = source
+        self._ring: Deque[Message] = deque()
+        self._start = 0
+        self._session: Optional[Message] = None
+        self._cond = asyncio.Condition()
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def head(self) -> int:
+        """Sequence number of the next message to be produced"""
+        return self._start + len(self._ring)
+
+    def subscribe(self, policy: StragglerPolicy = StragglerPolicy.BLOCK) -> Subscriber:
+        """Add a subscriber, starting the producer once enough have joined
+
+        Args:
+            policy (StragglerPolicy, optional): What to do when it falls behind. Defaults to StragglerPolicy.BLOCK.
+
+        Returns:
+            Subscriber: The subscriber, pass it to `messages`
+        """
+        # once the session header has left the ring a late subscriber gets it before its first batch
+        sub = Subscriber(policy, cursor=self._start, resync=self._session is not None)
+        self.subscribers.append(sub)
+        if self._task is None and len(self.subscribers) >= self.expected:
+            self._task = asyncio.create_task(self._produce())
+        return sub
+
+    async def unsubscribe(self, sub: Subscriber) -> None:
+        """Remove a subscriber, stopping the producer when none are left
+
+        Args:
+            sub (Subscriber): The subscriber
+        """
+        async with self._cond:
+            if sub in self.subscribers:
+                self.subscribers.remove(sub)
+            self._cond.notify_all()
+        if not self.subscribers and self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def _has_room(self) -> bool:
+        if len(self._ring) < self.capacity:
+            return True
+        # the oldest message can go once every blocking subscriber is past it
+        return all(sub.cursor > self._start for sub in self.subscribers if sub.policy == StragglerPolicy.BLOCK)
+
+    async def _produce(self) -> None:
+        prefetcher: AsyncPrefetcher[Message] = AsyncPrefetcher(self._source, 2)
+        try:
+            async for msg in prefetcher:
+                async with self._cond:
+                    await self._cond.wait_for(self._has_room)
+                    if len(self._ring) >= self.capacity:
+                        evicted = self._ring.popleft()
+                        self._start += 1
+                        # session headers carry no batches, keep the last one evicted to resync stragglers with
+                        if evicted[1] == 0:
+                            self._session = evicted
+                    self._ring.append(msg)
+                    self._cond.notify_all()
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            prefetcher.close()
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    async def messages(self, sub: Subscriber) -> AsyncIterator[Message]:
+        """Iterate over the messages for a subscriber
+
+        Args:
+            sub (Subscriber): The subscriber
+
+        Raises:
+            RuntimeError: If the producer failed
+
+        Yields:
+            AsyncIterator[Message]: Messages and the number of batches in each
+        """
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: sub.cursor < self.head or self.done)
+                if sub.cursor < self._start:
+                    sub.dropped += self._start - sub.cursor
+                    sub.cursor = self._start
+                    sub.resync = True
+                if sub.cursor >= self.head:
+                    if self.error is not None and not isinstance(self.error, asyncio.CancelledError):
+                        raise RuntimeError("broadcast producer failed") from self.error
+                    return
+                msg = self._ring[sub.cursor - self._start]
+                resync = None
+                if sub.resync:
+                    sub.resync = False
+                    # headers go out as they are, a batch needs the session it belongs to first
+                    if msg[1] != 0:
+                        resync = self._session
+
+            if resync is not None:
+                yield resync
+            yield msg
+
+            async with self._cond:
+                sub.cursor += 1
+                self._cond.notify_all()
@@ -0,0 +1,258 @@
+import asyncio
+import io
+import json
+
+import numpy as np
+import pytest
+
+from arc.data.compression import Compressor, DeflateCodec, decompress_message
+from arc.data.encoding import decode_batches
+from arc.data.stream import (
+    BatchCount,
+    BatchSizer,
+    Broadcast,
+    CreditWindow,
+    Cursor,
+    StragglerPolicy,
+    encode_stream,
+    length_prefixed,
+    read_length_prefixed,
+)
+from arc.data.shapes.image import ImageData
+from arc.data.shapes.classes import ClassData, ClassEncoding
+
+
+def _batches(n: int, size: int = 4, cursor: Cursor = Cursor()):
+    for i in range(n):
+        x = ImageData(np.random.rand(size, 16), 4, 4, 1, size)
+        y = ClassData(np.arange(size) + i, 10, size, ClassEncoding.CATEGORICAL)
+        yield cursor, x, y
+        cursor = cursor.advance()
+
+
+def test_encode_stream():
+    msgs = list(encode_stream(_batches(5), Compressor(DeflateCodec(), min_size=0), batches_per_message=2))
+    # session header, 3 batch messages, end
+    assert [n for _, n in msgs] == [0, 2, 2, 1, 0]
+
+    session = {}
+    ys = []
+    cursors = []
+    for msg, _ in msgs:
+        fields, decoded = decode_batches(decompress_message(msg), {"x": ImageData, "y": ClassData}, session)
+        if "session" in fields:
+            session = {name: part["fields"] for name, part in fields["session"].items()}
+        if "cursor" in fields:
+            cursors.append(Cursor.load_dict(fields["cursor"]).index)
+        ys.extend(int(batch["y"].data[0]) for batch in decoded)
+    assert ys == list(range(5))
+    assert cursors == [0, 2, 4]
+    assert fields["end"] and fields["compression"]["messages"] == 3
+
+    msgs = list(encode_stream(_batches(2, cursor=Cursor(1, 7, 10))))
+    assert [n for _, n in msgs] == [1, 1, 0]
+    assert msgs[0][0]["x"]["width"] == 4 and msgs[-1][0] == {"end": True}
+    assert msgs[1][0]["cursor"] == {"epoch": 1, "seed": 7, "index": 11}
+
+    # messages never span epochs
+    epochs = list(_batches(3, cursor=Cursor(0, 7, 0))) + list(_batches(3, cursor=Cursor(1, 7, 0)))
+    msgs = list(encode_stream(epochs, Compressor(DeflateCodec(), min_size=0), batches_per_message=2))
+    assert [n for _, n in msgs] == [0, 2, 1, 2, 1, 0]
+    fields, _ = decode_batches(decompress_message(msgs[3][0]), {"x": ImageData, "y": ClassData}, session)
+    assert Cursor.load_dict(fields["cursor"]) == Cursor(1, 7, 0)
+
+
+def test_length_prefixed():
+    msgs = [msg for msg, _ in encode_stream(_batches(3), Compressor(DeflateCodec(), min_size=0))]
+    body = io.BytesIO(b"".join(length_prefixed(msg) for msg in msgs))
+    assert list(read_length_prefixed(body.read)) == [bytes(msg) for msg in msgs]
+
+    assert json.loads(next(read_length_prefixed(io.BytesIO(length_prefixed({"end": True})).read))) == {"end": True}
+
+    with pytest.raises(ConnectionError):
+        list(read_length_prefixed(io.BytesIO(length_prefixed(b"abcdef")[:-2]).read))
+
+
+def test_batch_count():
+    # a 10ms round trip next to 1ms batches needs about 90 batches to be 10% overhead
+    count = BatchCount(count=8)
+    for _ in range(10):
+        count.update(count.count, 0.011, 0.011 + 0.001 * (count.count - 1))
+    assert 80 <= count.count <= 100
+
+    count = BatchCount(max_count=32)
+    count.update(8, 0.011, 0.018)
+    assert count.count == 32
+
+    # fast round trips and slow batches need few per request
+    count = BatchCount(min_count=2)
+    count.update(8, 0.0101, 0.08)
+    assert count.count == 2
+
+
+def test_batch_sizer():
+    # sizes stay on min_size times a power of two
+    sizer = BatchSizer(100, min_size=4, target_bytes=4096)
+    assert sizer.size == 64 and sizer.max_size == 4096
+
+    # 128 bytes a row fits 32 rows in 4KiB
+    sizer.observe_bytes(64, 64 * 128)
+    assert sizer.size == 32 and sizer.resizes == 1
+    sizer.observe_bytes(32, 32 * 128)
+    assert sizer.size == 32 and sizer.resizes == 1
+
+    # the smaller of the limits wins, and sizes never pass max_size
+    sizer = BatchSizer(8, max_size=64, target_bytes=10**9, target_ms=100.0)
+    sizer.observe_ms(8, 8.0)
+    assert sizer.size == 64
+    sizer.observe_bytes(8, 8 * 10**8)
+    assert sizer.size == 8
+
+    # measurements for a target that isn't set are ignored
+    sizer = BatchSizer(16, target_ms=50.0)
+    sizer.observe_bytes(16, 10**9)
+    assert sizer.size == 16 and sizer.bytes_per_row is None
+
+    assert BatchSizer.from_params({}, 32) is None
+    sizer = BatchSizer.from_params({"target_ms": "20", "min_batch_size": "8", "max_batch_size": "128"}, 32)
+    assert (sizer.size, sizer.min_size, sizer.max_size, sizer.target_ms) == (32, 8, 128, 20.0)
+
+
+def test_cursor():
+    cursor = Cursor(2, 1234, 57)
+    assert cursor.token() == "2.1234.57"
+    assert Cursor.parse(cursor.token()) == cursor
+    assert Cursor.parse(Cursor().token()) == Cursor(0, None, 0)
+    assert cursor.advance(3) == Cursor(2, 1234, 60)
+    assert Cursor.load_dict(cursor.repr_json()) == cursor
+
+    sized = Cursor(2, 1234, 57, 16)
+    assert sized.token() == "2.1234.57.16"
+    assert Cursor.parse(sized.token()) == sized and sized.advance().batch_size == 16
+    assert Cursor.load_dict(sized.repr_json()) == sized and "batch_size" not in cursor.repr_json()
+
+    with pytest.raises(ValueError):
+        Cursor.parse("2.x")
+
+
+def test_credit_window():
+    async def run():
+        window = CreditWindow(2)
+        await window.acquire(1)
+        await window.acquire(3)
+        assert window.credits == -2
+
+        waiting = asyncio.create_task(window.acquire(1))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        window.grant(2)
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        window.grant(2)
+        await waiting
+        assert window.credits == 1 and window.waits == 1
+
+        window.credits = 0
+        waiting = asyncio.create_task(window.acquire(1))
+        await asyncio.sleep(0.01)
+        window.close()
+        with pytest.raises(ConnectionError):
+            await waiting
+
+        # disabled windows never wait
+        window = CreditWindow(0)
+        await window.acquire(100)
+
+    asyncio.run(run())
+
+
+def _messages(n: int):
+    # a session header then one batch per message, like encode_stream
+    yield b"session", 0
+    for i in range(n):
+        yield i, 1
+    yield b"end", 0
+
+
+def test_broadcast_block():
+    async def run():
+        broadcast = Broadcast(lambda: _messages(20), capacity=4, subscribers=2)
+        fast = broadcast.subscribe()
+        slow = broadcast.subscribe()
+
+        async def consume(sub, delay):
+            out = []
+            async for msg, _ in broadcast.messages(sub):
+                out.append(msg)
+                await asyncio.sleep(delay)
+            return out
+
+        outs = await asyncio.gather(consume(fast, 0), consume(slow, 0.002))
+        expected = [b"session"] + list(range(20)) + [b"end"]
+        assert outs[0] == expected and outs[1] == expected
+        assert fast.dropped == 0 and slow.dropped == 0
+
+    asyncio.run(run())
+
+
+def test_broadcast_late_subscriber():
+    async def run():
+        broadcast = Broadcast(lambda: _messages(20), capacity=4)
+        first = broadcast.subscribe()
+        out = []
+        async for msg, _ in broadcast.messages(first):
+            out.append(msg)
+            if msg == 10:
+                break
+
+        # the ring has wrapped past the session header, the late subscriber gets it before its first batch
+        late = broadcast.subscribe()
+        assert late.resync and late.cursor > 0
+
+        async def consume(sub):
+            return [msg async for msg, _ in broadcast.messages(sub)]
+
+        rest, late_out = await asyncio.gather(consume(first), consume(late))
+        # the message it stopped on wasn't acknowledged, so it comes again
+        assert out + rest[1:] == [b"session"] + list(range(20)) + [b"end"]
+        assert late_out[0] == b"session" and late_out[-1] == b"end"
+        batches = late_out[1:-1]
+        assert batches == list(range(batches[0], 20)) and batches[0] > 0
+        assert late.dropped == 0
+
+    asyncio.run(run())
+
+
+def test_broadcast_drop():
+    async def run():
+        broadcast = Broadcast(lambda: _messages(50), capacity=4, subscribers=2)
+        fast = broadcast.subscribe()
+        slow = broadcast.subscribe(StragglerPolicy.DROP)
+
+        async def consume(sub, delay):
+            out = []
+            async for msg, _ in broadcast.messages(sub):
+                out.append(msg)
+                await asyncio.sleep(delay)
+            return out
+
+        fast_out, slow_out = await asyncio.gather(consume(fast, 0.001), consume(slow, 0.01))
+        assert fast_out == [b"session"] + list(range(50)) + [b"end"]
+
+        # the straggler skipped ahead, got the session header again and still saw the end in order
+        assert slow.dropped > 0
+        assert slow_out.count(b"session") >= 2 and slow_out[-1] == b"end"
+        batches = [m for m in slow_out if isinstance(m, int)]
+        assert batches == sorted(batches) and len(batches) < 50
+
+        # everyone leaving stops the producer
+        broadcast = Broadcast(lambda: _messages(1000), capacity=2)
+        sub = broadcast.subscribe()
+        async for msg, _ in broadcast.messages(sub):
+            if msg == 3:
+                break
+        await broadcast.unsubscribe(sub)
+        await asyncio.sleep(0.05)
+        assert broadcast.done
+
+    asyncio.run(run())
@@ -2,8 +2,11 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import Any, Generic, Iterator, List, Optional, Tuple, TypeVar, Dict, Type, NewType
-from arc.data.encoding import ShapeEncoder
+from arc.data.codegen import codec_for
+from arc.data.encoding import ShapeEncoder, Buffer, Restore, WirePolicy, pack, unpack, to_wire, from_wire
+from arc.data.encoding import add_fields
 from enum import Enum
+import json
 
 import numpy as np
 from dataclasses_jsonschema import JsonSchemaMixin, DEFAULT_SCHEMA_TYPE, JsonDict, SchemaType
@@ -116,9 +119,77 @@ NDArray = np.ndarray
 
 D = TypeVar("D", bound="Data")
 
+WIRE_POLICY_SCHEMA_KEY = "x-wire-policy"
+
+
+def wire_policy_from_schema(schema: str | JsonDict) -> WirePolicy:
+    """Read the wire policy recorded in a Data JSON schema
+
+    Args:
+        schema (str | JsonDict): The schema, or its JSON string as stored in image labels
+
+    Returns:
+        WirePolicy: The wire policy, PRESERVE if the schema doesn't record one
+    """
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    if WIRE_POLICY_SCHEMA_KEY not in schema:
+        return WirePolicy()
+    return WirePolicy.load_dict(schema[WIRE_POLICY_SCHEMA_KEY])
+
 
 class Data(ABC, JsonSchemaMixin):
-    """Job data"""
+    """Job data
+
+    The binary encoding of a Data object is cached on first use and dropped whenever an attribute is reassigned, so
+    one batch can be sent to many servers while only being encoded once. Arrays must not be modified in place after
+    the object has been encoded.
+
+    Subclasses can set `wire_policy` to send floating point arrays as float16 or quantized uint8, arrays are restored
+    to their original dtype the first time they are accessed after decoding.
+
+    When streaming, only the arrays and the scalar fields named in `batch_fields` are sent with every batch, the rest
+    are sent once per stream in a session header.
+    """
+
+    # NOTE: these are left unannotated as dataclasses_jsonschema resolves the type hints of every base class
+    wire_policy = WirePolicy()
+    batch_fields = ()  # type: Tuple[str, ...]
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self.__dict__.pop("_repr_bytes", None)
+        self.__dict__.pop("_repr_batch_bytes", None)
+        self.__dict__.pop("_repr_static", None)
+        pending = self.__dict__.get("_wire_pending")
+        if pending:
+            pending.pop(name, None)
+        super().__setattr__(name, value)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called when normal lookup fails, i.e. for arrays still in their wire dtype
+        pending = self.__dict__.get("_wire_pending")
+        if not pending or name not in pending:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        arr, restore = pending.pop(name)
+        value = from_wire(arr, restore)
+        # restoring doesn't change the encoding, so bypass __setattr__ and keep the cached bytes
+        self.__dict__[name] = value
+        return value
+
+    @classmethod
+    def json_schema(cls, embeddable: bool = False, **kwargs) -> JsonDict:
+        """JSON schema for the data, including its wire policy
+
+        Args:
+            embeddable (bool, optional): Generate the schema for embedding into other schemas. Defaults to False.
+
+        Returns:
+            JsonDict: The JSON schema
+        """
+        schema = super().json_schema(embeddable=embeddable, **kwargs)
+        if not embeddable:
+            schema[WIRE_POLICY_SCHEMA_KEY] = cls.wire_policy.repr_json()
+        return schema
 
     @abstractmethod
     def as_ndarray(self) -> NDArray:
@@ -149,7 +220,10 @@ class Data(ABC, JsonSchemaMixin):
         Returns:
             Dict[str, Any]: A JSON serializable dict
         """
-        return self.__dict__
+        codec = codec_for(type(self))
+        if codec is not None:
+            return codec.repr_json(self)
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
 
     @classmethod
     def load_dict(cls: Type[Data], data: Dict[str, Any]) -> Data:
@@ -162,8 +236,145 @@ class Data(ABC, JsonSchemaMixin):
         Returns:
             Data: A Data object
         """
+        codec = codec_for(cls)
+        if codec is not None:
+            return codec.load_dict(cls, data)
         return cls(**data)
 
+    def repr_wire(self) -> Tuple[Dict[str, Any], Dict[str, NDArray]]:
+        """Split the object into scalar fields and arrays for the binary wire format
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, NDArray]]: JSON serializable fields and arrays
+        """
+        codec = codec_for(type(self))
+        if codec is not None:
+            return codec.repr_wire(self)
+
+        items = [(k, v) for k, v in self.__dict__.items() if not k.startswith("_")]
+        scalars: Dict[str, Any] = {}
+        arrays: Dict[str, NDArray] = {}
+        for name, val in items:
+            if isinstance(val, np.ndarray):
+                arrays[name] = val
+            elif isinstance(val, Enum):
+                scalars[name] = val.value
+            elif isinstance(val, np.generic):
+                scalars[name] = val.item()
+            else:
+                scalars[name] = val
+        return scalars, arrays
+
+    @classmethod
+    def load_wire(cls: Type[D], scalars: Dict[str, Any], arrays: Dict[str, NDArray]) -> D:
+        """Load object from the binary wire format
+
+        Args:
+            cls (Type[D]): A Data class
+            scalars (Dict[str, Any]): Scalar fields
+            arrays (Dict[str, NDArray]): Array fields
+
+        Returns:
+            D: A Data object
+        """
+        codec = codec_for(cls)
+        if codec is not None:
+            return codec.load_wire(cls, scalars, arrays)
+        return cls(**scalars, **arrays)
+
+    def repr_static(self) -> Dict[str, Any]:
+        """Scalar fields that are the same for every batch of a stream i.e. those not in `batch_fields`
+
+        Returns:
+            Dict[str, Any]: JSON serializable fields
+        """
+        scalars, _ = self.repr_wire()
+        return {name: val for name, val in scalars.items() if name not in self.batch_fields}
+
+    def _pack(self, batch_only: bool) -> bytes:
+        scalars, arrays = self.repr_wire()
+        if batch_only:
+            scalars = {name: val for name, val in scalars.items() if name in self.batch_fields}
+        restore: Dict[str, Restore] = {}
+        for name, arr in arrays.items():
+            arrays[name], res = to_wire(arr, self.wire_policy)
+            if res is not None:
+                restore[name] = res
+        return pack(scalars, arrays, restore=restore)
+
+    def repr_bytes(self) -> Buffer:
+        """Encode object in the binary wire format, the result is cached on the object
+
+        Returns:
+            Buffer: The packed object
+        """
+        buf = self.__dict__.get("_repr_bytes")
+        if buf is None:
+            batch, static = self.__dict__.get("_repr_batch_bytes"), self.__dict__.get("_repr_static")
+            if batch is not None and static is not None:
+                # a decoded stream batch only needs its session's static fields back, not its arrays encoded again
+                buf = add_fields(batch, static)
+            else:
+                buf = self._pack(batch_only=False)
+            self.__dict__["_repr_bytes"] = buf
+        return buf
+
+    def repr_batch_bytes(self) -> Buffer:
+        """Encode only the arrays and `batch_fields` of the object, the result is cached on the object
+
+        The static fields from `repr_static` must be passed to `load_bytes` to decode it.
+
+        Returns:
+            Buffer: The packed batch
+        """
+        buf = self.__dict__.get("_repr_batch_bytes")
+        if buf is None:
+            buf = self._pack(batch_only=True)
+            self.__dict__["_repr_batch_bytes"] = buf
+        return buf
+
+    @classmethod
+    def load_bytes(cls: Type[D], buf: Buffer, copy: bool = True, static: Optional[Dict[str, Any]] = None) -> D:
+        """Load object from the binary wire format
+
+        Args:
+            cls (Type[D]): A Data class
+            buf (Buffer): Buffer created with `repr_bytes` or `repr_batch_bytes`
+            copy (bool, optional): Copy arrays out of the buffer rather than viewing it. Defaults to True.
+            static (Dict[str, Any], optional): Static fields for a buffer created with `repr_batch_bytes`.
+                Defaults to None.
+
+        Returns:
+            D: A Data object
+        """
+        frame = unpack(buf, copy=copy)
+        lazy = cls.load_wire.__func__ is Data.load_wire.__func__  # type: ignore
+        if not lazy:
+            for name, restore in frame.restore.items():
+                frame.arrays[name] = from_wire(frame.arrays[name], restore)
+
+        scalars = frame.fields if static is None else {**static, **frame.fields}
+        data = cls.load_wire(scalars, frame.arrays)
+
+        if lazy and frame.restore:
+            pending: Dict[str, Tuple[NDArray, Restore]] = {}
+            for name, restore in frame.restore.items():
+                if hasattr(cls, name):
+                    # a class attribute would shadow __getattr__, so restore now
+                    data.__dict__[name] = from_wire(data.__dict__[name], restore)
+                else:
+                    pending[name] = (data.__dict__.pop(name), restore)
+            data.__dict__["_wire_pending"] = pending
+
+        if not copy:
+            # the arrays are views over the buffer, so it is a valid encoding for as long as they are
+            if static is None:
+                data.__dict__["_repr_bytes"] = buf
+            else:
+                data.__dict__["_repr_batch_bytes"] = buf
+                data.__dict__["_repr_static"] = static
+        return data
+
 
 class XData(Data):
     """Input data"""
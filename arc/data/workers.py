@@ -0,0 +1,334 @@
+"""Produce a job's batches on a pool of worker processes
+
+Decoding, normalizing and augmenting batches in `stream_from` is CPU bound, so a job server streaming from one thread
+is pinned to one core. `BatchWorkers` forks processes that each produce every `num_workers`th batch of an epoch, using
+the job's own sharding, and encode them into shared memory slots the server reads back in order. Batches come back as
+`encode_batch` frames, so the stream sends their bytes on without encoding them again.
+"""
+
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+
+from arc.data.encoding import decode_batch, encode_batch
+from arc.data.pipeline import PipelineStats
+from arc.data.stream import Cursor
+
+DEFAULT_SLOT_BYTES = 16 * 2**20
+BATCH_WORKERS_ENV = "ARC_BATCH_WORKERS"
+BATCH_WORKER_SLOT_BYTES_ENV = "ARC_BATCH_WORKER_SLOT_BYTES"
+
+# seconds between checks that a stream is still wanted, or a worker still alive, while blocked on a queue
+_POLL = 0.1
+
+
+@dataclass
+class WorkerStats:
+    """Counters for BatchWorkers"""
+
+    epochs: int = 0
+    """Number of epochs produced by the workers"""
+
+    batches: int = 0
+    """Number of batches read back from the workers"""
+
+    oversize: int = 0
+    """Number of batches too large for a slot, which were sent through a pipe instead"""
+
+    busy: int = 0
+    """Number of epochs produced on the calling thread because another stream had the workers"""
+
+    waits: int = 0
+    """Number of times the next batch wasn't ready"""
+
+    wait_seconds: float = 0.0
+    """Time spent waiting on the workers"""
+
+    def repr_json(self) -> Dict[str, Any]:
+        """Convert object to a JSON serializable dict
+
+        Returns:
+            Dict[str, Any]: A JSON serializable dict
+        """
+        return {
+            "epochs": self.epochs,
+            "batches": self.batches,
+            "oversize": self.oversize,
+            "busy": self.busy,
+            "waits": self.waits,
+            "wait_seconds": self.wait_seconds,
+        }
+
+
+def _worker_shard(cursor: Cursor, shard: int, num_shards: int, worker: int, num_workers: int) -> Tuple[Cursor, int]:
+    """Cursor and shard of the job's batches a worker produces
+
+    The stream wants batches `shard + (cursor.index + j) * num_shards` for j = 0, 1... and worker `k` takes every
+    `num_workers`th of them starting at j = k, which is itself a shard of `num_shards * num_workers`.
+    """
+    offset = cursor.index + worker
+    return Cursor(cursor.epoch, cursor.seed, offset // num_workers), shard + (offset % num_workers) * num_shards
+
+
+def _work(
+    job: Any,
+    worker: int,
+    tasks: Any,
+    results: Any,
+    free: Any,
+    slots: List[SharedMemory],
+    generation: Any,
+) -> None:
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        gen, args = task
+        cursor, batch_size, batch_type, shard, num_shards, drop_last, strategy, num_workers = args
+        cursor, shard = _worker_shard(cursor, shard, num_shards, worker, num_workers)
+        pipeline_runs: List[PipelineStats] = []
+        try:
+            batches = job._produce_epoch(
+                cursor, batch_size, batch_type, shard, num_shards * num_workers, drop_last, strategy, pipeline_runs
+            )
+            for x, y in batches:
+                if generation.value != gen:
+                    break
+                frame = encode_batch({"x": x, "y": y})
+
+                slot = None
+                while slot is None and generation.value == gen:
+                    try:
+                        slot = free.get(timeout=_POLL)
+                    except queue.Empty:
+                        continue
+                if slot is None:
+                    break
+
+                if len(frame) <= slots[slot].size:
+                    slots[slot].buf[: len(frame)] = frame
+                    results.put(("batch", gen, slot, len(frame)))
+                else:
+                    results.put(("bytes", gen, slot, frame))
+            # the stage timing is sent back with the end, it would otherwise stay in this process
+            results.put(("end", gen, PipelineStats.merge(pipeline_runs) if pipeline_runs else None))
+        except Exception:
+            results.put(("error", gen, traceback.format_exc()))
+
+
+class BatchWorkers:
+    """A pool of processes producing a job's batches into shared memory
+
+    Each worker has a few shared memory slots of `slot_bytes`, which bound how far it runs ahead of the stream. Batches
+    larger than a slot still work, they are pickled through the worker's result queue instead. Slots are shared memory
+    in /dev/shm, whose pages are only used once written, so it is the batch size and not `slot_bytes` that needs to fit.
+
+    Workers are forked from the server process and inherit the job, so the pool must be started before the process has
+    threads of its own e.g. on the server's startup. One stream uses the workers at a time, an epoch asked for while
+    they are busy is produced on the calling thread as usual.
+    """
+
+    def __init__(
+        self,
+        job: Any,
+        num_workers: int,
+        slots: int = 2,
+        slot_bytes: int = DEFAULT_SLOT_BYTES,
+    ) -> None:
+        """Create a BatchWorkers and start its processes
+
+        Args:
+            job (SupervisedJob): Job to produce batches of
+            num_workers (int): Number of worker processes
+            slots (int, optional): Shared memory slots per worker. Defaults to 2.
+            slot_bytes (int, optional): Size of each slot. Defaults to DEFAULT_SLOT_BYTES.
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+
+        job._resolve_types()
+        self.job = job
+        self.num_workers = num_workers
+        self.stats = WorkerStats()
+        self._classes = {"x": job.x_cls, "y": job.y_cls}
+        self._lock = threading.Lock()
+        self._gen = 0
+
+        ctx = multiprocessing.get_context("fork")
+        self._generation = ctx.Value("q", 0, lock=False)
+        self._slots: List[List[SharedMemory]] = []
+        self._tasks: List[Any] = []
+        self._results: List[Any] = []
+        self._free: List[Any] = []
+        self._procs: List[Any] = []
+        for i in range(num_workers):
+            shms = [SharedMemory(create=True, size=slot_bytes) for _ in range(slots)]
+            tasks, results, free = ctx.Queue(), ctx.Queue(), ctx.Queue()
+            for slot in range(slots):
+                free.put(slot)
+            proc = ctx.Process(
+                target=_work,
+                args=(job, i, tasks, results, free, shms, self._generation),
+                name=f"arc-batch-worker-{i}",
+                daemon=True,
+            )
+            proc.start()
+            self._slots.append(shms)
+            self._tasks.append(tasks)
+            self._results.append(results)
+            self._free.append(free)
+            self._procs.append(proc)
+
+    @classmethod
+    def from_env(cls, job: Any) -> Optional["BatchWorkers"]:
+        """Create BatchWorkers configured by the ARC_BATCH_WORKERS and ARC_BATCH_WORKER_SLOT_BYTES variables
+
+        Args:
+            job (SupervisedJob): Job to produce batches of
+
+        Returns:
+            Optional[BatchWorkers]: The workers, or None if fewer than 2 are asked for
+        """
+        num_workers = int(os.getenv(BATCH_WORKERS_ENV, 0))
+        if num_workers < 2:
+            return None
+        return cls(job, num_workers, slot_bytes=int(os.getenv(BATCH_WORKER_SLOT_BYTES_ENV, DEFAULT_SLOT_BYTES)))
+
+    def _get(self, worker: int, gen: int) -> Tuple[Any, ...]:
+        # results of an older epoch can't be left over, they are drained when it ends
+        while True:
+            try:
+                msg = self._results[worker].get(timeout=_POLL)
+            except queue.Empty:
+                if not self._procs[worker].is_alive():
+                    raise RuntimeError(f"batch worker {worker} exited with code {self._procs[worker].exitcode}")
+                continue
+            if msg[1] == gen:
+                return msg
+
+    def _read(self, worker: int, msg: Tuple[Any, ...]) -> bytes:
+        kind, _, slot, n = msg
+        if kind == "bytes":
+            self.stats.oversize += 1
+            frame = n
+        else:
+            frame = bytes(self._slots[worker][slot].buf[:n])
+        self._free[worker].put(slot)
+        return frame
+
+    def _add_runs(self, msg: Tuple[Any, ...], pipeline_runs: Optional[List[PipelineStats]]) -> None:
+        if msg[0] == "end" and msg[2] is not None and pipeline_runs is not None:
+            pipeline_runs.append(msg[2])
+
+    def epoch(
+        self,
+        cursor: Cursor,
+        batch_size: int,
+        batch_type: Any,
+        shard: int,
+        num_shards: int,
+        drop_last: bool,
+        strategy: Any,
+        pipeline_runs: Optional[List[PipelineStats]] = None,
+    ) -> Iterator[Tuple[Any, Any]]:
+        """Stream a shard of one epoch from the workers, as `SupervisedJob.stream_epochs` does for one epoch
+
+        Args:
+            cursor (Cursor): Position to start at
+            batch_size (int): Size of the batch
+            batch_type (BatchType): Type of the batch
+            shard (int): Index of the shard
+            num_shards (int): Number of shards
+            drop_last (bool): Drop the last partial batch
+            strategy (SampleStrategy): How batches are drawn
+            pipeline_runs (List[PipelineStats], optional): Collects the stage timing of each worker's pipeline run.
+                Defaults to None.
+
+        Raises:
+            RuntimeError: If a worker fails or exits
+
+        Yields:
+            Iterator[Tuple[X, Y]]: An iterator of X and Y
+        """
+        args = (cursor, batch_size, batch_type, shard, num_shards, drop_last, strategy)
+        if not self._lock.acquire(blocking=False):
+            self.stats.busy += 1
+            yield from self.job._produce_epoch(*args, pipeline_runs)
+            return
+
+        try:
+            self._gen += 1
+            gen = self._gen
+            self._generation.value = gen
+            for tasks in self._tasks:
+                tasks.put((gen, args + (self.num_workers,)))
+            self.stats.epochs += 1
+
+            ended = [False] * self.num_workers
+            try:
+                # batch j of the epoch comes from worker j % num_workers, the first one to run out ends the epoch
+                worker = 0
+                while True:
+                    start = time.perf_counter()
+                    if self._results[worker].empty():
+                        self.stats.waits += 1
+                    msg = self._get(worker, gen)
+                    self.stats.wait_seconds += time.perf_counter() - start
+                    if msg[0] == "end":
+                        ended[worker] = True
+                        self._add_runs(msg, pipeline_runs)
+                        break
+                    if msg[0] == "error":
+                        ended[worker] = True
+                        raise RuntimeError(f"batch worker {worker} failed:\n{msg[2]}")
+
+                    batch = decode_batch(self._read(worker, msg), self._classes)
+                    self.stats.batches += 1
+                    yield batch["x"], batch["y"]
+                    worker = (worker + 1) % self.num_workers
+            finally:
+                # stop the workers early and take back their slots before the next epoch
+                self._generation.value = -gen
+                for worker in range(self.num_workers):
+                    while not ended[worker]:
+                        try:
+                            msg = self._get(worker, gen)
+                        except RuntimeError as e:
+                            logging.warning(f"{e}")
+                            break
+                        if msg[0] in ("batch", "bytes"):
+                            self._read(worker, msg)
+                        else:
+                            ended[worker] = True
+                            self._add_runs(msg, pipeline_runs)
+        finally:
+            self._lock.release()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop the workers and free their shared memory
+
+        Args:
+            timeout (float, optional): Seconds to wait for each worker to exit. Defaults to 5.0.
+        """
+        self._generation.value = 0
+        for tasks in self._tasks:
+            tasks.put(None)
+        for proc in self._procs:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+        for shms in self._slots:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+        self._procs = []
+        self._slots = []
@@ -0,0 +1,187 @@
+from typing import Iterator, Tuple
+
+import numpy as np
+import pytest
+
+from arc.data.cache import FrameCache
+from arc.data.job import DEFAULT_BATCH_SIZE, SupervisedJob
+from arc.data.pipeline import Pipeline, PipelineStats
+from arc.data.shapes.classes import ClassData, ClassEncoding, SampleStrategy
+from arc.data.shapes.image import ImageData
+from arc.data.shuffle import gather_batches
+from arc.data.stream import Cursor
+from arc.data.types import BatchType
+from arc.data.workers import BatchWorkers
+
+
+class ArangeJob(SupervisedJob[ImageData, ClassData]):
+    """Rows numbered in order, so batches show where they came from"""
+
+    def __init__(self, n: int = 100) -> None:
+        self.x = np.arange(n * 4, dtype=np.float64).reshape(n, 4)
+        self.y = np.arange(n)
+
+    @property
+    def description(self) -> str:
+        return "numbered rows"
+
+    @property
+    def name(self) -> str:
+        return "Arange"
+
+    def stream(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, batch_type: BatchType = BatchType.TRAIN
+    ) -> Iterator[Tuple[ImageData, ClassData]]:
+        return self.stream_from(Cursor(), batch_size, batch_type)
+
+    def stream_from(
+        self,
+        cursor: Cursor,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        shard: int = 0,
+        num_shards: int = 1,
+        drop_last: bool = True,
+    ) -> Iterator[Tuple[ImageData, ClassData]]:
+        if self.y[0] < 0:
+            raise ValueError("bad rows")
+        arrays = {"x": self.x, "y": self.y}
+        for batch in gather_batches(arrays, batch_size, cursor, drop_last, shard, num_shards):
+            size = len(batch["y"])
+            yield ImageData(batch["x"], 2, 2, 1, size), ClassData(batch["y"], 100, size, ClassEncoding.CATEGORICAL)
+
+    def sample(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[ImageData, ClassData]:
+        return next(iter(self.stream(batch_size)))
+
+
+class PipelineJob(ArangeJob):
+    """Numbered rows batched by a pipeline"""
+
+    def stream_from(
+        self,
+        cursor: Cursor,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_type: BatchType = BatchType.TRAIN,
+        shard: int = 0,
+        num_shards: int = 1,
+        drop_last: bool = True,
+    ) -> Iterator[Tuple[ImageData, ClassData]]:
+        return (
+            Pipeline.from_arrays({"x": self.x, "y": self.y})
+            .shuffle(len(self.y))
+            .batch(batch_size, drop_last)
+            .shard(shard, num_shards)
+            .skip(cursor.index)
+            .map(
+                lambda b: (
+                    ImageData(b["x"].copy(), 2, 2, 1, len(b["y"])),
+                    ClassData(b["y"].copy(), 100, len(b["y"]), ClassEncoding.CATEGORICAL),
+                )
+            )
+            .iterate(cursor.seed, cursor.epoch)
+        )
+
+
+def _ys(job: SupervisedJob, *args, **kwargs):
+    return [y.data.tolist() for _, _, y in job.stream_epochs(*args, **kwargs)]
+
+
+def test_batch_workers():
+    job = ArangeJob()
+    cursors = [Cursor(0, 5, 0), Cursor(1, None, 3), Cursor(0, 5, 2)]
+    expected = {c: _ys(job, c, 2, 8, drop_last=False) for c in cursors}
+    sharded = _ys(job, Cursor(0, 5, 1), 2, 8, shard=1, num_shards=3)
+
+    job.batch_workers = BatchWorkers(job, 3, slots=2)
+    try:
+        # the same batches in the same order, from any cursor and shard
+        for cursor in cursors:
+            assert _ys(job, cursor, 2, 8, drop_last=False) == expected[cursor]
+        assert _ys(job, Cursor(0, 5, 1), 2, 8, shard=1, num_shards=3) == sharded
+        assert job.batch_workers.stats.batches > 0
+
+        # leaving an epoch early frees the workers for the next one
+        batches = job.stream_epochs(Cursor(0, 5, 0), 1, 8)
+        next(batches)
+        batches.close()
+        assert _ys(job, Cursor(0, 5, 0), 1, 8, drop_last=False) == expected[Cursor(0, 5, 0)][:13]
+
+        # while one stream has the workers another is produced on its own thread
+        batches = job.stream_epochs(Cursor(0, 5, 0), 1, 8)
+        next(batches)
+        assert _ys(job, Cursor(1, None, 3), 2, 8, drop_last=False) == expected[Cursor(1, None, 3)]
+        assert job.batch_workers.stats.busy == 1
+        batches.close()
+    finally:
+        job.batch_workers.close()
+
+    # batches too large for a slot go through the result queue
+    job.batch_workers = BatchWorkers(job, 2, slot_bytes=64)
+    try:
+        assert _ys(job, Cursor(0, 5, 0), 1, 8) == expected[Cursor(0, 5, 0)][:12]
+        assert job.batch_workers.stats.oversize == 12
+    finally:
+        job.batch_workers.close()
+
+    # errors come back from the workers, which are forked with the job so it is broken first
+    job.y = job.y - 1
+    job.batch_workers = BatchWorkers(job, 2)
+    try:
+        with pytest.raises(RuntimeError, match="bad rows"):
+            _ys(job, Cursor(), 1, 8)
+    finally:
+        job.batch_workers.close()
+
+
+def test_batch_workers_strategy():
+    job = ArangeJob()
+    job.class_labels = lambda batch_type=BatchType.TRAIN: job.y % 4
+    job.take = lambda idx, batch_type=BatchType.TRAIN: (
+        ImageData(job.x[idx], 2, 2, 1, len(idx)),
+        ClassData(job.y[idx], 100, len(idx), ClassEncoding.CATEGORICAL),
+    )
+    expected = _ys(job, Cursor(0, 1, 0), 1, 8, strategy=SampleStrategy.BALANCED)
+
+    job.batch_workers = BatchWorkers(job, 2)
+    try:
+        assert _ys(job, Cursor(0, 1, 0), 1, 8, strategy=SampleStrategy.BALANCED) == expected
+    finally:
+        job.batch_workers.close()
+
+
+def test_batch_workers_pipeline_stats():
+    job = PipelineJob()
+    expected = _ys(job, Cursor(0, 5, 0), 2, 8)
+
+    # each stream collects the stage timing of its own runs
+    runs, other = [], []
+    batches = job.stream_epochs(Cursor(0, 5, 0), 2, 8, pipeline_runs=runs)
+    next(batches)
+    assert _ys(job, Cursor(0, 5, 0), 1, 8, pipeline_runs=other) == expected[:12]
+    assert [y.data.tolist() for _, _, y in batches] == expected[1:]
+    assert len(runs) == 2 and len(other) == 1
+    assert PipelineStats.merge(runs).stages[-1].items == 24
+
+    # the workers send theirs back when they end an epoch
+    job.batch_workers = BatchWorkers(job, 2)
+    try:
+        runs = []
+        assert _ys(job, Cursor(0, 5, 0), 2, 8, pipeline_runs=runs) == expected
+        assert len(runs) == 4
+        merged = PipelineStats.merge(runs)
+        assert merged.stages[0].name == "from_arrays>shuffle>batch>shard>skip" and merged.stages[-1].items == 24
+    finally:
+        job.batch_workers.close()
+        job.batch_workers = None
+
+    # cached batches don't run the pipeline, the ones that weren't cached do
+    cache = FrameCache()
+    batches = job.stream_epochs(Cursor(0, 5, 0), 1, 8, cache=cache)
+    next(batches)
+    batches.close()
+    runs = []
+    assert _ys(job, Cursor(0, 5, 0), 1, 8, cache=cache, pipeline_runs=runs) == expected[:12]
+    assert len(runs) == 1 and PipelineStats.merge(runs).stages[-1].items == 11
+    runs = []
+    assert _ys(job, Cursor(0, 5, 0), 1, 8, cache=cache, pipeline_runs=runs) == expected[:12]
+    assert runs == []
@@ -1,4 +1,4 @@
-from typing import Dict, Generic, TypeVar, List, Any, Optional, Type, Union, get_args
+from typing import Dict, Generic, TypeVar, List, Any, Optional, Tuple, Type, Union, get_args
 import inspect
 import time
 import logging
@@ -29,6 +29,7 @@ from docker.auth import resolve_repository_name
 
 
 from arc.data.types import Data, EvalReport
+from arc.data.encoding import Encoded
 from arc.kube.sync import copy_file_to_pod
 from arc.image.client import default_socket
 from arc.model.util import get_orig_class
@@ -506,7 +507,7 @@ class Trainer(RuntimeGeneric, Generic[X, Y]):
                     logging.info(f"creating deployment for model {m}")
                     models.append(SupervisedModelClient[x_cls, y_cls](uri=m))
                 elif isinstance(m, SupervisedModelClient):
-                    models.append(m.uri)
+                    models.append(m)
                 elif isinstance(m, SupervisedModel):
                     logging.info(f"creating model for {m.uri}")
                     models.append(SupervisedModelClient[x_cls, y_cls](model=m))
@@ -536,8 +537,16 @@ class Trainer(RuntimeGeneric, Generic[X, Y]):
             logging.debug(f"sending x: {x}")
             logging.debug(f"sending y: {y}")
 
+            # encode the batch once per content type and compression the servers read and send it to every model
+            bodies: Dict[Tuple[str, str], Encoded] = {}
             for modl in models:
-                metrics = modl.fit(x, y)
+                if isinstance(modl, SupervisedModel):
+                    metrics = modl.fit(x, y)
+                else:
+                    key = modl.request_format()
+                    if key not in bodies:
+                        bodies[key] = modl.encode(x, y)
+                    metrics = modl.fit_encoded(bodies[key])
                 logging.info(f"model: {modl.uri} metrics: {metrics}")
 
         ret = {}
@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from dataclasses import is_dataclass, make_dataclass, field
 from enum import Enum
-from typing import Dict, Generic, TypeVar, List, Any, Optional, Type, Union
+from typing import Dict, Generic, TypeVar, List, Any, Optional, Type, Union, Mapping, Tuple
 import inspect
 import time
 import logging
@@ -45,6 +45,7 @@ from kubernetes.client import CoreV1Api, V1PodSpec, V1ObjectMeta, RbacAuthorizat
 from docker.utils.utils import parse_repository_tag
 from docker.auth import resolve_repository_name
 from urllib import request
+from urllib.error import HTTPError
 
 from arc.data.types import Data
 from arc.data.shapes.classes import ClassData
@@ -67,7 +68,23 @@ from arc.kube.pod_util import (
 from arc.config import Config, RemoteSyncStrategy
 from arc.scm import SCM
 from arc.image.registry import get_img_labels, get_repo_tags
-from arc.data.encoding import ShapeEncoder
+from arc.data.encoding import (
+    TENSOR_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    Encoded,
+    is_tensor,
+    encode_body,
+    decode_message,
+)
+from arc.data.compression import (
+    IDENTITY,
+    DEFAULT_ENCODINGS,
+    CompressionStats,
+    Compressor,
+    get_codec,
+    negotiate,
+    decompress,
+)
 from arc.kube.env import is_k8s_proc
 from arc.kube.auth_util import ensure_cluster_auth_resources, get_dockercfg_secret_name
 from arc.config import Opts
@@ -180,6 +197,12 @@ class SupervisedModelClient(Generic[X, Y], Client):
     ycls: Optional[Type[Y]] = None
     uri: Optional[str] = None
     server_addr: str
+    wire_format: str = TENSOR_CONTENT_TYPE
+    accept_encoding: str = ", ".join(DEFAULT_ENCODINGS)
+    compressor: Optional[Compressor] = None
+    sent_stats: Optional[CompressionStats] = None
+    received_stats: Optional[CompressionStats] = None
+    _request_format: Optional[Tuple[str, str]] = None
 
     def __init__(
         self,
@@ -508,6 +531,94 @@ class SupervisedModelClient(Generic[X, Y], Client):
         resp = request.urlopen(req)
         return resp.read().decode("utf-8")
 
+    def request_format(self) -> Tuple[str, str]:
+        """Content type and encoding of the request bodies this client sends
+
+        Servers advertise the content types and encodings they read in `/info`. A server that doesn't is sent
+        uncompressed JSON, as are servers that reject a body with a 415.
+
+        Returns:
+            Tuple[str, str]: The content type and the encoding
+        """
+        if self._request_format is None:
+            info = self.info()
+            accept = info.get("accept", [])
+            content_type = (
+                self.wire_format if is_tensor(self.wire_format) and TENSOR_CONTENT_TYPE in accept else JSON_CONTENT_TYPE
+            )
+            encoding = negotiate(self.accept_encoding, supported=info.get("accept-encoding", []))
+            self._request_format = (content_type, encoding)
+        return self._request_format
+
+    def _send(self, path: str, body: Encoded) -> Any:
+        headers = {
+            "content-type": body.content_type,
+            "accept": self.wire_format,
+            "accept-encoding": self.accept_encoding,
+        }
+        if body.content_encoding is not None:
+            headers["content-encoding"] = body.content_encoding
+        try:
+            resp = request.urlopen(request.Request(f"{self.server_addr}/{path}", data=body.body, headers=headers))
+        except HTTPError as e:
+            if e.code != 415 or body.parts is None or self._request_format == (JSON_CONTENT_TYPE, IDENTITY):
+                raise
+            logging.warning(f"model server can't read {body.content_type} bodies, sending uncompressed JSON")
+            self._request_format = (JSON_CONTENT_TYPE, IDENTITY)
+            return self._send(path, self._encode(body.parts))
+
+        self._stats()["sent"].record(
+            body.raw_bytes or len(body.body), len(body.body), body.seconds, body.content_encoding is not None
+        )
+        return resp
+
+    def _stats(self) -> Dict[str, CompressionStats]:
+        if self.sent_stats is None or self.received_stats is None:
+            self.sent_stats = CompressionStats()
+            self.received_stats = CompressionStats()
+        return {"sent": self.sent_stats, "received": self.received_stats}
+
+    def compression_stats(self) -> Dict[str, CompressionStats]:
+        """Compression counters for the requests sent and the responses received by this client
+
+        Bodies encoded once and sent to many models count toward the stats of every client that sent them.
+
+        Returns:
+            Dict[str, CompressionStats]: Stats for "sent" and "received"
+        """
+        return self._stats()
+
+    def encode(self, x: X, y: Optional[Y] = None) -> Encoded:
+        """Encode a batch once so it can be sent to many models with `fit_encoded`
+
+        Args:
+            x (X): Input data
+            y (Y, optional): Expected output data. Defaults to None.
+
+        Returns:
+            Encoded: The encoded batch
+        """
+        parts: Dict[str, Data] = {"x": x}
+        if y is not None:
+            parts["y"] = y
+        return self._encode(parts)
+
+    def _encode(self, parts: Mapping[str, Data]) -> Encoded:
+        content_type, encoding = self.request_format()
+        encoded = encode_body(parts, content_type)
+        if encoding == IDENTITY:
+            return encoded
+
+        if self.compressor is None or self.compressor.codec.name != encoding:
+            self.compressor = Compressor(get_codec(encoding))
+        start = time.perf_counter()
+        used, body = self.compressor.compress(encoded.body)
+        if used == IDENTITY:
+            return encoded
+        return Encoded(
+            bytes(body), encoded.content_type, used, encoded.raw_bytes, time.perf_counter() - start, encoded.parts
+        )
+
     def compile(self, x: X, y: Y) -> None:
         """Compile the model
 
@@ -515,9 +626,7 @@ class SupervisedModelClient(Generic[X, Y], Client):
             x (X): A sample of X
             y (Y): A sample of Y
         """
-        params = json.dumps({"x": x, "y": y}, cls=ShapeEncoder).encode("utf8")
-        req = request.Request(f"{self.server_addr}/compile", data=params, headers={"content-type": "application/json"})
-        resp = request.urlopen(req)
+        resp = self._send("compile", self.encode(x, y))
         resp_data = resp.read().decode("utf-8")
 
         logging.info(resp_data)
@@ -531,13 +640,22 @@ class SupervisedModelClient(Generic[X, Y], Client):
             x (X): Input data
             y (Y): Expected output data
 
+        Returns:
+            Metrics: Metrics
+        """
+        return self.fit_encoded(self.encode(x, y))
+
+    def fit_encoded(self, body: Encoded) -> Metrics:
+        """Fit a batch that was already encoded with `encode`
+
+        Args:
+            body (Encoded): The encoded X and Y
+
         Returns:
             Metrics: Metrics
         """
         # use the connection to call standardized methods
-        params = json.dumps({"x": x, "y": y}, cls=ShapeEncoder).encode("utf8")
-        req = request.Request(f"{self.server_addr}/fit", data=params, headers={"content-type": "application/json"})
-        resp = request.urlopen(req)
+        resp = self._send("fit", body)
         resp_data = resp.read().decode("utf-8")
 
         metrics = json.loads(resp_data)
@@ -552,15 +670,18 @@ class SupervisedModelClient(Generic[X, Y], Client):
         Returns:
             Y: Prediction
         """
-        params = json.dumps({"x": x}, cls=ShapeEncoder).encode("utf8")
-        req = request.Request(f"{self.server_addr}/predict", data=params, headers={"content-type": "application/json"})
-        resp = request.urlopen(req)
-        resp_data = resp.read().decode("utf-8")
+        resp = self._send("predict", self.encode(x))
+        resp_data = decompress(resp.headers.get("content-encoding"), resp.read(), self._stats()["received"])
 
         if self.ycls is None:
             orig = get_orig_class(self)
             self.xcls, self.ycls = orig.__args__
-        y = json.loads(resp_data, object_hook=lambda d: self.ycls(**d))  # type: ignore
+
+        if is_tensor(resp.headers.get("content-type")):
+            _, parts = decode_message(resp_data, {"y": self.ycls})
+            return parts["y"]
+
+        y = json.loads(bytes(resp_data).decode("utf-8"), object_hook=lambda d: self.ycls(**d))  # type: ignore
         return y
 
     @classmethod
@@ -849,11 +970,20 @@ import shutil
 
 from simple_parsing import ArgumentParser
 from starlette.applications import Starlette
-from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+from starlette.exceptions import HTTPException
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from starlette.schemas import SchemaGenerator
 import uvicorn
 
-from arc.data.encoding import ShapeEncoder
+from arc.data.encoding import (
+    ShapeEncoder,
+    TENSOR_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    is_tensor,
+    encode_message,
+    decode_message,
+)
+from arc.data.compression import CODECS, IDENTITY, compress_response, decompress
 from arc.model.metrics import Metrics
 from arc.scm import SCM
 from arc.image.build import REPO_ROOT
@@ -896,24 +1026,43 @@ schemas = SchemaGenerator(
 @app.route("/health")
 def health(request):
     return JSONResponse({{"status": "alive"}})
-kin
+
 @app.route("/info")
 def info(request):
     # model_dict = model.opts().to_dict()
-    return JSONResponse({{"name": model.__class__.__name__, "version": scm.sha(), "env-sha": scm.env_sha(), "phase": model.phase().value}})
+    return JSONResponse(
+        {{
+            "name": model.__class__.__name__,
+            "version": scm.sha(),
+            "env-sha": scm.env_sha(),
+            "phase": model.phase().value,
+            # request bodies this server reads, clients fall back to uncompressed JSON without them
+            "accept": [TENSOR_CONTENT_TYPE, JSON_CONTENT_TYPE],
+            "accept-encoding": list(CODECS),
+        }}
+    )
+
+
+async def load_parts(request) -> Dict[str, Any]:
+    classes = {{"x": {x.__name__}, "y": {y.__name__}}}
+    encoding = request.headers.get("content-encoding")
+    if encoding is not None and encoding not in CODECS:
+        raise HTTPException(415, f"unsupported content-encoding '{{encoding}}'")
+    body = decompress(encoding, await request.body())
+    if is_tensor(request.headers.get("content-type")):
+        _, parts = decode_message(body, classes)
+        return parts
+
+    jdict = json.loads(bytes(body))
+    return {{name: classes[name].load_dict(jdict[name]) for name in classes if name in jdict}}
+
 
 @app.route("/compile", methods=["POST"])
 async def compile(request):
-    jdict = await request.json()
-
-    try:
-        x = {x.__name__}.load_dict(jdict['x'])
-    except Exception as e:
-        print(e)
-        raise
-
     try:
-        y = {y.__name__}.load_dict(jdict['y'])
+        parts = await load_parts(request)
+        x = parts["x"]
+        y = parts["y"]
     except Exception as e:
         print(e)
         raise
@@ -943,10 +1092,8 @@ def load(request):
 
 @app.route("/fit", methods=["POST"])
 async def fit(request):
-    jdict = await request.json()
-    x = {x.__name__}.load_dict(jdict['x'])
-    y = {y.__name__}.load_dict(jdict['y'])
-    metrics = model.fit(x, y)
+    parts = await load_parts(request)
+    metrics = model.fit(parts["x"], parts["y"])
     return JSONResponse(metrics)
 
 class ShapeJSONResponse(JSONResponse):
@@ -955,10 +1102,12 @@ class ShapeJSONResponse(JSONResponse):
 
 @app.route("/predict", methods=["POST"])
 async def predict(request):
-    jdict = await request.json()
-    x = {x.__name__}.load_dict(jdict['x'])
-    y = model.predict(x)
-    # encode me
+    parts = await load_parts(request)
+    y = model.predict(parts["x"])
+    if is_tensor(request.headers.get("accept")):
+        encoding, body = compress_response(request.headers.get("accept-encoding"), encode_message({{"y": y}}))
+        headers = {{"content-encoding": encoding}} if encoding != IDENTITY else None
+        return Response(body, media_type=TENSOR_CONTENT_TYPE, headers=headers)
     return ShapeJSONResponse(y)
 
 @app.route("/schema")
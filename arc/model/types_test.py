@@ -1,6 +1,10 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List, Optional, Tuple
 import json
+import threading
 
 import docker
+import numpy as np
 from docker.utils.utils import parse_repository_tag
 from docker.auth import resolve_repository_name
 from opencontainers.distribution.reggie import (
@@ -13,6 +17,94 @@ from opencontainers.distribution.reggie import (
     WithDigest,
 )
 
+from arc.data.encoding import JSON_CONTENT_TYPE, TENSOR_CONTENT_TYPE
+from arc.data.shapes.classes import ClassData, ClassEncoding
+from arc.data.shapes.image import ImageData
+from arc.model.types import SupervisedModelClient
+
 
 def test_client():
     pass
+
+
+class _ModelServer(BaseHTTPRequestHandler):
+    """Records request bodies, advertising what `info` says it reads and rejecting `reject` content types"""
+
+    info: Dict[str, Any] = {}
+    reject: Optional[str] = None
+    requests: List[Tuple[str, Optional[str]]] = []
+
+    def do_GET(self):
+        self._reply(200, json.dumps(self.info).encode("utf-8"))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["content-length"]))
+        content_type = self.headers["content-type"]
+        self.requests.append((content_type, self.headers.get("content-encoding")))
+        if content_type == self.reject:
+            self._reply(415, b"unsupported")
+            return
+        self._reply(200, b'{"loss": 0.1}')
+
+    def _reply(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _model_client(server: HTTPServer) -> SupervisedModelClient:
+    client = object.__new__(SupervisedModelClient)
+    client.__orig_class__ = SupervisedModelClient[ImageData, ClassData]
+    client.server_addr = f"http://127.0.0.1:{server.server_port}"
+    return client
+
+
+def test_model_client_negotiation():
+    server = HTTPServer(("127.0.0.1", 0), _ModelServer)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    x = ImageData(np.zeros((8, 784)), 28, 28, 1, 8)
+    y = ClassData(np.zeros(8, dtype=np.int64), 10, 8, ClassEncoding.CATEGORICAL)
+    try:
+        # a server that doesn't advertise what it reads gets uncompressed JSON
+        _ModelServer.info = {"name": "old"}
+        _ModelServer.requests = []
+        assert _model_client(server).fit(x, y) == {"loss": 0.1}
+        assert _ModelServer.requests == [(JSON_CONTENT_TYPE, None)]
+
+        _ModelServer.info = {
+            "name": "new",
+            "accept": [TENSOR_CONTENT_TYPE, JSON_CONTENT_TYPE],
+            "accept-encoding": ["deflate"],
+        }
+        _ModelServer.requests = []
+        first, second = _model_client(server), _model_client(server)
+        body = first.encode(x, y)
+        assert (body.content_type, body.content_encoding) == (TENSOR_CONTENT_TYPE, "deflate")
+        first.fit_encoded(body)
+        second.fit_encoded(body)
+        assert _ModelServer.requests == [(TENSOR_CONTENT_TYPE, "deflate")] * 2
+        # a shared body counts for each client that sent it
+        for client in (first, second):
+            sent = client.compression_stats()["sent"]
+            assert sent.messages == 1 and sent.compressed == 1 and sent.raw_bytes == body.raw_bytes
+
+        # a 415 falls back to JSON for that request and the ones after it
+        _ModelServer.reject = TENSOR_CONTENT_TYPE
+        _ModelServer.requests = []
+        client = _model_client(server)
+        client.fit(x, y)
+        client.fit(x, y)
+        assert _ModelServer.requests == [
+            (TENSOR_CONTENT_TYPE, "deflate"),
+            (JSON_CONTENT_TYPE, None),
+            (JSON_CONTENT_TYPE, None),
+        ]
+        assert client.request_format() == (JSON_CONTENT_TYPE, "identity")
+    finally:
+        _ModelServer.reject = None
+        server.shutdown()